@@ -3,6 +3,7 @@ import json
 from dotenv import load_dotenv
 
 from src.llm_switcher import LLMSwitcher
+from src.rate_limit import RateLimiter
 from src.message import HumanMessage, SystemMessage, ImageMessage
 
 # Inference wrappers
@@ -42,49 +43,54 @@ for model in models_data:
         "tasks": model["tasks"],
         "price_per_1k_tokens": model["price_per_1k_tokens"],
         "free_limit_tokens": model["free_limit_tokens"],
-        "benchmark_score": model["benchmark_score"]
+        "benchmark_score": model["benchmark_score"],
+        **{key: model[key] for key in ("rpm", "tpm", "batch_price_per_1k_tokens", "cached_price_per_1k_tokens", "context_window", "max_output_tokens") if key in model}
     })
 
 # -----------------------
 # Initialize switcher
 # -----------------------
-switcher = LLMSwitcher(llms=llms, max_retries=3)
+rate_limiter = RateLimiter()
+switcher = LLMSwitcher(llms=llms, max_retries=3, rate_limiter=rate_limiter)
 
 # -----------------------
 # Example tasks
 # -----------------------
 tasks = [
-    {"prompt": "Summarize the following text: 'Artificial Intelligence is transforming the world...'", "type": "small"},
-    {"prompt": "Generate an image related to AI ethics", "type": "image"},
+    "Summarize the following text: 'Artificial Intelligence is transforming the world...'",
+    "Generate an image related to AI ethics",
 ]
 
 # -----------------------
 # Execute tasks
 # -----------------------
-for t in tasks:
+for prompt in tasks:
     print("\n========================================")
-    print(f"Task: {t['prompt']}\n")
-    messages = [SystemMessage("You are a helpful AI assistant."), HumanMessage(t["prompt"])]
+    print(f"Task: {prompt}\n")
+    messages = [SystemMessage("You are a helpful AI assistant."), HumanMessage(prompt)]
+
+    # The switcher's classifier picks the task type from the prompt
+    task_type, _ = switcher.classify_task(messages)
 
     # Filter LLMs that support this task type
-    suitable_llms = [l for l in llms if t["type"] in l["tasks"]]
+    suitable_llms = [l for l in llms if task_type in l["tasks"]]
 
     if not suitable_llms:
-        print(f"None LLM found suitable for the task: {t['type']}")
+        print(f"None LLM found suitable for the task: {task_type}")
         continue
 
     # Use switcher with only suitable LLMs
-    task_switcher = LLMSwitcher(llms=suitable_llms, max_retries=3)
+    task_switcher = LLMSwitcher(llms=suitable_llms, max_retries=3, rate_limiter=rate_limiter)
     try:
         # For image tasks, wrap prompt in ImageMessage if model supports it
-        if t["type"] == "image":
-            image_messages = [SystemMessage("You are an AI that can generate images."), ImageMessage((t["prompt"], None))]
-            response, selected_model, cost_estimate, reason = task_switcher.invoke_task(image_messages, t["type"])
+        if task_type == "image":
+            image_messages = [SystemMessage("You are an AI that can generate images."), ImageMessage((prompt, None))]
+            response, selected_model, cost_estimate, reason = task_switcher.invoke_task(image_messages, task_type)
         else:
-            response, selected_model, cost_estimate, reason = task_switcher.invoke_task(messages, t["type"])
+            response, selected_model, cost_estimate, reason = task_switcher.invoke_task(messages)
 
         print(f"--- Using LLM: {selected_model} ---")
-        print(f"Task type: {t['type']}")
+        print(f"Task type: {task_type}")
         print(f"Estimated cost: ${cost_estimate:.4f}")
         print(f"Reason for selection: {reason}\n")
         print("Response:")
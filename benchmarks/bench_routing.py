@@ -0,0 +1,94 @@
+"""Microbenchmark: routing index vs. the original sort-per-request `rank_llms`.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_routing --models 300 --requests 20000
+"""
+import argparse
+import random
+import time
+
+from src.inference import BaseInference
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, SystemMessage
+
+TASKS = ["small", "medium", "heavy", "text-generation", "code-generation"]
+PROVIDERS = ["Gemini", "OpenAI", "Groq", "Mistral"]
+
+
+class NullLLM(BaseInference):
+    def invoke(self, messages, json=False):
+        raise NotImplementedError
+
+
+def make_llms(n: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    llms = []
+    for i in range(n):
+        llm = NullLLM(model=f"model-{i}")
+        llm.name = PROVIDERS[i % len(PROVIDERS)]
+        llms.append({
+            "llm": llm,
+            "tasks": rng.sample(TASKS, rng.randint(1, 3)),
+            "price_per_1k_tokens": rng.choice([0.0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.03, 0.05, 0.06]),
+            "free_limit_tokens": rng.choice([0] * 8 + [50_000, 100_000]),
+            "benchmark_score": rng.randint(60, 100),
+        })
+    return llms
+
+
+def legacy_rank(llms: list[dict], task_type: str, token_estimate: int) -> list[dict]:
+    """The original implementation: scan, copy every candidate and sort per request."""
+    capable_llms = [l for l in llms if task_type in l["tasks"]]
+    if not capable_llms:
+        raise RuntimeError(f"No LLM available for task type '{task_type}'")
+    ranked = []
+    for l in capable_llms:
+        if token_estimate <= l["free_limit_tokens"]:
+            cost = 0.0
+        else:
+            cost = ((token_estimate - l["free_limit_tokens"]) / 1000) * l["price_per_1k_tokens"]
+        score = l["benchmark_score"] / (cost + 1e-6)
+        ranked.append({**l, "rank_score": score, "estimated_cost": cost, "token_estimate": token_estimate})
+    ranked.sort(key=lambda x: x["rank_score"], reverse=True)
+    return ranked
+
+
+def timed(fn, requests: int) -> float:
+    start = time.perf_counter()
+    for i in range(requests):
+        fn(TASKS[i % len(TASKS)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    llms = make_llms(args.models)
+    switcher = LLMSwitcher(llms=llms)
+    messages = [SystemMessage("You are a helpful AI assistant."), HumanMessage("Summarize the following text: " + "lorem ipsum " * 200)]
+
+    # Both variants rank on the same token estimate so only the ranking cost differs
+    for task_type in TASKS:
+        token_estimate = switcher.estimate_tokens(llms[0]["llm"], messages, task_type)
+        legacy = [round(r["rank_score"], 6) for r in legacy_rank(llms, task_type, token_estimate)]
+        indexed = [round(r["rank_score"], 6) for r in switcher.index.rank(task_type, lambda entry: token_estimate)]
+        assert legacy == indexed, task_type
+
+    legacy_time = timed(lambda task_type: legacy_rank(llms, task_type, 1000)[0], args.requests)
+    first_time = timed(lambda task_type: switcher.index.rank(task_type, lambda entry: 1000)[0], args.requests)
+    full_time = timed(lambda task_type: len(switcher.index.rank(task_type, lambda entry: 1000)), args.requests)
+    switcher_time = timed(lambda task_type: switcher.rank_llms(task_type, messages)[0], args.requests)
+
+    print(f"models={args.models} requests={args.requests}")
+    print(f"legacy rank_llms             {legacy_time / args.requests * 1e6:8.1f} us/request")
+    print(f"index, best candidate        {first_time / args.requests * 1e6:8.1f} us/request  ({legacy_time / first_time:.1f}x)")
+    print(f"index, full rank order       {full_time / args.requests * 1e6:8.1f} us/request  ({legacy_time / full_time:.1f}x)")
+    print(f"rank_llms with real prompt   {switcher_time / args.requests * 1e6:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
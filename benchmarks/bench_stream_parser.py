@@ -0,0 +1,127 @@
+"""Throughput benchmark: shared byte-level stream parser vs. the old per-adapter line parsing.
+
+Replays the recorded streams in benchmarks/fixtures through httpx responses
+split into network-sized reads, and compares the old `iter_lines` parsing
+(decode to str, split lines, strip `data: `, `loads`) with `iter_sse` /
+`iter_ndjson` over `iter_bytes`.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_stream_parser --repeat 50
+"""
+import argparse
+import random
+import time
+from json import loads
+from pathlib import Path
+
+import httpx
+
+from src.inference.stream_parser import iter_sse, iter_ndjson, parse_json
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def split(raw: bytes, min_read: int, max_read: int, seed: int = 0) -> list[bytes]:
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(raw):
+        size = rng.randint(min_read, max_read)
+        chunks.append(raw[i:i + size])
+        i += size
+    return chunks
+
+
+def response(chunks: list[bytes]) -> httpx.Response:
+    return httpx.Response(200, content=iter(chunks))
+
+
+def legacy_framing(chunks):
+    for line in response(chunks).iter_lines():
+        if line and not line.startswith(":") and line != "data: [DONE]":
+            yield line.replace("data: ", "")
+
+
+def shared_framing(chunks):
+    return iter_sse(response(chunks).iter_bytes())
+
+
+def shared_ndjson_framing(chunks):
+    return iter_ndjson(response(chunks).iter_bytes())
+
+
+def legacy_openai(chunks):
+    # ChatOpenAI.stream before the shared parser
+    for line in response(chunks).iter_lines():
+        if line and line.startswith("data: ") and line != "data: [DONE]":
+            yield loads(line.replace("data: ", ""))
+
+
+def legacy_gemini(chunks):
+    # ChatGemini.stream before the shared parser
+    for line in response(chunks).iter_lines():
+        if line:
+            yield loads(line.replace("data: ", ""))
+
+
+def legacy_ollama(chunks):
+    # ChatOllama.stream before the shared parser
+    for line in response(chunks).iter_lines():
+        if line:
+            yield loads(line)
+
+
+def shared_sse(chunks):
+    for data in iter_sse(response(chunks).iter_bytes()):
+        yield parse_json(data)
+
+
+def shared_ndjson(chunks):
+    for line in iter_ndjson(response(chunks).iter_bytes()):
+        yield parse_json(line)
+
+
+CASES = [
+    ("openai_chat.sse", legacy_openai, shared_sse, shared_framing),
+    ("gemini_stream.sse", legacy_gemini, shared_sse, shared_framing),
+    ("ollama_chat.ndjson", legacy_ollama, shared_ndjson, shared_ndjson_framing),
+]
+
+
+def timed(parse, chunks: list[bytes], repeat: int, rounds: int = 5) -> tuple[float, int]:
+    """Best-of-`rounds` time for `repeat` parses, which keeps scheduler noise out of the ratios."""
+    best, events = float("inf"), 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            events = sum(1 for _ in parse(chunks))
+        best = min(best, time.perf_counter() - start)
+    return best, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--min-read", type=int, default=64, help="smallest simulated socket read in bytes")
+    parser.add_argument("--max-read", type=int, default=4096, help="largest simulated socket read in bytes")
+    args = parser.parse_args()
+
+    print(f"reads={args.min_read}-{args.max_read} bytes repeat={args.repeat}")
+    for name, legacy, shared, framing in CASES:
+        raw = (FIXTURES / name).read_bytes()
+        chunks = split(raw, args.min_read, args.max_read)
+        megabytes = len(raw) * args.repeat / 1e6
+        # Framing only (no JSON decoding), then the full parse as the adapters do it
+        legacy_time, legacy_events = timed(legacy_framing, chunks, args.repeat)
+        shared_time, shared_events = timed(framing, chunks, args.repeat)
+        print(f"{name:20s} framing      legacy {megabytes / legacy_time:6.1f} MB/s  "
+              f"shared {megabytes / shared_time:6.1f} MB/s  ({legacy_time / shared_time:.2f}x)")
+        legacy_time, legacy_events = timed(legacy, chunks, args.repeat)
+        shared_time, shared_events = timed(shared, chunks, args.repeat)
+        assert legacy_events == shared_events, f"{name}: {legacy_events} != {shared_events} events"
+        print(f"{name:20s} {shared_events:4d} events  legacy {megabytes / legacy_time:6.1f} MB/s  "
+              f"shared {megabytes / shared_time:6.1f} MB/s  ({legacy_time / shared_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
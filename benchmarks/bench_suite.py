@@ -0,0 +1,353 @@
+"""End-to-end benchmarks against the local mock provider (benchmarks/mock_server.py).
+
+Scenarios:
+
+- adapters: invoke / ainvoke / stream latency and throughput for every wire format
+- switcher: `invoke_task`, `ainvoke_task`, `stream_task`, `astream_task` and their overhead over a bare adapter call
+- memory: Python heap per in-flight `ainvoke_task` and `astream_task` request (tracemalloc)
+- failover: the extra latency of a request whose first-ranked model fails, with and without circuit breakers
+
+Results are written as JSON so runs can be compared across changes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_suite --requests 200 --concurrency 32 --output bench_results.json
+    python -m benchmarks.bench_suite --scenarios failover --compare bench_results.json
+"""
+from statistics import mean
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.mock_server import MockConfig, MockServer
+from src.health import HealthMonitor
+from src.inference import ConnectionPool
+from src.inference.gemini import ChatGemini
+from src.inference.groq import ChatGroq
+from src.inference.mistral import ChatMistral
+from src.inference.ollama import ChatOllama
+from src.inference.openai import ChatOpenAI
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, SystemMessage
+
+SCENARIOS = ["adapters", "switcher", "memory", "failover"]
+MESSAGES = [SystemMessage("You are a helpful AI assistant."), HumanMessage("Summarize the following text: " + "lorem ipsum " * 50)]
+TASK = "text-generation"
+
+
+def make_pool(args) -> ConnectionPool:
+    # Enough keep-alive connections that concurrent requests do not churn them
+    return ConnectionPool(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+
+
+def make_llm(server: MockServer, provider: str, model: str, pool: ConnectionPool):
+    url = server.urls(model)[provider]
+    if provider == "openai":
+        return ChatOpenAI(model=model, api_key="mock", base_url=url, pool=pool)
+    adapter = {"groq": ChatGroq, "mistral": ChatMistral, "gemini": ChatGemini, "ollama": ChatOllama}[provider]
+    return adapter(model=model, api_key="mock", base_url=url, pool=pool)
+
+
+def entry(llm, score: int = 90) -> dict:
+    return {"llm": llm, "tasks": [TASK], "price_per_1k_tokens": 0.001, "free_limit_tokens": 0, "benchmark_score": score}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples: list[float], wall: float | None = None) -> dict:
+    """Latency percentiles in milliseconds, plus throughput when the wall time of the run is given."""
+    summary = {
+        "n": len(samples),
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "mean_ms": mean(samples) * 1000,
+    }
+    if wall is not None:
+        summary["throughput_rps"] = len(samples) / wall
+    return summary
+
+
+def run_sync(call, requests: int) -> dict:
+    call()  # warm up the connection
+    samples = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def run_sync_stream(open_stream, requests: int) -> dict:
+    """TTFT and total latency of `open_stream()` iterated to the end."""
+    for _ in open_stream():
+        pass
+    ttft, total = [], []
+    start = time.perf_counter()
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        first = None
+        for _ in open_stream():
+            if first is None:
+                first = time.perf_counter() - t0
+        ttft.append(first)
+        total.append(time.perf_counter() - t0)
+    return {"ttft": summarize(ttft), "total": summarize(total, time.perf_counter() - start)}
+
+
+async def run_async(call, requests: int, concurrency: int) -> dict:
+    await asyncio.gather(*(call() for _ in range(concurrency)))  # open the connections
+    samples = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            t0 = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def run_async_stream(open_stream, requests: int, concurrency: int) -> dict:
+    """`open_stream` is a coroutine function returning an async iterator."""
+    async def drain():
+        async for _ in await open_stream():
+            pass
+
+    await asyncio.gather(*(drain() for _ in range(concurrency)))
+    ttft, total = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            t0 = time.perf_counter()
+            first = None
+            async for _ in await open_stream():
+                if first is None:
+                    first = time.perf_counter() - t0
+            ttft.append(first)
+            total.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return {"ttft": summarize(ttft), "total": summarize(total, time.perf_counter() - start)}
+
+
+def bench_adapters(server: MockServer, args) -> dict:
+    results = {}
+    for provider in ["openai", "groq", "mistral", "gemini", "ollama"]:
+        llm = make_llm(server, provider, f"{provider}-mock", make_pool(args))
+
+        async def astream(llm=llm):
+            return llm.astream(MESSAGES)
+
+        results[provider] = {
+            "invoke": run_sync(lambda: llm.invoke(MESSAGES), args.requests),
+            "ainvoke": asyncio.run(run_async(lambda: llm.ainvoke(MESSAGES), args.requests, args.concurrency)),
+            "stream": run_sync_stream(lambda: llm.stream(MESSAGES), args.requests),
+            "astream": asyncio.run(run_async_stream(astream, args.requests, args.concurrency)),
+        }
+    return results
+
+
+def bench_switcher(server: MockServer, args) -> dict:
+    llm = make_llm(server, "openai", "switcher-mock", make_pool(args))
+    switcher = LLMSwitcher([entry(llm)])
+
+    def stream_task():
+        return switcher.stream_task(MESSAGES, TASK)[0]
+
+    async def astream_task():
+        return (await switcher.astream_task(MESSAGES, TASK))[0]
+
+    async def astream_direct():
+        return llm.astream(MESSAGES)
+
+    direct = run_sync(lambda: llm.invoke(MESSAGES), args.requests)
+    results = {
+        "invoke_task": run_sync(lambda: switcher.invoke_task(MESSAGES, TASK), args.requests),
+        "ainvoke_task": asyncio.run(run_async(lambda: switcher.ainvoke_task(MESSAGES, TASK), args.requests, args.concurrency)),
+        "stream_task": run_sync_stream(stream_task, args.requests),
+        "astream_task": asyncio.run(run_async_stream(astream_task, args.requests, args.concurrency)),
+    }
+    direct_stream = run_sync_stream(lambda: llm.stream(MESSAGES), args.requests)
+    direct_astream = asyncio.run(run_async_stream(astream_direct, args.requests, args.concurrency))
+    # Routing overhead: the same request through the switcher minus the bare adapter call
+    results["overhead_ms"] = {
+        "invoke_task": results["invoke_task"]["p50_ms"] - direct["p50_ms"],
+        "stream_task": results["stream_task"]["total"]["p50_ms"] - direct_stream["total"]["p50_ms"],
+        "astream_task": results["astream_task"]["total"]["p50_ms"] - direct_astream["total"]["p50_ms"],
+    }
+    return results
+
+
+async def _in_flight_memory(start_request, started, in_flight: int) -> dict:
+    """Start `in_flight` requests, measure the heap once all are in flight, then let them finish.
+
+    `started()` is a running count of requests that have reached the provider.
+    """
+    await start_request()  # warm up clients and lazily built state outside the measurement
+    before = started()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.ensure_future(start_request()) for _ in range(in_flight)]
+    while started() - before < in_flight:
+        await asyncio.sleep(0.01)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await asyncio.gather(*tasks)
+    return {
+        "in_flight": in_flight,
+        "bytes_per_request": (current - baseline) / in_flight,
+        "peak_bytes_per_request": (peak - baseline) / in_flight,
+    }
+
+
+def bench_memory(server: MockServer, args) -> dict:
+    slow, streaming = "memory-slow", "memory-stream"
+    # Answers stay in flight long enough for every request to be started before the snapshot
+    server.configure(slow, latency=1.0 + args.in_flight / 500)
+    server.configure(streaming, chunks=40, chunk_interval=0.05 + args.in_flight / 10_000)
+    pool = ConnectionPool(max_connections=args.in_flight + 10, max_keepalive_connections=args.in_flight + 10)
+    invoker = LLMSwitcher([entry(make_llm(server, "openai", slow, pool))])
+    streamer = LLMSwitcher([entry(make_llm(server, "openai", streaming, pool))])
+    streams_started = 0
+
+    async def invoke():
+        await invoker.ainvoke_task(MESSAGES, TASK)
+
+    async def stream():
+        nonlocal streams_started
+        chunks, _ = await streamer.astream_task(MESSAGES, TASK)
+        streams_started += 1
+        async for _ in chunks:
+            pass
+
+    async def run():
+        return {
+            "ainvoke_task": await _in_flight_memory(invoke, lambda: server.requests_by_model[slow], args.in_flight),
+            "astream_task": await _in_flight_memory(stream, lambda: streams_started, args.in_flight),
+        }
+
+    return asyncio.run(run())
+
+
+def bench_failover(server: MockServer, args) -> dict:
+    server.configure("broken", error_rate=1.0)
+    server.configure("flaky", chunks=20, fail_after_chunks=10)
+    pool = make_pool(args)
+    healthy = make_llm(server, "openai", "healthy", pool)
+    broken = make_llm(server, "openai", "broken", pool)
+    flaky = make_llm(server, "openai", "flaky", pool)
+    # Breakers that never open and scores that never drop, so every request pays for the failed model
+    no_breaker = lambda: HealthMonitor(failure_threshold=10**9, error_rate_threshold=2.0, alpha=0.0)
+
+    baseline = LLMSwitcher([entry(healthy)], health=no_breaker())
+    failing = LLMSwitcher([entry(broken, score=100), entry(healthy)], health=no_breaker())
+    breaker = LLMSwitcher([entry(broken, score=100), entry(healthy)])
+    mid_stream = LLMSwitcher([entry(flaky, score=100), entry(healthy)], health=no_breaker())
+
+    def stream(switcher):
+        return lambda: switcher.stream_task(MESSAGES, TASK)[0]
+
+    before = server.requests_by_model["broken"]
+    results = {
+        "healthy": run_sync(lambda: baseline.invoke_task(MESSAGES, TASK), args.requests),
+        "failover": run_sync(lambda: failing.invoke_task(MESSAGES, TASK), args.requests),
+    }
+    results["failed_attempts_per_request"] = (server.requests_by_model["broken"] - before) / (args.requests + 1)
+    results["with_breaker"] = run_sync(lambda: breaker.invoke_task(MESSAGES, TASK), args.requests)
+    results["stream_healthy"] = run_sync_stream(stream(baseline), args.requests)
+    results["stream_mid_failover"] = run_sync_stream(stream(mid_stream), args.requests)
+    results["cost_ms"] = {
+        "invoke_failover": results["failover"]["p50_ms"] - results["healthy"]["p50_ms"],
+        "invoke_with_breaker_mean": results["with_breaker"]["mean_ms"] - results["healthy"]["mean_ms"],
+        "stream_mid_failover": results["stream_mid_failover"]["total"]["p50_ms"] - results["stream_healthy"]["total"]["p50_ms"],
+    }
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict):
+    """Print every metric present in both runs with its relative change."""
+    old = flatten(baseline["results"])
+    print(f"{'metric':<60}{'baseline':>14}{'current':>14}{'change':>10}")
+    for key, value in flatten(current["results"]).items():
+        if key in old and not key.endswith(".n"):
+            change = f"{(value - old[key]) / abs(old[key]) * 100:+.1f}%" if old[key] else ""
+            print(f"{key:<60}{old[key]:>14.3f}{value:>14.3f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--in-flight", type=int, default=200, help="concurrent requests in the memory scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server latency before each answer (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, default=20, help="streamed chunks per answer")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # The failover scenario fails on purpose; keep its warnings out of the report
+    logging.getLogger("src").setLevel(logging.ERROR)
+    config = MockConfig(latency=args.latency, jitter=args.jitter, chunks=args.chunks, chunk_interval=args.chunk_interval)
+    benches = {"adapters": bench_adapters, "switcher": bench_switcher, "memory": bench_memory, "failover": bench_failover}
+    results = {}
+    with MockServer(config) as server:
+        for name in args.scenarios:
+            start = time.perf_counter()
+            results[name] = benches[name](server, args)
+            print(f"{name}: {time.perf_counter() - start:.1f}s")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Local mock LLM provider speaking the wire formats the adapters use.
+
+Serves, on one port:
+
+- OpenAI / Groq / Mistral: POST .../chat/completions (JSON or SSE with "stream": true), GET .../models
+- Gemini: POST .../models/{model}:generateContent and :streamGenerateContent?alt=sse, GET .../models,
+  and context caches (POST .../cachedContents, PATCH / DELETE .../cachedContents/{id})
+- Ollama: POST /api/chat (JSON or NDJSON with "stream": true)
+
+Latency, error rate and stream cadence are configurable globally and per model,
+so a benchmark can make one model slow or broken and another healthy. Point an
+adapter at it with `base_url` (see `MockServer.urls`).
+
+Standalone:
+
+    python -m benchmarks.mock_server --port 8089 --latency 0.05 --chunks 20 --chunk-interval 0.01
+"""
+from dataclasses import dataclass, replace
+from collections import Counter
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import json
+import random
+import threading
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.0  # seconds before the response (or the first chunk) is sent
+    jitter: float = 0.0  # uniform extra latency in [0, jitter)
+    error_rate: float = 0.0  # share of requests answered with `error_status`
+    error_status: int = 500
+    chunks: int = 20  # streamed chunks per answer
+    chunk_interval: float = 0.0  # seconds between streamed chunks
+    chunk_text: str = "token "
+    fail_after_chunks: int | None = None  # break the connection mid-stream after this many chunks
+
+
+REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class MockServer:
+    """Asyncio HTTP/1.1 server with keep-alive, run on a daemon thread by `start()`."""
+    def __init__(self, config: MockConfig | None = None, models: dict[str, MockConfig] | None = None,
+                 host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+        self.config = config or MockConfig()
+        self.models = models or {}
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.requests_by_model: Counter[str] = Counter()
+        # Context cache calls by method (POST creates, PATCH extends, DELETE deletes)
+        self.cache_requests: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def urls(self, model: str) -> dict[str, str]:
+        """`base_url` for each adapter, as they expect it."""
+        return {
+            "openai": f"{self.base_url}/v1",
+            "groq": f"{self.base_url}/openai/v1/chat/completions",
+            "mistral": f"{self.base_url}/v1/chat/completions",
+            "gemini": f"{self.base_url}/v1beta/models/{model}:generateContent",
+            "ollama": f"{self.base_url}/api/chat",
+        }
+
+    def configure(self, model: str | None = None, **changes):
+        """Change the global config, or one model's, while the server runs."""
+        if model is None:
+            self.config = replace(self.config, **changes)
+        else:
+            self.models[model] = replace(self.models.get(model, self.config), **changes)
+
+    def start(self) -> "MockServer":
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, backlog=1024))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="mock-llm-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+    async def _shutdown(self):
+        self._server.close()
+        # Close keep-alive connections the clients left open; their handlers then see EOF and return
+        for writer in list(self._connections):
+            writer.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if handlers:
+            await asyncio.wait(handlers, timeout=1.0)
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                keep_alive = await self._respond(writer, method, target, body)
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def _config_for(self, model: str) -> MockConfig:
+        return self.models.get(model, self.config)
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, target: str, body: bytes) -> bool:
+        url = urlsplit(target)
+        path = url.path
+        if "/cachedContents" in path:
+            await self._cached_contents(writer, method, path, body)
+            return True
+        if method == "GET" and path.endswith("/models"):
+            await self._send_json(writer, 200, {"data": [{"id": m, "active": True} for m in self.models] or [{"id": "mock", "active": True}],
+                                                 "models": [{"displayName": m} for m in self.models] or [{"displayName": "mock"}]})
+            return True
+        if method != "POST":
+            await self._send_json(writer, 404, {"error": {"message": f"No route for {method} {path}"}})
+            return True
+        request = json.loads(body or b"{}")
+        if path.endswith("/chat/completions"):
+            wire, model, stream = "openai", request.get("model", ""), bool(request.get("stream"))
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            # A `base_url` override is used for both methods; streams are marked by alt=sse
+            wire, model, stream = "gemini", path.rsplit("/", 1)[-1].split(":")[0], "alt=sse" in url.query
+        elif path.endswith("/api/chat"):
+            wire, model, stream = "ollama", request.get("model", ""), bool(request.get("stream"))
+        else:
+            await self._send_json(writer, 404, {"error": {"message": f"No route for {path}"}})
+            return True
+
+        self.requests_by_model[model] += 1
+        config = self._config_for(model)
+        delay = config.latency + (self._random.random() * config.jitter if config.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if config.error_rate and self._random.random() < config.error_rate:
+            await self._send_json(writer, config.error_status, {"error": {"message": "mock upstream error", "code": config.error_status}})
+            return True
+        if not stream:
+            await self._send_json(writer, 200, self._answer(wire, model, config))
+            return True
+        return await self._stream(writer, wire, model, config)
+
+    async def _cached_contents(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes):
+        self.cache_requests[method] += 1
+        if method == "POST":
+            request = json.loads(body or b"{}")
+            name = f"cachedContents/mock-{self.cache_requests['POST']}"
+            await self._send_json(writer, 200, {"name": name, "model": request.get("model", ""), "ttl": request.get("ttl", "3600s")})
+        elif method == "DELETE":
+            await self._send_json(writer, 200, {})
+        else:
+            await self._send_json(writer, 200, {"name": "cachedContents/" + path.rsplit("/", 1)[-1]})
+
+    def _answer(self, wire: str, model: str, config: MockConfig) -> dict:
+        text = config.chunk_text * config.chunks
+        usage = {"prompt_tokens": 10, "completion_tokens": config.chunks, "total_tokens": 10 + config.chunks}
+        if wire == "openai":
+            return {"id": "mock", "object": "chat.completion", "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}], "usage": usage}
+        if wire == "gemini":
+            return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": config.chunks, "totalTokenCount": 10 + config.chunks}}
+        return {"model": model, "message": {"role": "assistant", "content": text}, "done": True,
+                "prompt_eval_count": 10, "eval_count": config.chunks}
+
+    def _chunk(self, wire: str, model: str, config: MockConfig) -> bytes:
+        if wire == "openai":
+            event = {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": config.chunk_text}, "finish_reason": None}]}
+            return b"data: " + json.dumps(event).encode() + b"\n\n"
+        if wire == "gemini":
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": config.chunk_text}]}}]}
+            return b"data: " + json.dumps(event).encode() + b"\r\n\r\n"
+        return json.dumps({"model": model, "message": {"role": "assistant", "content": config.chunk_text}, "done": False}).encode() + b"\n"
+
+    def _end(self, wire: str, model: str) -> bytes:
+        if wire == "openai":
+            return b"data: [DONE]\n\n"
+        if wire == "ollama":
+            return json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                               "prompt_eval_count": 10, "eval_count": 0}).encode() + b"\n"
+        return b""
+
+    async def _stream(self, writer: asyncio.StreamWriter, wire: str, model: str, config: MockConfig) -> bool:
+        content_type = "application/x-ndjson" if wire == "ollama" else "text/event-stream"
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n".encode())
+        for i in range(config.chunks):
+            if i and config.chunk_interval:
+                await asyncio.sleep(config.chunk_interval)
+            if config.fail_after_chunks is not None and i >= config.fail_after_chunks:
+                await writer.drain()
+                # Drop the connection without the terminating chunk
+                writer.transport.abort()
+                return False
+            data = self._chunk(wire, model, config)
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+        end = self._end(wire, model)
+        if end:
+            writer.write(b"%x\r\n%s\r\n" % (len(end), end))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--chunk-interval", type=float, default=0.0)
+    args = parser.parse_args()
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        chunks=args.chunks, chunk_interval=args.chunk_interval)
+    server = MockServer(config, host=args.host, port=args.port)
+    print(f"Mock LLM server on {server.base_url}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+from typing import Callable, Iterable
+import asyncio
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSlots:
+    """Per-model in-flight request limits for a batch run.
+
+    A job takes a slot on the best-ranked model that has one free, so work is
+    packed onto the preferred models up to their limits and spills over to the
+    next ones instead of queueing behind them.
+    """
+    def __init__(self, limit_for: Callable[[dict], int]):
+        self.limit_for = limit_for
+        self._in_flight: dict[int, int] = {}
+        self._freed = asyncio.Event()
+
+    def has_room(self, entry: dict) -> bool:
+        return self._in_flight.get(id(entry), 0) < self.limit_for(entry)
+
+    def take(self, entry: dict):
+        self._in_flight[id(entry)] = self._in_flight.get(id(entry), 0) + 1
+
+    def release(self, entry: dict):
+        self._in_flight[id(entry)] -= 1
+        self._freed.set()
+
+    async def wait(self, timeout: float | None = None):
+        """Wait until some slot is released, or `timeout` seconds pass."""
+        self._freed.clear()
+        try:
+            await asyncio.wait_for(self._freed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class Checkpoint:
+    """Append-only JSONL record of finished batch jobs, keyed by job index.
+
+    Every finished job is written and flushed as its own line, so after a crash
+    at most the jobs that were in flight are lost. A partially written last
+    line is ignored on load.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.done: dict[int, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.done[record["index"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.done
+
+    def write(self, index: int, result: tuple[str, str, float, str]):
+        content, model, cost, reason = result
+        record = {"index": index, "content": content, "model": model, "cost": cost, "reason": reason}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.done[index] = record
+
+    def close(self):
+        self._file.close()
+
+
+def pending_jobs(jobs: Iterable[tuple], checkpoint: Checkpoint | None) -> Iterable[tuple[int, tuple]]:
+    """(index, job) for every job not already in the checkpoint, read lazily."""
+    for index, job in enumerate(jobs):
+        if checkpoint is None or index not in checkpoint:
+            yield index, job
+
+
+class DeferredBatch:
+    """Jobs handed to provider batch endpoints by `LLMSwitcher.submit_deferred`.
+
+    There is one provider batch per model. `poll` checks the unfinished ones
+    and collects their answers once they are done; `collect` polls until all
+    are. `state()` is JSON-serializable, so a batch that runs for hours can be
+    picked up by another process with `LLMSwitcher.resume_deferred`.
+    """
+    def __init__(self, json: bool = False):
+        self.json = json
+        self.batches: list[dict] = []
+        self._results: dict[int, tuple[str, str, float, str] | Exception] = {}
+        self._rejected: dict[int, str] = {}
+
+    def add(self, llm, batch_id: str, jobs: dict[str, tuple[int, float, str]]):
+        """Track a submitted provider batch; `jobs` maps custom id to (index, estimated_cost, reason)."""
+        self.batches.append({"llm": llm, "batch_id": batch_id, "jobs": jobs, "done": False})
+
+    def fail(self, index: int, error: Exception):
+        """Record a job that could not be submitted to any model."""
+        self._results[index] = error
+        self._rejected[index] = str(error)
+
+    @property
+    def done(self) -> bool:
+        return all(batch["done"] for batch in self.batches)
+
+    def poll(self) -> bool:
+        """Collect the answers of batches that finished since the last poll; True once all have."""
+        for batch in self.batches:
+            if batch["done"]:
+                continue
+            llm = batch["llm"]
+            try:
+                status = llm.batch_status(batch["batch_id"])
+                if not status["done"]:
+                    continue
+                answers = llm.batch_results(batch["batch_id"], self.json)
+            except Exception as e:
+                logger.warning("Batch polling error with %s: %s", llm.model, e)
+                continue
+            for custom_id, (index, cost, reason) in batch["jobs"].items():
+                answer = answers.get(custom_id)
+                if answer is None:
+                    self._results[index] = RuntimeError(f"{llm.model} batch {batch['batch_id']} ended {status['state']} without an answer")
+                elif isinstance(answer, Exception):
+                    self._results[index] = answer
+                else:
+                    self._results[index] = (answer.content, llm.model, cost, reason)
+            batch["done"] = True
+        return self.done
+
+    def results(self) -> dict[int, tuple[str, str, float, str] | Exception]:
+        """Results collected so far by job index: (content, model, estimated_cost, reason) or the error."""
+        return dict(sorted(self._results.items()))
+
+    def collect(self, poll_interval: float = 60.0, timeout: float | None = None) -> dict[int, tuple[str, str, float, str] | Exception]:
+        """Poll every `poll_interval` seconds until all batches are done and return `results()`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.poll():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Deferred batch not finished within {timeout}s")
+            time.sleep(poll_interval)
+        return self.results()
+
+    async def acollect(self, poll_interval: float = 60.0, timeout: float | None = None) -> dict[int, tuple[str, str, float, str] | Exception]:
+        """Async counterpart of `collect`; polls in a worker thread."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await asyncio.to_thread(self.poll):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Deferred batch not finished within {timeout}s")
+            await asyncio.sleep(poll_interval)
+        return self.results()
+
+    def state(self) -> dict:
+        """Provider batch ids and job mapping for `LLMSwitcher.resume_deferred`.
+
+        Answers are fetched again from the provider on resume, so besides the ids
+        only the jobs that were never submitted are stored.
+        """
+        return {
+            "json": self.json,
+            "batches": [
+                {"provider": batch["llm"].name, "model": batch["llm"].model, "batch_id": batch["batch_id"],
+                 "jobs": {custom_id: list(job) for custom_id, job in batch["jobs"].items()}}
+                for batch in self.batches
+            ],
+            "failed": {str(index): error for index, error in self._rejected.items()},
+        }
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from hashlib import sha256
+from typing import Any
+import threading
+import sqlite3
+import json
+import time
+
+from src.message import BaseMessage
+
+
+def make_key(messages: list[BaseMessage], task_type: str, model: str, temperature: float, json_output: bool = False) -> str:
+    """Stable cache key for a request, built from the normalized message list and model params."""
+    normalized = json.dumps(
+        [[message.to_dict() for message in messages], task_type, model, temperature, json_output],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(ABC):
+    def __init__(self, ttl: float | None = 3600.0, allow_nondeterministic: bool = False):
+        """
+        Args:
+            ttl (float | None): Seconds a response stays valid. None keeps entries until evicted.
+            allow_nondeterministic (bool): Also cache responses generated with temperature > 0.
+        """
+        self.ttl = ttl
+        self.allow_nondeterministic = allow_nondeterministic
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.allow_nondeterministic or temperature == 0
+
+    def get(self, key: str) -> Any | None:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_first(self, keys: list[str]) -> tuple[int, Any] | None:
+        """(position, value) of the first of `keys` that is cached; counts one hit or miss for the whole lookup."""
+        for position, key in enumerate(keys):
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return position, value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self._set(key, value, expires_at)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+        }
+
+    @abstractmethod
+    def _get(self, key: str) -> Any | None:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: Any, expires_at: float | None):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class InMemoryCache(ResponseCache):
+    """LRU cache with per-entry TTL, kept in process memory."""
+    def __init__(self, max_size: int = 1024, ttl: float | None = 3600.0, allow_nondeterministic: bool = False):
+        super().__init__(ttl=ttl, allow_nondeterministic=allow_nondeterministic)
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[Any, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any, expires_at: float | None):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk LRU cache with TTL, so responses survive restarts. Values must be JSON serializable."""
+    def __init__(self, path: str = "llm_cache.sqlite3", max_size: int = 100_000, ttl: float | None = 86400.0, allow_nondeterministic: bool = False):
+        super().__init__(ttl=ttl, allow_nondeterministic=allow_nondeterministic)
+        self.max_size = max_size
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+
+    def _get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def _set(self, key: str, value: Any, expires_at: float | None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time.time()),
+            )
+            # Trimming scans the LRU index, so only do it every few hundred writes
+            self._writes += 1
+            if self._writes % 256 == 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
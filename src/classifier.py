@@ -0,0 +1,275 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Collection, Iterable
+from math import exp, log2
+import threading
+import json
+import re
+
+from src.message import BaseMessage, HumanMessage, ImageMessage
+from src.prompt_cache import message_digest
+
+# Size tiers and the fallback order when a tier has no model: heavier first, a bigger model can do a smaller task
+TIERS = {
+    "small": ("small", "medium", "heavy"),
+    "medium": ("medium", "heavy", "small"),
+    "heavy": ("heavy", "medium", "small"),
+}
+# Types that can answer any text request, tried when none of the predicted ones is served
+GENERAL = ("text-generation", "medium", "heavy", "small")
+
+FEATURES = (
+    "bias", "size", "short", "long_prompt", "turns", "code_block", "code_syntax", "code_words", "math_words",
+    "math_symbols", "image_input", "image_words", "video_words", "brief_words", "long_words", "reasoning_words",
+)
+
+_CODE_SYNTAX = re.compile(r"^\s*(?:def |class |import |from \S+ import|#include|public |const |let |var |func |fn |SELECT |return\b)|[{};]\s*$|=>|::", re.M)
+_CODE_WORDS = re.compile(r"\b(?:code|function|script|implement|refactor|debug|bug|compile|python|javascript|typescript|java|rust|golang|c\+\+|sql|regex|api|unit tests?|stack ?trace|exception|program)\b")
+_MATH_WORDS = re.compile(r"\b(?:calculate|compute|solve|equation|integral|derivative|probability|percent(?:age)?|sum of|average|how many|how much|convert|arithmetic|algebra|math)\b")
+_MATH_SYMBOLS = re.compile(r"[\d+\-*/^=%()]")
+_IMAGE_WORDS = re.compile(r"\b(?:image|picture|photo|drawing|draw|illustrat\w*|logo|sketch|render|diagram|screenshot)\b")
+_VIDEO_WORDS = re.compile(r"\b(?:video|animation|animate|clip|footage|movie)\b")
+_BRIEF_WORDS = re.compile(r"\b(?:summari[sz]e|tl;?dr|classify|extract|translate|yes or no|one word|one sentence|short|brief(?:ly)?|define|what is|who is)\b")
+_LONG_WORDS = re.compile(r"\b(?:essay|article|report|story|blog post|chapter|detailed|in detail|comprehensive|thorough|step[- ]by[- ]step|complete guide|documentation)\b")
+_REASONING_WORDS = re.compile(r"\b(?:analy[sz]e|compare|evaluate|design|architecture|plan|strategy|prove|explain why|trade-?offs?|critique|optimi[sz]e)\b")
+_LENGTH = re.compile(r"\b(\d{1,5})(?:-|\s*)(word|sentence|paragraph|line|bullet point|bullet|item|page)s?\b")
+_TOKENS_PER_UNIT = {"word": 1.4, "sentence": 25, "paragraph": 120, "line": 12, "bullet point": 30, "bullet": 30, "item": 30, "page": 700}
+
+
+@dataclass(frozen=True)
+class Classification:
+    """Task types in order of preference, and the expected answer length in tokens if served as each."""
+    task_types: tuple[str, ...]
+    lengths: tuple[int, ...]
+
+    @property
+    def task_type(self) -> str:
+        return self.task_types[0]
+
+    @property
+    def output_tokens(self) -> int:
+        return self.lengths[0]
+
+
+@dataclass(frozen=True)
+class _Signals:
+    features: tuple[float, ...]
+    prompt_tokens: int
+    user_tokens: int
+    length_hint: int | None  # tokens asked for explicitly ("in 200 words")
+    translation: bool
+
+    def __getitem__(self, name: str) -> float:
+        return self.features[FEATURES.index(name)]
+
+
+def _last_user(messages: list[BaseMessage]) -> BaseMessage | None:
+    for message in reversed(messages):
+        if isinstance(message, (HumanMessage, ImageMessage)):
+            return message
+    return None
+
+
+def _text(message: BaseMessage | None) -> str:
+    if message is None:
+        return ""
+    if isinstance(message, ImageMessage):
+        return message.content[0] or ""
+    return message.content if isinstance(message.content, str) else f"{message.content}"
+
+
+def _signals(messages: list[BaseMessage]) -> _Signals:
+    raw = _text(_last_user(messages))
+    text = raw.lower()
+    prompt_tokens = sum(len(_text(message)) for message in messages) // 4
+    user_tokens = len(raw) // 4
+    hits = lambda pattern, scale: min(len(pattern.findall(text)) / scale, 1.0)
+    symbols = len(_MATH_SYMBOLS.findall(text)) / len(text) if text else 0.0
+    hint = _LENGTH.search(text)
+    features = (
+        1.0,
+        min(log2(1 + prompt_tokens) / 16, 1.0),
+        float(user_tokens < 48),
+        float(prompt_tokens > 3000),
+        min(len(messages) / 20, 1.0),
+        float("```" in raw),
+        min(len(_CODE_SYNTAX.findall(raw)) / 5, 1.0),
+        hits(_CODE_WORDS, 2),
+        hits(_MATH_WORDS, 1),
+        min(symbols * 3, 1.0),
+        float(any(isinstance(message, ImageMessage) and message.content[1] is not None for message in messages)),
+        hits(_IMAGE_WORDS, 1),
+        hits(_VIDEO_WORDS, 1),
+        hits(_BRIEF_WORDS, 1),
+        hits(_LONG_WORDS, 1),
+        hits(_REASONING_WORDS, 2),
+    )
+    length_hint = int(int(hint.group(1)) * _TOKENS_PER_UNIT[hint.group(2)]) if hint else None
+    return _Signals(features, prompt_tokens, user_tokens, length_hint, "translat" in text)
+
+
+def _rules(signals: _Signals) -> tuple[str, ...]:
+    """Task types by preference from hand-set rules: the kind of task, then the size tier."""
+    complexity = (signals["size"] * 1.5 + signals["long_prompt"] + signals["long_words"] + signals["reasoning_words"]
+                  - signals["short"] * 0.5 - signals["brief_words"] * 0.5)
+    tier = "heavy" if complexity >= 1.6 else "medium" if complexity >= 0.9 else "small"
+    tiers = TIERS[tier]
+    if signals["video_words"] and not signals["code_words"]:
+        return ("video", *tiers)
+    if signals["image_input"] or (signals["image_words"] and not signals["code_words"]):
+        return ("image", *tiers)
+    if signals["code_block"] or signals["code_syntax"] >= 0.6 or signals["code_words"] >= 0.5:
+        return ("code-generation", *TIERS["heavy" if tier == "heavy" else "medium"], "text-generation")
+    if signals["math_words"] or signals["math_symbols"] >= 0.5:
+        return ("calculation", *tiers, "text-generation")
+    if signals["long_words"]:
+        return ("text-generation", *TIERS["heavy" if tier == "heavy" else "medium"])
+    return (*tiers, "text-generation")
+
+
+def _output_tokens(signals: _Signals, task_type: str) -> int:
+    """Expected answer length: an explicit length in the prompt, else an estimate from the kind of task."""
+    if signals.length_hint is not None:
+        return max(signals.length_hint, 16)
+    if task_type in ("image", "video"):
+        return 1
+    if signals["brief_words"] and not signals["long_words"]:
+        # Translations are as long as the text, summaries and extractions a fraction of the input
+        if signals.translation:
+            return max(int(signals.user_tokens * 1.2), 32)
+        return int(min(max(signals.prompt_tokens * 0.15, 100), 800))
+    if task_type == "code-generation":
+        return 1500 if signals["code_block"] and signals.user_tokens > 300 else 800
+    if signals["long_words"] or task_type == "heavy":
+        return 1500
+    return {"small": 200, "calculation": 150, "medium": 500}.get(task_type, 500)
+
+
+class LinearTaskModel:
+    """A tiny linear model over the classifier's features, trained on labelled requests.
+
+    Scores every task type with one dot product each, and optionally predicts
+    the answer length (log tokens) the same way when the training data had it.
+    """
+    def __init__(self, classes: list[str], weights: list[list[float]], output_weights: list[float] | None = None):
+        self.classes = classes
+        self.weights = weights
+        self.output_weights = output_weights
+
+    def rank(self, features: tuple[float, ...]) -> tuple[str, ...]:
+        scores = [sum(w * x for w, x in zip(row, features)) for row in self.weights]
+        return tuple(label for _, label in sorted(zip(scores, self.classes), reverse=True))
+
+    def output_tokens(self, features: tuple[float, ...]) -> int | None:
+        if self.output_weights is None:
+            return None
+        return max(1, int(exp(sum(w * x for w, x in zip(self.output_weights, features))) - 1))
+
+    @classmethod
+    def fit(cls, samples: Iterable[tuple], epochs: int = 500, learning_rate: float = 0.5, l2: float = 1e-3) -> "LinearTaskModel":
+        """Train on (messages, task_type) or (messages, task_type, output_tokens) samples with softmax regression."""
+        import numpy as np
+
+        rows, labels, lengths = [], [], []
+        for sample in samples:
+            rows.append(_signals(sample[0]).features)
+            labels.append(sample[1])
+            lengths.append(sample[2] if len(sample) > 2 else None)
+        classes = sorted(set(labels))
+        x = np.array(rows, dtype=np.float64)
+        y = np.zeros((len(labels), len(classes)))
+        y[np.arange(len(labels)), [classes.index(label) for label in labels]] = 1.0
+        weights = np.zeros((len(classes), x.shape[1]))
+        for _ in range(epochs):
+            logits = x @ weights.T
+            logits -= logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            weights -= learning_rate * (((probabilities - y).T @ x) / len(x) + l2 * weights)
+
+        output_weights = None
+        known = [i for i, length in enumerate(lengths) if length is not None]
+        if known:
+            xs = x[known]
+            target = np.log1p(np.array([lengths[i] for i in known], dtype=np.float64))
+            # Ridge regression on log tokens
+            output_weights = np.linalg.solve(xs.T @ xs + l2 * len(known) * np.eye(xs.shape[1]), xs.T @ target).tolist()
+        return cls(classes, weights.tolist(), output_weights)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"features": FEATURES, "classes": self.classes, "weights": self.weights, "output_weights": self.output_weights}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LinearTaskModel":
+        with open(path) as f:
+            data = json.load(f)
+        if tuple(data["features"]) != FEATURES:
+            raise ValueError(f"{path} was trained on different features; retrain it")
+        return cls(data["classes"], data["weights"], data.get("output_weights"))
+
+
+class TaskClassifier:
+    """Picks a request's task type and expected answer length locally, on the CPU.
+
+    Features come from the last user message and the size of the prompt:
+    length, code (fences, syntax, programming words), arithmetic, image
+    input, and keywords for images, video, brief and long answers and
+    reasoning. Hand-set rules map them to a kind of task (image, video,
+    code-generation, calculation, text-generation) and a size tier (small,
+    medium, heavy); a `LinearTaskModel` trained on your own labelled traffic
+    replaces the rules. Results are cached per last message and prompt size,
+    so repeated prompts skip the regexes.
+    """
+    def __init__(self, model: LinearTaskModel | str | None = None, cache_size: int = 4096):
+        """
+        Args:
+            model (LinearTaskModel | str | None): Trained model, or a path saved with `LinearTaskModel.save`.
+            cache_size (int): Classifications kept for repeated prompts.
+        """
+        self.model = LinearTaskModel.load(model) if isinstance(model, str) else model
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, Classification] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, messages: list[BaseMessage]) -> tuple:
+        last = _last_user(messages)
+        size = sum(len(_text(message)) for message in messages)
+        images = any(isinstance(message, ImageMessage) for message in messages)
+        return message_digest(last) if last is not None else None, size.bit_length(), min(len(messages), 20), images
+
+    def classify(self, messages: list[BaseMessage]) -> Classification:
+        key = self._key(messages)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        signals = _signals(messages)
+        if self.model is not None:
+            task_types = self.model.rank(signals.features)
+            output_tokens = self.model.output_tokens(signals.features)
+        else:
+            task_types, output_tokens = _rules(signals), None
+        if output_tokens is None:
+            lengths = tuple(_output_tokens(signals, task_type) for task_type in task_types)
+        else:
+            lengths = (output_tokens,) * len(task_types)
+        classification = Classification(task_types, lengths)
+        with self._lock:
+            self._cache[key] = classification
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return classification
+
+    def choose(self, messages: list[BaseMessage], available: Collection[str]) -> tuple[str, int]:
+        """(task type, expected output tokens): the most preferred type some model serves."""
+        classification = self.classify(messages)
+        for task_type, length in zip(classification.task_types, classification.lengths):
+            if task_type in available:
+                return task_type, length
+        # None of the predicted types is served: fall back to a general-purpose one that is
+        for task_type in GENERAL:
+            if task_type in available:
+                return task_type, max(classification.lengths)
+        return classification.task_type, classification.output_tokens
@@ -0,0 +1,360 @@
+from weakref import WeakKeyDictionary
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator
+from hashlib import sha256
+import threading
+import asyncio
+import json
+
+from src.message import BaseMessage
+
+
+def flight_key(kind: str, messages: list[BaseMessage], task_type: str, *params) -> str:
+    """Key for identical requests: the normalized messages, task type and request params (json, timeouts)."""
+    normalized = json.dumps(
+        [kind, [message.to_dict() for message in messages], task_type, params],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class _StreamHub:
+    """One upstream stream fanned out to any number of subscribers.
+
+    A driver thread reads the upstream into a shared buffer; every subscriber
+    replays the buffer from the first chunk, so late joiners get the whole
+    answer. The upstream is closed once every subscriber has closed.
+    """
+    def __init__(self):
+        self.opened = threading.Event()
+        self.upstream = None
+        self.chunks: list[str] = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.subscribers = 1
+        self.cancelled = False
+        self._changed = threading.Condition()
+
+    def joinable(self) -> bool:
+        with self._changed:
+            if self.cancelled:
+                return False
+            self.subscribers += 1
+            return True
+
+    def run(self, on_end: Callable[[], None]):
+        try:
+            for chunk in self.upstream:
+                with self._changed:
+                    if self.cancelled:
+                        break
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            on_end()
+            self.upstream.close()
+            with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    def chunk(self, index: int) -> str | None:
+        """The `index`th chunk, waiting for it; None once the stream has ended."""
+        with self._changed:
+            while index >= len(self.chunks) and not self.finished:
+                self._changed.wait()
+            if index < len(self.chunks):
+                return self.chunks[index]
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def leave(self):
+        with self._changed:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self.cancelled = True
+
+
+class SharedStream:
+    """A subscriber's view of a coalesced `FailoverStream`; iterates the same chunks from the start."""
+    def __init__(self, hub: _StreamHub):
+        self._hub = hub
+        self._index = 0
+        self._closed = False
+
+    @property
+    def model(self) -> str | None:
+        return self._hub.upstream.model
+
+    @property
+    def models(self) -> list[str]:
+        return self._hub.upstream.models
+
+    @property
+    def text(self) -> str:
+        return "".join(self._hub.chunks[:self._index])
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if self._closed:
+            raise StopIteration
+        chunk = self._hub.chunk(self._index)
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        self._index += 1
+        return chunk
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._hub.leave()
+
+
+class _AsyncStreamHub:
+    """Async counterpart of `_StreamHub`, driven by a task on the subscribers' event loop."""
+    def __init__(self, opened: asyncio.Task):
+        self.opened = opened
+        self.upstream = None
+        self.chunks: list[str] = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.subscribers = 1
+        self.driver: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def joinable(self) -> bool:
+        if self.driver is not None and self.driver.cancelled():
+            return False
+        self.subscribers += 1
+        return True
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def run(self, on_end: Callable[[], None]):
+        try:
+            async for chunk in self.upstream:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            on_end()
+            self.finished = True
+            self._notify()
+            await self.upstream.aclose()
+
+    async def chunk(self, index: int) -> str | None:
+        while index >= len(self.chunks) and not self.finished:
+            await self._changed.wait()
+        if index < len(self.chunks):
+            return self.chunks[index]
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def leave(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.finished:
+            if self.driver is not None:
+                self.driver.cancel()
+            else:
+                self.opened.cancel()
+
+
+class AsyncSharedStream:
+    """Async counterpart of `SharedStream`."""
+    def __init__(self, hub: _AsyncStreamHub):
+        self._hub = hub
+        self._index = 0
+        self._closed = False
+
+    @property
+    def model(self) -> str | None:
+        return self._hub.upstream.model
+
+    @property
+    def models(self) -> list[str]:
+        return self._hub.upstream.models
+
+    @property
+    def text(self) -> str:
+        return "".join(self._hub.chunks[:self._index])
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self._closed:
+            raise StopAsyncIteration
+        chunk = await self._hub.chunk(self._index)
+        if chunk is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        self._index += 1
+        return chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._hub.leave()
+
+
+class SingleFlight:
+    """Coalesces identical in-flight requests onto one upstream call.
+
+    The first caller for a key (the leader) makes the call; callers with the
+    same key that arrive while it is in flight wait for and share its result,
+    or its exception. Nothing is kept once the call finishes, so unlike a
+    cache this never serves an answer that was not in flight. Streams are
+    fanned out chunk by chunk to every subscriber.
+
+    Sync calls are shared across threads and async calls across the tasks of
+    one event loop. An async call keeps running while any caller still waits
+    for it, and is cancelled once every caller has been cancelled.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._streams: dict[str, _StreamHub] = {}
+        self._async: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, Any]] = WeakKeyDictionary()
+        self.leaders = 0
+        self.followers = 0
+
+    def stats(self) -> dict:
+        """Upstream calls made (leaders) and requests that attached to one (followers)."""
+        with self._lock:
+            in_flight = len(self._calls) + len(self._streams) + sum(len(flights) for flights in self._async.values())
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": in_flight}
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = call()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+
+    def stream(self, key: str, open_stream: Callable[[], Iterator[str]]) -> SharedStream:
+        """Subscribe to the in-flight stream for `key`, or open it with `open_stream()`.
+
+        `open_stream` returns a started `FailoverStream`; followers wait for it
+        to start, so `model` is known on return as with an unshared stream.
+        """
+        with self._lock:
+            hub = self._streams.get(key)
+            leader = hub is None or not hub.joinable()
+            if leader:
+                hub = self._streams[key] = _StreamHub()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            hub.opened.wait()
+            if hub.upstream is None:
+                raise hub.error
+            return SharedStream(hub)
+        try:
+            hub.upstream = open_stream()
+        except BaseException as e:
+            hub.error = e
+            self._forget(self._streams, key, hub)
+            raise
+        finally:
+            hub.opened.set()
+        threading.Thread(target=hub.run, args=(lambda: self._forget(self._streams, key, hub),),
+                         name="single-flight-stream", daemon=True).start()
+        return SharedStream(hub)
+
+    def _forget(self, flights: dict, key: str, flight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    def _loop_flights(self) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._async.setdefault(loop, {})
+
+    async def _attach(self, flights: dict, key: str, task: asyncio.Task, waiters: list[int]):
+        """Wait for a shared task without letting one caller's cancellation cancel it for the others."""
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                waiters[0] -= 1
+                if waiters[0] == 0:
+                    task.cancel()
+                    self._forget(flights, key, (task, waiters))
+            raise
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async counterpart of `do`; `call` returns the coroutine to run."""
+        flights = self._loop_flights()
+        flight = flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(call())
+            flight = flights[key] = (task, [1])
+            task.add_done_callback(lambda _: self._forget(flights, key, flight))
+            self.leaders += 1
+        else:
+            flight[1][0] += 1
+            self.followers += 1
+        return await self._attach(flights, key, *flight)
+
+    async def astream(self, key: str, open_stream: Callable[[], Awaitable[AsyncIterator[str]]]) -> AsyncSharedStream:
+        """Async counterpart of `stream`; `open_stream` returns a coroutine for a started `AsyncFailoverStream`."""
+        flights = self._loop_flights()
+        hub = flights.get(key)
+        if hub is not None and hub.joinable():
+            self.followers += 1
+        else:
+            hub = flights[key] = _AsyncStreamHub(asyncio.ensure_future(open_stream()))
+            self.leaders += 1
+
+            def started(opened: asyncio.Task):
+                if opened.cancelled() or opened.exception() is not None:
+                    self._forget(flights, key, hub)
+                    return
+                hub.upstream = opened.result()
+                hub.driver = asyncio.ensure_future(hub.run(lambda: self._forget(flights, key, hub)))
+
+            hub.opened.add_done_callback(started)
+        try:
+            await asyncio.shield(hub.opened)
+        except asyncio.CancelledError:
+            if not hub.opened.done():
+                hub.leave()
+            raise
+        return AsyncSharedStream(hub)
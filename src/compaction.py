@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from hashlib import sha256
+from math import ceil
+import threading
+import logging
+
+from src.inference import BaseInference
+from src.message import AIMessage, BaseMessage, HumanMessage, ImageMessage, SystemMessage
+from src.prompt_cache import message_digest
+from src.tokenizer import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for the assistant that continues it. Keep facts, decisions, names, "
+    "numbers and open questions, drop pleasantries, and answer with the summary only, in at most {words} words."
+)
+# The summary goes back in as an exchange, since several providers keep only one system message
+SUMMARY_REQUEST = "Summarize our conversation so far."
+
+
+def _transcript(messages: list[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, ImageMessage):
+            text, image = message.content
+            lines.append(f"{message.role}: {text or ''}{' [image]' if image else ''}")
+        else:
+            lines.append(f"{message.role}: {message.content}")
+    return "\n".join(lines)
+
+
+class HistoryCompactor:
+    """Trims a conversation to the token budget of the model about to answer it.
+
+    The leading system messages stay pinned and the most recent turns that
+    fit are kept, whole; older turns are dropped. The cut moves in steps of
+    `step` turns, so consecutive requests of a growing conversation send the
+    same prefix (and hit the provider's prompt cache) until the window has
+    to move again.
+
+    With `summarizer`, a cheap model, the dropped turns are replaced by a
+    summary of at most about `summary_tokens` tokens. Summaries are cached by
+    the content of the turns they cover and extended from the longest cached
+    one, so moving the window only summarizes the newly dropped turns. If the
+    summarizer fails, the turns are dropped without a summary.
+    """
+    def __init__(self, summarizer: BaseInference | None = None, max_prompt_tokens: int | None = None, step: int = 4,
+                 summary_tokens: int = 512, max_summaries: int = 256):
+        """
+        Args:
+            summarizer (BaseInference | None): Model that summarizes dropped turns. None drops them.
+            max_prompt_tokens (int | None): Budget for every model, on top of its context window;
+                smaller prompts cost less and prefill faster.
+            step (int): Turns the window moves at a time.
+            summary_tokens (int): Room kept for the summary.
+            max_summaries (int): Summaries cached, least recently used dropped first.
+        """
+        self.summarizer = summarizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.step = max(1, step)
+        self.summary_tokens = summary_tokens
+        self.max_summaries = max_summaries
+        self._summaries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def budget(self, context_budget: int | None) -> int | None:
+        """Prompt tokens allowed for a model that has `context_budget` left after its output."""
+        if context_budget is None or self.max_prompt_tokens is None:
+            return context_budget if context_budget is not None else self.max_prompt_tokens
+        return min(context_budget, self.max_prompt_tokens)
+
+    def _layout(self, messages: list[BaseMessage]) -> tuple[int, list[int]]:
+        """(pinned system messages, start index of every turn after them)."""
+        pinned = 0
+        while pinned < len(messages) and isinstance(messages[pinned], SystemMessage):
+            pinned += 1
+        starts = [pinned] + [i for i in range(pinned + 1, len(messages)) if isinstance(messages[i], (HumanMessage, ImageMessage))]
+        return pinned, starts
+
+    def minimum_tokens(self, messages: list[BaseMessage], family: str) -> int:
+        """Tokens of the shortest compaction: the pinned system messages, the last turn and room for a summary."""
+        pinned, starts = self._layout(messages)
+        kept = messages[:pinned] + messages[starts[-1]:]
+        summary = self.summary_tokens if self.summarizer is not None and starts[-1] > pinned else 0
+        return sum(count_message_tokens(message, family) for message in kept) + 3 + summary
+
+    def _cut(self, messages: list[BaseMessage], budget: int, family: str) -> tuple[int, int] | None:
+        """(pinned, start of the first kept turn), or None when everything fits."""
+        tokens = [count_message_tokens(message, family) for message in messages]
+        if sum(tokens) + 3 <= budget:
+            return None
+        pinned, starts = self._layout(messages)
+        room = budget - sum(tokens[:pinned]) - 3 - (self.summary_tokens if self.summarizer is not None else 0)
+        kept = sum(tokens[starts[-1]:])
+        turn = len(starts) - 1
+        while turn > 0 and kept + sum(tokens[starts[turn - 1]:starts[turn]]) <= room:
+            turn -= 1
+            kept += sum(tokens[starts[turn]:starts[turn + 1]])
+        turn = min(ceil(turn / self.step) * self.step, len(starts) - 1)
+        if turn == 0:
+            return None
+        return pinned, starts[turn]
+
+    def _key(self, dropped: list[BaseMessage]) -> list[str]:
+        """Chained digests of every prefix of `dropped`."""
+        running = sha256()
+        keys = []
+        for message in dropped:
+            running.update(message_digest(message))
+            keys.append(running.copy().hexdigest())
+        return keys
+
+    def _cached_summary(self, keys: list[str]) -> tuple[int, list[BaseMessage]]:
+        """(messages covered, summary exchange) of the longest cached summary of a prefix of the dropped turns."""
+        with self._lock:
+            for covered in range(len(keys), 0, -1):
+                summary = self._summaries.get(keys[covered - 1])
+                if summary is not None:
+                    self._summaries.move_to_end(keys[covered - 1])
+                    return covered, summary
+        return 0, []
+
+    def _store(self, key: str, text: str) -> list[BaseMessage]:
+        # Kept as message objects, so their encoded forms are reused by the adapters too
+        summary = [HumanMessage(SUMMARY_REQUEST), AIMessage(text)]
+        with self._lock:
+            self._summaries[key] = summary
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def _plan(self, messages: list[BaseMessage], budget: int | None, family: str):
+        """(pinned, start, keys, summary, messages still to summarize), or None when `messages` fit."""
+        budget = self.budget(budget)
+        cut = None if budget is None else self._cut(messages, budget, family)
+        if cut is None:
+            return None
+        pinned, start = cut
+        if self.summarizer is None:
+            return pinned, start, [], [], []
+        dropped = messages[pinned:start]
+        keys = self._key(dropped)
+        covered, summary = self._cached_summary(keys)
+        return pinned, start, keys, summary, dropped[covered:]
+
+    def _summary_prompt(self, summary: list[BaseMessage], new: list[BaseMessage]) -> list[BaseMessage]:
+        transcript = _transcript(new)
+        if summary:
+            transcript = f"Summary so far:\n{summary[1].content}\n\nLater messages:\n{transcript}"
+        return [SystemMessage(SUMMARY_PROMPT.format(words=self.summary_tokens * 3 // 4)), HumanMessage(transcript)]
+
+    def _failed(self, messages: list[BaseMessage], pinned: int, start: int, error: Exception) -> list[BaseMessage]:
+        logger.warning("Summarizing %d dropped messages failed, dropping them: %s", start - pinned, error)
+        return messages[:pinned] + messages[start:]
+
+    def compact(self, messages: list[BaseMessage], budget: int | None, family: str) -> list[BaseMessage]:
+        """`messages` trimmed to `budget` prompt tokens (counted for tokenizer `family`); unchanged when they fit."""
+        plan = self._plan(messages, budget, family)
+        if plan is None:
+            return messages
+        pinned, start, keys, summary, new = plan
+        if new:
+            try:
+                text = self.summarizer.invoke(self._summary_prompt(summary, new)).content
+            except Exception as e:
+                return self._failed(messages, pinned, start, e)
+            summary = self._store(keys[-1], text)
+        return messages[:pinned] + summary + messages[start:]
+
+    async def acompact(self, messages: list[BaseMessage], budget: int | None, family: str) -> list[BaseMessage]:
+        """Async counterpart of `compact`, summarizing with the summarizer's `ainvoke`."""
+        plan = self._plan(messages, budget, family)
+        if plan is None:
+            return messages
+        pinned, start, keys, summary, new = plan
+        if new:
+            try:
+                text = (await self.summarizer.ainvoke(self._summary_prompt(summary, new))).content
+            except Exception as e:
+                return self._failed(messages, pinned, start, e)
+            summary = self._store(keys[-1], text)
+        return messages[:pinned] + summary + messages[start:]
@@ -0,0 +1,611 @@
+"""OpenAI-compatible HTTP gateway in front of `LLMSwitcher`.
+
+Serves, on one port:
+
+- POST /v1/chat/completions: JSON, or SSE with "stream": true
+- GET /v1/models: "auto" and every task type the switcher routes
+- GET /health: 200 while serving, 503 while draining
+- GET /stats: the switcher's scheduler, health and latency status
+
+OpenAI SDK clients work unchanged with `base_url="http://host:port/v1"`. The
+request's `model` picks the task type when it names one ("code-generation",
+"small", ...); any other model, such as "auto", lets the switcher's classifier
+choose. Provider keys stay on the gateway.
+
+With a `Scheduler` on the switcher, the `X-Priority` header picks the
+request's priority class and `X-Deadline` its deadline in seconds; the
+tenant is the client's API key (or `X-Tenant` when keys are not required).
+Requests the scheduler rejects are answered with 429.
+
+Standalone, with the models and keys `app.py` uses:
+
+    python -m src.gateway --models models.json --port 8000 --workers 4
+"""
+from typing import Callable, Iterable
+from urllib.parse import urlsplit
+from uuid import uuid4
+import argparse
+import asyncio
+import logging
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+from src.llm_switcher import LLMSwitcher
+from src.scheduler import AdmissionRejected, Scheduler
+from src.message import AIMessage, BaseMessage, HumanMessage, ImageMessage, SystemMessage
+from src.tokenizer import count_prompt_tokens, count_text_tokens, family_of
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class RequestError(ValueError):
+    """A request the gateway rejects before routing it; answered with `status`."""
+    def __init__(self, message: str, status: int = 400, kind: str = "invalid_request_error"):
+        super().__init__(message)
+        self.status = status
+        self.kind = kind
+
+
+def _request_line(line: bytes) -> tuple[str, str]:
+    """(method, target) of an HTTP/1.x request line."""
+    parts = line.decode("latin-1").rstrip("\r\n").split(" ")
+    if len(parts) != 3 or not parts[0].isalpha() or not parts[2].startswith("HTTP/"):
+        raise RequestError("Malformed request line")
+    return parts[0], parts[1]
+
+
+def _length(value: str, base: int, name: str) -> int:
+    """A Content-Length (base 10) or chunk size (base 16); signs and underscores, which `int` allows, are rejected."""
+    value = value.strip()
+    digits = "0123456789abcdefABCDEF"[:22 if base == 16 else 10]
+    if not value or value.strip(digits):
+        raise RequestError(f"Invalid {name}: {value[:32]!r}")
+    return int(value, base)
+
+
+def _content(content) -> tuple[str, str | None]:
+    """(text, image URL) of an OpenAI message content: a string or a list of text and image_url parts."""
+    if content is None or isinstance(content, str):
+        return content or "", None
+    if not isinstance(content, list):
+        raise RequestError("Message content must be a string or a list of parts")
+    texts, images = [], []
+    for part in content:
+        if not isinstance(part, dict):
+            raise RequestError("Content parts must be objects")
+        if part.get("type") == "text":
+            if not isinstance(part.get("text", ""), str):
+                raise RequestError("Text parts must have a string 'text'")
+            texts.append(part.get("text", ""))
+        elif part.get("type") == "image_url":
+            url = part.get("image_url")
+            url = url.get("url") if isinstance(url, dict) else url
+            if not isinstance(url, str):
+                raise RequestError("Image parts must have a string URL")
+            images.append(url)
+        else:
+            raise RequestError(f"Unsupported content part type: {part.get('type')!r}")
+    if len(images) > 1:
+        raise RequestError("At most one image per message is supported")
+    return "\n".join(texts), images[0] if images else None
+
+
+def _image_message(text: str, url: str) -> ImageMessage:
+    if url.startswith("data:"):
+        header, _, data = url.partition(",")
+        if not header.endswith(";base64"):
+            raise RequestError("Image data URLs must be base64 encoded")
+        return ImageMessage(text, image_base_64=data)
+    if url.startswith(("http://", "https://")):
+        return ImageMessage(text, image_path=url)
+    raise RequestError("Image URLs must be http(s) or base64 data URLs")
+
+
+def to_messages(messages: list[dict]) -> list[BaseMessage]:
+    """OpenAI chat messages as this package's message objects."""
+    if not isinstance(messages, list) or not messages:
+        raise RequestError("'messages' must be a non-empty list")
+    converted = []
+    for message in messages:
+        role = message.get("role") if isinstance(message, dict) else None
+        text, image = _content(message.get("content")) if role else ("", None)
+        if role in ("system", "developer"):
+            converted.append(SystemMessage(text))
+        elif role == "user":
+            converted.append(_image_message(text, image) if image else HumanMessage(text))
+        elif role == "assistant":
+            converted.append(AIMessage(text))
+        else:
+            raise RequestError(f"Unsupported message role: {role!r}")
+    return converted
+
+
+def load_llms(path: str = "models.json") -> list[dict]:
+    """`LLMSwitcher` entries for the models in `path` whose provider key is set, as `app.py` builds them."""
+    from src.inference.gemini import ChatGemini
+    from src.inference.mistral import ChatMistral
+    from src.inference.openai import ChatOpenAI
+    from src.inference.groq import ChatGroq
+
+    providers = {
+        "gemini": (ChatGemini, "CHATGEMINI_API_KEY"),
+        "groq": (ChatGroq, "CHATGROQ_API_KEY"),
+        "mistral": (ChatMistral, "MISTRAL_API_KEY"),
+        "openai": (ChatOpenAI, "OPENAI_API_KEY"),
+    }
+    with open(path) as f:
+        models = json.load(f)
+    llms = []
+    for model in models:
+        if model["provider"] not in providers:
+            continue
+        cls, env = providers[model["provider"]]
+        api_key = os.getenv(env)
+        if not api_key:
+            continue
+        llms.append({
+            "llm": cls(model=model["model"], api_key=api_key),
+            **{key: value for key, value in model.items() if key not in ("provider", "model")},
+        })
+    return llms
+
+
+class Gateway:
+    """Asyncio HTTP/1.1 server with keep-alive, answering OpenAI chat requests through an `LLMSwitcher`.
+
+    Every worker process builds its own switcher with `switcher_factory`, so each
+    worker keeps one set of pooled provider connections, prompt caches and
+    health state shared by all of its requests. With `workers` > 1, `run()`
+    forks the workers; each binds the port with SO_REUSEPORT where the OS has
+    it, so the kernel spreads connections across them, and otherwise they
+    accept on one socket bound before the fork. Workers that die are replaced.
+
+    SIGTERM or SIGINT drains a worker: it stops accepting, closes idle
+    keep-alive connections, answers in-flight requests (streams included)
+    with `Connection: close`, and closes its provider connections, cancelling
+    whatever is still running after `drain_timeout` seconds.
+    """
+    def __init__(self, switcher_factory: Callable[[], LLMSwitcher], host: str = "127.0.0.1", port: int = 8000,
+                 workers: int = 1, api_keys: Iterable[str] | None = None, drain_timeout: float = 30.0,
+                 max_body_size: int = 32 * 1024 * 1024, reuse_port: bool | None = None):
+        """
+        Args:
+            switcher_factory (Callable[[], LLMSwitcher]): Builds the switcher; called once in every worker.
+            host (str): Interface to listen on.
+            port (int): Port to listen on; 0 picks a free one.
+            workers (int): Worker processes. More than one needs `os.fork`.
+            api_keys (Iterable[str] | None): Bearer tokens clients must send. None accepts any client.
+            drain_timeout (float): Seconds in-flight requests get to finish on shutdown.
+            max_body_size (int): Largest request body accepted, in bytes.
+            reuse_port (bool | None): Bind every worker with SO_REUSEPORT. Defaults to whether the OS supports it.
+        """
+        self.switcher_factory = switcher_factory
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.api_keys = set(api_keys) if api_keys is not None else None
+        self.drain_timeout = drain_timeout
+        self.max_body_size = max_body_size
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT") if reuse_port is None else reuse_port
+        self.switcher: LLMSwitcher | None = None
+        self.draining = False
+        self._stopping: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        # Open connections -> whether a request is being answered on it
+        self._connections: dict[asyncio.StreamWriter, bool] = {}
+        self._handlers: set[asyncio.Task] = set()
+        self._families: dict[str, str] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _bind(self) -> socket.socket:
+        sock = socket.create_server((self.host, self.port), backlog=1024)
+        sock.setblocking(False)
+        self.port = sock.getsockname()[1]
+        return sock
+
+    # -----------------------
+    # Process management
+    # -----------------------
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT, forking `workers` processes when more than one."""
+        if self.workers <= 1 or not hasattr(os, "fork"):
+            asyncio.run(self.serve())
+            return
+        reuse_port = self.reuse_port and self.port != 0
+        sock = None if reuse_port else self._bind()
+        # Worker pid -> when it started
+        children: dict[int, float] = {}
+        stopping = False
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                code = 0
+                try:
+                    asyncio.run(self.serve(sock))
+                except BaseException:
+                    logger.exception("Gateway worker %d failed", os.getpid())
+                    code = 1
+                finally:
+                    os._exit(code)
+            children[pid] = time.monotonic()
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for _ in range(self.workers):
+            spawn()
+        logger.info("Gateway on %s with %d workers", self.base_url, self.workers)
+        while children:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if stopping or started is None:
+                continue
+            if time.monotonic() - started < 1.0:
+                # Failing right away (e.g. the port is taken) would only fail again
+                logger.error("Gateway worker %d failed on start; stopping", pid)
+                stop(None, None)
+            else:
+                logger.warning("Gateway worker %d exited with status %d; starting another", pid, status)
+                spawn()
+        if sock is not None:
+            sock.close()
+
+    def start(self) -> "Gateway":
+        """Serve one worker on a daemon thread, e.g. inside tests or benchmarks; `stop()` drains it."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve(ready=ready.set))
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="llm-gateway", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "Gateway":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def serve(self, sock: socket.socket | None = None, ready: Callable[[], None] | None = None):
+        """Serve one worker in the running loop until SIGTERM or SIGINT (or `stop()`), then drain."""
+        self.switcher = self.switcher_factory()
+        self._families = {entry["llm"].model: family_of(entry["llm"]) for entry in self.switcher.llms}
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, self._stopping.set)
+        if sock is not None:
+            server = await asyncio.start_server(self._handle, sock=sock)
+        else:
+            reuse_port = self.reuse_port and self.workers > 1
+            server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024, reuse_port=reuse_port or None)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info("Gateway worker %d serving %s", os.getpid(), self.base_url)
+        if ready is not None:
+            ready()
+        await self._stopping.wait()
+        await self._drain(server)
+
+    async def _drain(self, server: asyncio.AbstractServer):
+        self.draining = True
+        server.close()
+        # Idle keep-alive connections are closed now; busy ones once their response is written
+        for writer, busy in list(self._connections.items()):
+            if not busy:
+                writer.close()
+        if self._handlers:
+            _, pending = await asyncio.wait(set(self._handlers), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Cancelled %d requests still running after %.0fs of draining", len(pending), self.drain_timeout)
+                await asyncio.wait(pending)
+        for entry in self.switcher.llms:
+            await entry["llm"].aclose()
+        self.switcher.quota.close()
+
+    # -----------------------
+    # HTTP
+    # -----------------------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._handlers.add(asyncio.current_task())
+        self._connections[writer] = False
+        try:
+            while not self.draining:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                self._connections[writer] = True
+                try:
+                    method, target = _request_line(request_line)
+                    headers = await self._headers(reader)
+                    body = await self._body(reader, headers)
+                except RequestError as e:
+                    await self._send_error(writer, e.status, str(e), e.kind, keep_alive=False)
+                    return
+                keep_alive = await self._respond(writer, method, target, headers, body)
+                self._connections[writer] = False
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _headers(self, reader: asyncio.StreamReader) -> dict[str, str]:
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, colon, value = line.decode("latin-1").partition(":")
+            if not colon or not name.strip():
+                raise RequestError("Malformed header line")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _body(self, reader: asyncio.StreamReader, headers: dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks, size = [], 0
+            while True:
+                length = _length((await reader.readline()).split(b";")[0].decode("latin-1"), 16, "chunk size")
+                if length == 0:
+                    await reader.readline()
+                    return b"".join(chunks)
+                size += length
+                if size > self.max_body_size:
+                    raise RequestError("Request body too large", 413)
+                chunks.append(await reader.readexactly(length))
+                await reader.readline()
+        length = _length(headers.get("content-length", "0"), 10, "Content-Length")
+        if length > self.max_body_size:
+            raise RequestError("Request body too large", 413)
+        return await reader.readexactly(length)
+
+    def _authorized(self, headers: dict[str, str]) -> bool:
+        if self.api_keys is None:
+            return True
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and token.strip() in self.api_keys
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, target: str, headers: dict[str, str], body: bytes) -> bool:
+        path = urlsplit(target).path.rstrip("/")
+        if path == "/health":
+            await self._send_json(writer, 503 if self.draining else 200, {"status": "draining" if self.draining else "ok"})
+            return True
+        if not self._authorized(headers):
+            await self._send_error(writer, 401, "Invalid API key", "authentication_error")
+            return True
+        if path in ("/v1/models", "/stats"):
+            if method != "GET":
+                await self._send_error(writer, 405, f"Use GET for {path}")
+                return True
+            await self._send_json(writer, 200, self._models() if path == "/v1/models" else self._stats())
+            return True
+        if path != "/v1/chat/completions":
+            await self._send_error(writer, 404, f"No route for {method} {path}")
+            return True
+        if method != "POST":
+            await self._send_error(writer, 405, f"Use POST for {path}")
+            return True
+        try:
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict):
+                raise RequestError("The request body must be a JSON object")
+            messages = to_messages(request.get("messages"))
+            task_type, json_mode, include_usage = self._options(request)
+            schedule = self._schedule(headers)
+        except (RequestError, ValueError) as e:
+            await self._send_error(writer, getattr(e, "status", 400), f"{e}")
+            return True
+        if request.get("stream"):
+            return await self._stream(writer, messages, task_type, include_usage, schedule)
+        return await self._complete(writer, messages, task_type, json_mode, schedule)
+
+    def _options(self, request: dict) -> tuple[str | None, bool, bool]:
+        """(task type, JSON mode, include usage) of a chat completion request."""
+        model = request.get("model")
+        if model is not None and not isinstance(model, str):
+            raise RequestError("'model' must be a string")
+        task_type = model if model in self.switcher.index.task_types() else None
+        response_format = request.get("response_format") or {}
+        stream_options = request.get("stream_options") or {}
+        if not isinstance(response_format, dict):
+            raise RequestError("'response_format' must be an object")
+        if not isinstance(stream_options, dict):
+            raise RequestError("'stream_options' must be an object")
+        json_mode = response_format.get("type") in ("json_object", "json_schema")
+        if json_mode and request.get("stream"):
+            raise RequestError("response_format is not supported with stream")
+        return task_type, json_mode, bool(stream_options.get("include_usage"))
+
+    def _schedule(self, headers: dict[str, str]) -> dict:
+        """The priority, tenant and deadline arguments of the switcher's task methods, from the request headers."""
+        scheduler = self.switcher.scheduler
+        if scheduler is None:
+            return {}
+        priority = headers.get("x-priority", "default")
+        if priority not in scheduler.priorities:
+            raise RequestError(f"X-Priority must be one of {', '.join(scheduler.priorities)}")
+        deadline = headers.get("x-deadline")
+        try:
+            deadline = float(deadline) if deadline is not None else None
+        except ValueError:
+            raise RequestError("X-Deadline must be a number of seconds") from None
+        if self.api_keys is not None:
+            tenant = headers["authorization"].partition(" ")[2].strip()
+        else:
+            tenant = headers.get("x-tenant", "default")
+        return {"priority": priority, "tenant": tenant, "deadline": deadline}
+
+    def _models(self) -> dict:
+        created = int(time.time())
+        ids = ["auto", *sorted(self.switcher.index.task_types())]
+        return {"object": "list", "data": [{"id": model, "object": "model", "created": created, "owned_by": "llm-router"} for model in ids]}
+
+    def _stats(self) -> dict:
+        return {
+            "scheduler": self.switcher.scheduler_status(),
+            "health": self.switcher.health_status(),
+            "latency": self.switcher.latency_status(),
+        }
+
+    def _usage(self, messages: list[BaseMessage], model: str, completion: str) -> dict:
+        """Token counts for the answering model's tokenizer family; the switcher does not return provider usage."""
+        family = self._families.get(model)
+        prompt_tokens = count_prompt_tokens(messages, family) if family else count_prompt_tokens(messages)
+        completion_tokens = count_text_tokens(completion, family) if family else count_text_tokens(completion)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def _upstream_error(self, writer: asyncio.StreamWriter, error: Exception):
+        if isinstance(error, AdmissionRejected):
+            return self._send_error(writer, 429, f"{error}", "rate_limit_error")
+        # RuntimeError is how the switcher reports that no model could answer
+        if isinstance(error, RuntimeError):
+            return self._send_error(writer, 503, f"{error}", "server_error")
+        logger.exception("Gateway request failed", exc_info=error)
+        return self._send_error(writer, 502, f"Upstream error: {error}", "server_error")
+
+    async def _complete(self, writer: asyncio.StreamWriter, messages: list[BaseMessage], task_type: str | None, json_mode: bool,
+                        schedule: dict) -> bool:
+        try:
+            content, model, cost, reason = await self.switcher.ainvoke_task(messages, task_type, json_mode, **schedule)
+        except Exception as e:
+            await self._upstream_error(writer, e)
+            return True
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        await self._send_json(writer, 200, {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": self._usage(messages, model, content),
+            "routing": {"estimated_cost": cost, "reason": reason},
+        })
+        return True
+
+    async def _stream(self, writer: asyncio.StreamWriter, messages: list[BaseMessage], task_type: str | None, include_usage: bool,
+                      schedule: dict) -> bool:
+        try:
+            stream, model = await self.switcher.astream_task(messages, task_type, **schedule)
+        except Exception as e:
+            await self._upstream_error(writer, e)
+            return True
+        base = {"id": f"chatcmpl-{uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+        def event(delta: dict, finish_reason: str | None = None, **extra) -> bytes:
+            data = json.dumps({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra})
+            return b"data: " + data.encode() + b"\n\n"
+
+        def chunk(data: bytes):
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     f"Transfer-Encoding: chunked\r\n{self._connection_header()}\r\n".encode())
+        text = []
+        try:
+            chunk(event({"role": "assistant", "content": ""}))
+            async for piece in stream:
+                text.append(piece)
+                chunk(event({"content": piece}))
+                await writer.drain()
+            chunk(event({}, "stop"))
+            if include_usage:
+                usage = self._usage(messages, stream.model, "".join(text))
+                chunk(b"data: " + json.dumps({**base, "choices": [], "usage": usage}).encode() + b"\n\n")
+        except Exception as e:
+            # Headers are out, so the failure is reported in-band
+            logger.warning("Gateway stream failed after %d chunks: %s", len(text), e)
+            chunk(b"data: " + json.dumps({"error": {"message": f"{e}", "type": "server_error"}}).encode() + b"\n\n")
+        finally:
+            await stream.aclose()
+        chunk(b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return not self.draining
+
+    def _connection_header(self) -> str:
+        return "Connection: close\r\n" if self.draining else ""
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n{self._connection_header()}\r\n".encode() + data)
+        await writer.drain()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, status: int, message: str, kind: str = "invalid_request_error",
+                          keep_alive: bool = True):
+        data = json.dumps({"error": {"message": message, "type": kind, "code": status}}).encode()
+        connection = "" if keep_alive and not self.draining else "Connection: close\r\n"
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n{connection}\r\n".encode() + data)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", default="models.json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--max-concurrency", type=int, help="Upstream requests per worker; the rest queue by priority and tenant")
+    parser.add_argument("--api-key", action="append", help="Bearer token clients must send; repeat for several. "
+                                                           "Defaults to the comma-separated GATEWAY_API_KEYS.")
+    args = parser.parse_args()
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    api_keys = args.api_key or [key for key in os.getenv("GATEWAY_API_KEYS", "").split(",") if key] or None
+
+    def switcher() -> LLMSwitcher:
+        scheduler = Scheduler(args.max_concurrency) if args.max_concurrency else None
+        return LLMSwitcher(load_llms(args.models), scheduler=scheduler)
+
+    gateway = Gateway(switcher, host=args.host, port=args.port, workers=args.workers,
+                      api_keys=api_keys, drain_timeout=args.drain_timeout)
+    gateway.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+from typing import Callable, Literal
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+State = Literal["closed", "open", "half_open"]
+
+
+class CircuitBreaker:
+    """Health of one model: error-rate and latency EWMAs plus a closed/open/half-open breaker."""
+    def __init__(self, key: str, alpha: float):
+        self.key = key
+        self.alpha = alpha
+        self.state: State = "closed"
+        self.error_rate = 0.0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.trial_started = float("-inf")
+
+    def observe(self, ok: bool, latency: float | None):
+        self.requests += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+
+    def snapshot(self, now: float) -> dict:
+        retry_in = max(0.0, self.opened_at + self.cooldown - now) if self.state == "open" else 0.0
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate, 4),
+            "latency_ewma": None if self.latency is None else round(self.latency, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": round(retry_in, 3),
+        }
+
+
+class HealthMonitor:
+    def __init__(self, failure_threshold: int = 3, error_rate_threshold: float = 0.5, min_requests: int = 10,
+                 cooldown: float = 30.0, max_cooldown: float = 600.0, alpha: float = 0.2,
+                 slow_latency: float | None = None, probe: Callable[[dict], object] | None = None):
+        """Per-model circuit breakers and health scores for `LLMSwitcher`.
+
+        A breaker opens after `failure_threshold` consecutive failures, or when the
+        error-rate EWMA passes `error_rate_threshold` once `min_requests` calls were
+        seen. Open models are skipped without a request. After `cooldown` seconds a
+        background probe checks the provider; a passing probe half-opens the
+        breaker so the next real request is a trial, which closes it again on
+        success. Each failed trial doubles the cooldown up to `max_cooldown`.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the breaker.
+            error_rate_threshold (float): Error-rate EWMA that opens the breaker.
+            min_requests (int): Calls needed before the error rate is trusted.
+            cooldown (float): Seconds a breaker stays open before it is probed.
+            max_cooldown (float): Upper bound for the backed-off cooldown.
+            alpha (float): EWMA smoothing factor for error rate and latency.
+            slow_latency (float | None): Latency EWMA (seconds) above which a model's
+                rank score is scaled down in proportion. None ranks on errors only.
+            probe (Callable[[dict], object] | None): Health check run in the background
+                with the `llms` entry; raising marks the provider as still down.
+                Defaults to the adapter's `available_models()`, which costs no tokens.
+        """
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.slow_latency = slow_latency
+        self.probe = probe or self._default_probe
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._entries: dict[str, dict] = {}
+        # id(entry) -> rank multiplier, only for models that are not fully healthy
+        self.penalties: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._prober = None
+
+    def key(self, entry: dict) -> str:
+        return f"{entry['llm'].name.lower()}:{entry['llm'].model}"
+
+    def _breaker(self, entry: dict) -> CircuitBreaker:
+        key = self.key(entry)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(key, self.alpha)
+            self._entries[key] = entry
+        return breaker
+
+    def _default_probe(self, entry: dict):
+        # Adapters without a model listing are simply half-opened after the cooldown
+        available_models = getattr(entry["llm"], "available_models", None)
+        if available_models is not None:
+            available_models()
+
+    def _score(self, breaker: CircuitBreaker) -> float:
+        if breaker.state == "open":
+            return 0.0
+        if breaker.state == "half_open":
+            # The probe passed; rank it on its merits so the trial request actually happens
+            return 1.0
+        score = 1.0 - breaker.error_rate
+        if self.slow_latency and breaker.latency and breaker.latency > self.slow_latency:
+            score *= self.slow_latency / breaker.latency
+        return score
+
+    def _rescore(self, breaker: CircuitBreaker):
+        # Copy-on-write so ranking reads the penalties without the lock
+        entry_id = id(self._entries[breaker.key])
+        score = self._score(breaker)
+        if score >= 0.99:
+            if entry_id in self.penalties:
+                self.penalties = {k: v for k, v in self.penalties.items() if k != entry_id}
+        elif self.penalties.get(entry_id) != score:
+            self.penalties = {**self.penalties, entry_id: score}
+
+    def _open(self, breaker: CircuitBreaker, now: float, backoff: bool = False):
+        if backoff or breaker.state == "half_open":
+            breaker.cooldown = min(self.max_cooldown, max(self.base_cooldown, breaker.cooldown * 2))
+        else:
+            breaker.cooldown = self.base_cooldown
+        breaker.state = "open"
+        breaker.opened_at = now
+        self._start_prober()
+
+    def available(self, entry: dict) -> bool:
+        """Whether `allow` would let a request through now, without claiming a half-open breaker's trial."""
+        breaker = self._breakers.get(self.key(entry))
+        if breaker is None or breaker.state == "closed":
+            return True
+        with self._lock:
+            return breaker.state == "half_open" and not self._trial_running(breaker, time.monotonic())
+
+    def _trial_running(self, breaker: CircuitBreaker, now: float) -> bool:
+        # A trial that never reports back expires after the cooldown
+        return now - breaker.trial_started < max(self.base_cooldown, breaker.cooldown)
+
+    def allow(self, entry: dict) -> bool:
+        """Claim a request to this model; call it only right before the request is sent.
+
+        Open breakers say no without touching the network. A half-open breaker lets
+        one trial through at a time, so use `available` to only look.
+        """
+        breaker = self._breakers.get(self.key(entry))
+        if breaker is None or breaker.state == "closed":
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if breaker.state == "open" or self._trial_running(breaker, now):
+                return False
+            breaker.trial_started = now
+            return True
+
+    def closed(self, entry: dict) -> bool:
+        """Whether the model's breaker is closed, i.e. retrying it is worthwhile."""
+        breaker = self._breakers.get(self.key(entry))
+        return breaker is None or breaker.state == "closed"
+
+    def record_success(self, entry: dict, latency: float | None = None):
+        with self._lock:
+            breaker = self._breaker(entry)
+            breaker.observe(True, latency)
+            if breaker.state == "half_open":
+                breaker.state = "closed"
+                breaker.cooldown = 0.0
+                # A recovered model starts with a clean error rate instead of ranking low for a while
+                breaker.error_rate = 0.0
+            self._rescore(breaker)
+
+    def record_failure(self, entry: dict, latency: float | None = None):
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breaker(entry)
+            breaker.observe(False, latency)
+            if breaker.state == "half_open" or (
+                breaker.state == "closed" and (
+                    breaker.consecutive_failures >= self.failure_threshold
+                    or (breaker.requests >= self.min_requests and breaker.error_rate >= self.error_rate_threshold)
+                )
+            ):
+                self._open(breaker, now)
+            self._rescore(breaker)
+
+    def state(self, entry: dict) -> State:
+        breaker = self._breakers.get(self.key(entry))
+        return "closed" if breaker is None else breaker.state
+
+    def snapshot(self) -> dict[str, dict]:
+        """Breaker state and health numbers per model ("provider:model"), for dashboards."""
+        now = time.monotonic()
+        with self._lock:
+            return {key: breaker.snapshot(now) for key, breaker in self._breakers.items()}
+
+    def reset(self, entry: dict):
+        """Forget a model's history and close its breaker, e.g. after a manual fix."""
+        with self._lock:
+            key = self.key(entry)
+            if key in self._breakers:
+                del self._breakers[key]
+                self.penalties = {k: v for k, v in self.penalties.items() if k != id(self._entries.pop(key))}
+
+    def _start_prober(self):
+        # Called with the lock held; the prober only runs while some breaker is open
+        self._wake.set()
+        if self._prober is None:
+            self._prober = threading.Thread(target=self._probe_loop, name="health-probe", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                opened = [(key, breaker) for key, breaker in self._breakers.items() if breaker.state == "open"]
+                if not opened:
+                    self._prober = None
+                    return
+            due = [(key, breaker) for key, breaker in opened if now >= breaker.opened_at + breaker.cooldown]
+            for key, breaker in due:
+                try:
+                    self.probe(self._entries[key])
+                    passed = True
+                except Exception as e:
+                    logger.warning("Health probe failed for %s: %s", key, e)
+                    passed = False
+                with self._lock:
+                    if breaker.state != "open":
+                        continue
+                    if passed:
+                        breaker.state = "half_open"
+                        breaker.trial_started = float("-inf")
+                        self._rescore(breaker)
+                    else:
+                        self._open(breaker, time.monotonic(), backoff=True)
+            with self._lock:
+                waits = [b.opened_at + b.cooldown - time.monotonic() for b in self._breakers.values() if b.state == "open"]
+            if waits:
+                self._wake.wait(max(0.05, min(waits)))
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Iterable, Iterator
+import contextvars
+import logging
+import asyncio
+import time
+
+from src.telemetry import current_span
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    def __init__(self, delay: float = 0.5, percentile: float | None = None, max_parallel: int = 2, window: int = 200, min_samples: int = 20):
+        """
+        Args:
+            delay (float): Seconds to wait for the primary model before sending a backup request.
+            percentile (float | None): If set (e.g. 95), hedge after this percentile of the
+                primary model's observed latency instead of the fixed delay, once
+                `min_samples` latencies have been recorded.
+            max_parallel (int): Maximum number of models racing at the same time.
+            window (int): Number of recent latencies kept per model.
+            min_samples (int): Samples needed before the percentile delay is trusted.
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.max_parallel = max(1, max_parallel)
+        self.min_samples = min_samples
+        self.latencies: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, model: str, latency: float):
+        self.latencies[model].append(latency)
+
+    def hedge_delay(self, model: str) -> float:
+        """Seconds to wait on `model` before hedging to the next candidate."""
+        samples = self.latencies.get(model)
+        if self.percentile is None or not samples or len(samples) < self.min_samples:
+            return self.delay
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def _timed(self, selected: dict, call: Callable[[dict], Any]):
+        start = time.perf_counter()
+        result = call(selected)
+        self.record(selected["llm"].model, time.perf_counter() - start)
+        return result
+
+    async def _atimed(self, selected: dict, call: Callable[[dict], Awaitable[Any]]):
+        start = time.perf_counter()
+        result = await call(selected)
+        self.record(selected["llm"].model, time.perf_counter() - start)
+        return result
+
+    def _next(self, candidates: Iterator[dict], deferred: list[dict], admit: Callable[[dict, bool], bool] | None,
+              wait: bool) -> dict | None:
+        """The next candidate to send, claimed with `admit`; one that cannot be claimed without waiting is deferred."""
+        for selected in candidates:
+            if admit is None or admit(selected, False):
+                return selected
+            deferred.append(selected)
+        while wait and deferred:
+            selected = deferred.pop(0)
+            if admit(selected, True):
+                return selected
+        return None
+
+    async def _anext(self, candidates: Iterator[dict], deferred: list[dict], admit: Callable[[dict, bool], Awaitable[bool]] | None,
+                     wait: bool) -> dict | None:
+        for selected in candidates:
+            if admit is None or await admit(selected, False):
+                return selected
+            deferred.append(selected)
+        while wait and deferred:
+            selected = deferred.pop(0)
+            if await admit(selected, True):
+                return selected
+        return None
+
+    def run(self, candidates: Iterable[dict], call: Callable[[dict], Any],
+            admit: Callable[[dict, bool], bool] | None = None) -> tuple[dict, Any]:
+        """Race `call` over the ranked candidates and return (winner, result).
+
+        The next candidate is launched when the newest one has not answered
+        within its hedge delay (a hedge), or as soon as a running attempt fails.
+        Candidates are only pulled from `candidates` at that point, so the
+        primary request never waits on the lookahead. `admit(candidate, wait)`
+        claims a candidate right before it is sent (e.g. its rate-limit tokens)
+        and returns False to pass it over; it is only asked to wait when nothing
+        else is in flight, and a hedge never waits. Losers still queued are
+        cancelled; ones already on the wire are abandoned and their results
+        discarded.
+        """
+        candidates = iter(candidates)
+        deferred = []
+        running = {}
+        errors = []
+        span = current_span()
+        executor = ThreadPoolExecutor(max_workers=self.max_parallel)
+
+        def launch(selected: dict):
+            # Each attempt runs with the caller's context, e.g. its telemetry span
+            running[executor.submit(contextvars.copy_context().run, self._timed, selected, call)] = selected
+
+        try:
+            newest = self._next(candidates, deferred, admit, wait=True)
+            if newest is not None:
+                launch(newest)
+            hedging = True
+            while running:
+                timeout = self.hedge_delay(newest["llm"].model) if hedging and len(running) < self.max_parallel else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    selected = self._next(candidates, deferred, admit, wait=False)
+                    if selected is None:
+                        # Only candidates that need waiting are left; they stay for failover
+                        hedging = False
+                        continue
+                    span.hedged(selected)
+                    launch(selected)
+                    newest = selected
+                    continue
+                for future in done:
+                    selected = running.pop(future)
+                    try:
+                        return selected, future.result()
+                    except Exception as e:
+                        logger.warning("Error with %s: %s", selected["llm"].model, e)
+                        errors.append(e)
+                selected = self._next(candidates, deferred, admit, wait=not running)
+                if selected is not None:
+                    launch(selected)
+                    newest = selected
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise RuntimeError("All suitable LLMs failed for this task") from (errors[-1] if errors else None)
+
+    async def arun(self, candidates: Iterable[dict], call: Callable[[dict], Awaitable[Any]],
+                   admit: Callable[[dict, bool], Awaitable[bool]] | None = None) -> tuple[dict, Any]:
+        """Async counterpart of `run`, with an async `admit`; losing requests are cancelled outright."""
+        candidates = iter(candidates)
+        deferred = []
+        running = {}
+        errors = []
+        span = current_span()
+        try:
+            newest = await self._anext(candidates, deferred, admit, wait=True)
+            if newest is not None:
+                running[asyncio.ensure_future(self._atimed(newest, call))] = newest
+            hedging = True
+            while running:
+                timeout = self.hedge_delay(newest["llm"].model) if hedging and len(running) < self.max_parallel else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    selected = await self._anext(candidates, deferred, admit, wait=False)
+                    if selected is None:
+                        hedging = False
+                        continue
+                    span.hedged(selected)
+                    running[asyncio.ensure_future(self._atimed(selected, call))] = selected
+                    newest = selected
+                    continue
+                for task in done:
+                    selected = running.pop(task)
+                    try:
+                        return selected, task.result()
+                    except Exception as e:
+                        logger.warning("Error with %s: %s", selected["llm"].model, e)
+                        errors.append(e)
+                selected = await self._anext(candidates, deferred, admit, wait=not running)
+                if selected is not None:
+                    running[asyncio.ensure_future(self._atimed(selected, call))] = selected
+                    newest = selected
+        finally:
+            for task in running:
+                task.cancel()
+        raise RuntimeError("All suitable LLMs failed for this task") from (errors[-1] if errors else None)
@@ -0,0 +1,283 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+from hashlib import sha256
+from io import BytesIO
+import threading
+import tempfile
+import requests
+import weakref
+import base64
+import mmap
+import os
+import re
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Raw bytes per streamed base64 chunk; a multiple of 3 so chunks encode without padding
+CHUNK_SIZE = 3 * 2**16
+
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class ImageCache:
+    """Process-wide LRU of image data by content hash, bounded by total size.
+
+    Holds base64 encodings, downloaded URLs and downscaled images, so an image
+    sent on every turn of a conversation is read and encoded once, and
+    messages only hold a reference to it.
+    """
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[tuple, bytes | str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | str | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: bytes | str):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+IMAGE_CACHE = ImageCache()
+
+
+class ImageSource:
+    """An image read only when a request needs it.
+
+    Files are memory-mapped and URLs downloaded on first use; base64 given by
+    the caller is passed through unchanged. The base64 encoding is cached in
+    `IMAGE_CACHE` by content hash, and adapters stream large images into the
+    request body without building the string at all.
+
+    With `downscale`, images larger than the provider's maximum resolution
+    (or `downscale` pixels on the longer side, if it is an int) are resized
+    locally before sending; this needs Pillow.
+    """
+    def __init__(self, path: str | None = None, url: str | None = None, base64_data: str | None = None,
+                 data: bytes | None = None, downscale: bool | int = False):
+        if downscale and Image is None:
+            raise ImportError("Downscaling images needs Pillow: pip install pillow")
+        self.path = path
+        self.url = url
+        self.base64_data = base64_data
+        self.data = data
+        self.downscale = downscale
+        self._digest: str | None = None
+        self._stat: tuple[int, int] | None = None
+        self._parent: tuple[ImageSource, int] | None = None
+        # A downloaded URL too large for IMAGE_CACHE, kept in a temporary file instead
+        self._spooled: str | None = None
+        self._spool_lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, source: str, downscale: bool | int = False) -> "ImageSource":
+        """A source for a URL or a file path."""
+        if re.match(r'^https?://', source):
+            return cls(url=source, downscale=downscale)
+        if re.match(r'^([./~]|([a-zA-Z]:)|\\|//)?\.?/?[a-zA-Z0-9._-]+(\.[a-zA-Z0-9]+)?$', source) or os.path.isfile(source):
+            return cls(path=source, downscale=downscale)
+        raise ValueError("Invalid image source. Must be a URL or file path.")
+
+    def __repr__(self):
+        origin = self.path or self.url or ("base64" if self.base64_data is not None else "bytes")
+        return f"ImageSource({origin})"
+
+    def __str__(self) -> str:
+        return self.base64()
+
+    @contextmanager
+    def _view(self) -> Iterator[memoryview]:
+        """The raw image bytes, memory-mapped for files."""
+        if self._parent is not None:
+            yield memoryview(self._resized())
+        elif self.path is not None:
+            with _mapped(self.path) as view:
+                yield view
+        elif self.url is not None:
+            data = IMAGE_CACHE.get(("url", self.url)) if self._spooled is None else None
+            if data is None and self._spooled is None:
+                data = self._download()
+            if data is not None:
+                yield memoryview(data)
+            else:
+                with _mapped(self._spooled) as view:
+                    yield view
+        elif self.base64_data is not None:
+            yield memoryview(base64.b64decode(self.base64_data))
+        else:
+            yield memoryview(self.data or b"")
+
+    def _download(self) -> bytes | None:
+        """Fetch the URL into IMAGE_CACHE, or into a temporary file when it is too large for it (then None)."""
+        with self._spool_lock:
+            if self._spooled is not None:
+                return None
+            data = IMAGE_CACHE.get(("url", self.url))
+            if data is not None:
+                return data
+            with requests.get(self.url, stream=True) as response:
+                chunks, size = [], 0
+                body = response.iter_content(CHUNK_SIZE)
+                for chunk in body:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > IMAGE_CACHE.max_bytes:
+                        # Every later read (digest, MIME type, encoding) maps the file instead of downloading again
+                        fd, path = tempfile.mkstemp(prefix="llm-image-")
+                        weakref.finalize(self, os.remove, path)
+                        with os.fdopen(fd, "wb") as f:
+                            f.writelines(chunks)
+                            for chunk in body:
+                                f.write(chunk)
+                        self._spooled = path
+                        return None
+            data = b"".join(chunks)
+            IMAGE_CACHE.put(("url", self.url), data)
+            return data
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the content; recomputed for files that changed on disk."""
+        if self.path is not None and self._parent is None:
+            stat = os.stat(self.path)
+            if (stat.st_mtime_ns, stat.st_size) != self._stat:
+                self._stat, self._digest = (stat.st_mtime_ns, stat.st_size), None
+        if self._digest is None:
+            if self._parent is not None:
+                parent, max_side = self._parent
+                self._digest = f"{parent.digest}@{max_side}"
+            elif self.base64_data is not None:
+                self._digest = "b64:" + sha256(self.base64_data.encode()).hexdigest()
+            else:
+                with self._view() as view:
+                    self._digest = sha256(view).hexdigest()
+        return self._digest
+
+    @property
+    def mime_type(self) -> str:
+        """Sniffed from the first bytes; JPEG when unknown."""
+        with self._view() as view:
+            head = bytes(view[:12])
+        for magic, mime in _MAGIC:
+            if head.startswith(magic):
+                return mime
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return "image/webp"
+        return "image/jpeg"
+
+    def size(self) -> int:
+        """Raw image bytes."""
+        if self.path is not None and self._parent is None:
+            return os.path.getsize(self.path)
+        if self._spooled is not None:
+            return os.path.getsize(self._spooled)
+        with self._view() as view:
+            return view.nbytes
+
+    def fit(self, max_side: int | None = None) -> "ImageSource":
+        """This image as it should be sent to a provider whose maximum resolution is `max_side` (None: no known limit)."""
+        if not self.downscale or self.base64_data is not None:
+            return self
+        limit = self.downscale if self.downscale is not True else max_side
+        if limit is None:
+            return self
+        resized = ImageSource()
+        resized._parent = (self, limit)
+        return resized
+
+    def _resized(self) -> bytes:
+        parent, max_side = self._parent
+        key = ("resized", parent.digest, max_side)
+        data = IMAGE_CACHE.get(key)
+        if data is None:
+            with parent._view() as view:
+                data = _downscale(view, max_side)
+            IMAGE_CACHE.put(key, data)
+        return data
+
+    def base64(self) -> str:
+        """The base64 encoding, from the cache when this content was encoded before."""
+        if self.base64_data is not None:
+            return self.base64_data
+        key = ("b64", self.digest)
+        encoded = IMAGE_CACHE.get(key)
+        if encoded is None:
+            with self._view() as view:
+                encoded = base64.b64encode(view).decode("ascii")
+            IMAGE_CACHE.put(key, encoded)
+        return encoded
+
+    def base64_length(self) -> int:
+        if self.base64_data is not None:
+            return len(self.base64_data)
+        return 4 * -(-self.size() // 3)
+
+    def iter_base64(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """The base64 encoding in ASCII chunks, encoded on the fly unless it is cached."""
+        cached = self.base64_data if self.base64_data is not None else IMAGE_CACHE.get(("b64", self.digest))
+        if cached is not None:
+            step = 4 * chunk_size // 3
+            for start in range(0, len(cached), step):
+                yield cached[start:start + step].encode("ascii")
+            return
+        with self._view() as view:
+            for start in range(0, view.nbytes, chunk_size):
+                yield base64.b64encode(view[start:start + chunk_size])
+
+
+@contextmanager
+def _mapped(path: str) -> Iterator[memoryview]:
+    """A file's bytes, memory-mapped."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def _downscale(data: memoryview, max_side: int) -> bytes:
+    """`data` resized to fit `max_side` pixels, in its own format (PNG for formats Pillow cannot write back)."""
+    with Image.open(BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return bytes(data)
+        image_format = image.format if image.format in ("JPEG", "PNG", "WEBP") else "PNG"
+        image.thumbnail((max_side, max_side))
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format=image_format, **({"quality": 85} if image_format != "PNG" else {"optimize": True}))
+        return output.getvalue()
@@ -1,19 +1,82 @@
 from abc import ABC,abstractmethod
-from src.message import AIMessage
-from typing import Generator
+from src.inference.pool import ConnectionPool,get_default_pool
+from src.prompt_cache import PromptCache,Prefix
+from src.tokenizer import family_of
+from src.message import AIMessage,BaseMessage
+from httpx import Client,AsyncClient,Response
+from typing import Generator,AsyncGenerator
+from json import JSONDecodeError,loads
+import asyncio
+
+def error_message(response:Response)->str:
+    '''The provider's `error.message` from an error response, or its raw body when that is not JSON (e.g. a proxy's HTML page).'''
+    try:
+        return loads(response.text)['error']['message']
+    except (JSONDecodeError,KeyError,TypeError):
+        return response.text
 
 class BaseInference(ABC):
-    def __init__(self,model:str='',api_key:str='',base_url:str='',temperature:float=0.5):
+    # Providers that only speak HTTP/1.1 (e.g. a local Ollama) set this to False
+    http2=True
+    # Tracks message prefixes for the provider's prompt cache; None where there is none
+    prompt_cache_type=PromptCache
+
+    def __init__(self,model:str='',api_key:str='',base_url:str='',temperature:float=0.5,pool:ConnectionPool|None=None,
+                 prompt_cache:PromptCache|bool=True):
         self.name=self.__class__.__name__.replace('Chat','')
         self.model=model
         self.api_key=api_key
         self.base_url=base_url
         self.temperature=temperature
         self.headers={'Content-Type': 'application/json'}
+        self.pool=pool or get_default_pool()
+        if prompt_cache is True:
+            prompt_cache=self.prompt_cache_type and self.prompt_cache_type()
+        self.prompt_cache=prompt_cache or None
+
+    def client(self,url:str)->Client:
+        '''Pooled keep-alive client for the host of `url`.'''
+        return self.pool.client(url,http2=self.http2)
+
+    def async_client(self,url:str)->AsyncClient:
+        '''Pooled keep-alive async client for the host of `url`, bound to the running loop.'''
+        return self.pool.async_client(url,http2=self.http2)
+
+    def _observe_prefixes(self,messages:list[BaseMessage])->list[Prefix]:
+        '''Record a request with the prompt cache; returns its stable prefixes, longest first.'''
+        if self.prompt_cache is None:
+            return []
+        return self.prompt_cache.observe(messages,family_of(self))
+
+    def close(self):
+        self.pool.close()
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*exc):
+        await self.aclose()
 
     @abstractmethod
     def invoke(self,messages:list[dict])->AIMessage:
         pass
-    
+
+    async def ainvoke(self,*args,**kwargs)->AIMessage:
+        '''Adapters without a native async transport run `invoke` in a worker thread.'''
+        return await asyncio.to_thread(self.invoke,*args,**kwargs)
+
     def stream(self,messages:list[dict])->Generator[str,None,None]:
-        pass
\ No newline at end of file
+        pass
+
+    async def astream(self,messages:list[dict])->AsyncGenerator[str,None]:
+        raise NotImplementedError(f'{self.name} does not support async streaming')
+        yield
@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator
+from json import loads
+import time
+
+from src.inference.encoding import dumps
+from src.message import AIMessage, BaseMessage
+
+
+class BatchAPI(ABC):
+    """Provider batch endpoints: many chat requests submitted at once, answered within hours at a discount.
+
+    Adapters mix this in next to their `_payload` and `_parse`. Requests are
+    (custom_id, messages) pairs and results are keyed by the same ids; a
+    request that failed on the provider side maps to an exception.
+    """
+    @abstractmethod
+    def submit_batch(self, requests: Iterable[tuple[str, list[BaseMessage]]], json: bool = False) -> str:
+        """Submit the requests as one provider batch and return its id."""
+
+    @abstractmethod
+    def batch_status(self, batch_id: str) -> dict:
+        """{"id", "state" (the provider's own name), "done"}; `done` means no more results will come."""
+
+    @abstractmethod
+    def batch_results(self, batch_id: str, json: bool = False) -> dict[str, AIMessage | Exception]:
+        """Answers of a finished batch by custom id. Requests the provider never ran are missing."""
+
+    @abstractmethod
+    def cancel_batch(self, batch_id: str):
+        """Stop a running batch; requests already answered keep their results."""
+
+    def wait_batch(self, batch_id: str, json: bool = False, poll_interval: float = 60.0,
+                   timeout: float | None = None) -> dict[str, AIMessage | Exception]:
+        """Poll until the batch is done, then return its results."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.batch_status(batch_id)["done"]:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Batch {batch_id} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+        return self.batch_results(batch_id, json)
+
+
+class OpenAIBatchAPI(BatchAPI):
+    """OpenAI's Files + Batches API, which Groq serves unchanged.
+
+    The requests are written as a JSONL file, uploaded with purpose "batch"
+    and referenced by a batch job; answers and per-request errors come back
+    as output and error JSONL files.
+    """
+    batch_endpoint = "/v1/chat/completions"
+    batch_done_states = frozenset({"completed", "failed", "expired", "cancelled"})
+    batch_file_fields = ("output_file_id", "error_file_id")
+
+    @abstractmethod
+    def _batch_root(self) -> str:
+        """API root (".../v1") the files and batches paths hang off."""
+
+    def _batch_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _batch_line(self, custom_id: str, messages: list[BaseMessage], json: bool) -> dict:
+        return {"custom_id": custom_id, "method": "POST", "url": self.batch_endpoint, "body": self._payload(messages, json)}
+
+    def _upload(self, lines: list[dict]) -> str:
+        url = f"{self._batch_root()}/files"
+        content = b"".join(dumps(line) + b"\n" for line in lines)
+        response = self.client(url).post(url, headers=self._batch_headers(), data={"purpose": "batch"},
+                                         files={"file": ("batch.jsonl", content, "application/jsonl")})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _create_batch(self, file_id: str) -> str:
+        url = f"{self._batch_root()}/batches"
+        body = {"input_file_id": file_id, "endpoint": self.batch_endpoint, "completion_window": "24h"}
+        response = self.client(url).post(url, headers=self._batch_headers(), json=body)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _batch_url(self, batch_id: str) -> str:
+        return f"{self._batch_root()}/batches/{batch_id}"
+
+    def _get_batch(self, batch_id: str) -> dict:
+        url = self._batch_url(batch_id)
+        response = self.client(url).get(url, headers=self._batch_headers())
+        response.raise_for_status()
+        return response.json()
+
+    def _download(self, file_id: str) -> Iterator[dict]:
+        url = f"{self._batch_root()}/files/{file_id}/content"
+        response = self.client(url).get(url, headers=self._batch_headers())
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            if line.strip():
+                yield loads(line)
+
+    def _batch_result(self, line: dict, json: bool) -> AIMessage | Exception:
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or (response.get("body") or {}).get("error") or {}
+            message = error.get("message", error) if isinstance(error, dict) else error
+            return RuntimeError(f"Batch request {line.get('custom_id')} failed: {message or response.get('status_code')}")
+        try:
+            return self._parse(response["body"], json)
+        except Exception as e:
+            return e
+
+    def submit_batch(self, requests: Iterable[tuple[str, list[BaseMessage]]], json: bool = False) -> str:
+        lines = [self._batch_line(custom_id, messages, json) for custom_id, messages in requests]
+        return self._create_batch(self._upload(lines))
+
+    def batch_status(self, batch_id: str) -> dict:
+        state = self._get_batch(batch_id)["status"]
+        return {"id": batch_id, "state": state, "done": state in self.batch_done_states}
+
+    def batch_results(self, batch_id: str, json: bool = False) -> dict[str, AIMessage | Exception]:
+        batch = self._get_batch(batch_id)
+        results = {}
+        for field in self.batch_file_fields:
+            if batch.get(field):
+                for line in self._download(batch[field]):
+                    results[line["custom_id"]] = self._batch_result(line, json)
+        return results
+
+    def cancel_batch(self, batch_id: str):
+        url = f"{self._batch_url(batch_id)}/cancel"
+        self.client(url).post(url, headers=self._batch_headers()).raise_for_status()
+
+
+class MistralBatchAPI(OpenAIBatchAPI):
+    """Mistral's batch jobs: the same JSONL upload, but the model is set on the job rather than per line."""
+    batch_done_states = frozenset({"SUCCESS", "FAILED", "TIMEOUT_EXCEEDED", "CANCELLED"})
+    batch_file_fields = ("output_file", "error_file")
+
+    def _batch_line(self, custom_id: str, messages: list[BaseMessage], json: bool) -> dict:
+        body = self._payload(messages, json)
+        body.pop("model", None)
+        body.pop("stream", None)
+        return {"custom_id": custom_id, "body": body}
+
+    def _create_batch(self, file_id: str) -> str:
+        url = f"{self._batch_root()}/batch/jobs"
+        body = {"input_files": [file_id], "model": self.model, "endpoint": self.batch_endpoint}
+        response = self.client(url).post(url, headers=self._batch_headers(), json=body)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _batch_url(self, batch_id: str) -> str:
+        return f"{self._batch_root()}/batch/jobs/{batch_id}"
+
+
+class GeminiBatchAPI(BatchAPI):
+    """Gemini's batchGenerateContent. Requests are sent inline (up to 20 MB per batch) and
+    the answers come back on the finished batch operation."""
+    batch_done_states = frozenset({"BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED"})
+
+    def _batch_root(self) -> str:
+        """API root (".../v1beta"); a `base_url` override keeps everything before "/models/"."""
+        if self.base_url:
+            return self.base_url.split("/models/")[0]
+        return "https://generativelanguage.googleapis.com/v1beta"
+
+    def _get_batch(self, batch_id: str) -> dict:
+        url = f"{self._batch_root()}/{batch_id}"
+        response = self.client(url).get(url, headers=self.headers, params={"key": self.api_key})
+        response.raise_for_status()
+        return response.json()
+
+    def _batch_state(self, operation: dict) -> str:
+        return (operation.get("metadata") or {}).get("state") or operation.get("state", "")
+
+    def submit_batch(self, requests: Iterable[tuple[str, list[BaseMessage]]], json: bool = False) -> str:
+        url = f"{self._batch_root()}/models/{self.model}:batchGenerateContent"
+        inlined = [{"request": self._payload(messages, json), "metadata": {"key": custom_id}} for custom_id, messages in requests]
+        body = {"batch": {"displayName": f"llm-router-{self.model}", "inputConfig": {"requests": {"requests": inlined}}}}
+        response = self.client(url).post(url, headers=self.headers, content=dumps(body), params={"key": self.api_key})
+        response.raise_for_status()
+        return response.json()["name"]
+
+    def batch_status(self, batch_id: str) -> dict:
+        operation = self._get_batch(batch_id)
+        state = self._batch_state(operation)
+        return {"id": batch_id, "state": state, "done": operation.get("done", False) or state in self.batch_done_states}
+
+    def batch_results(self, batch_id: str, json: bool = False) -> dict[str, AIMessage | Exception]:
+        output = self._get_batch(batch_id).get("response") or {}
+        results = {}
+        for answer in (output.get("inlinedResponses") or {}).get("inlinedResponses", []):
+            custom_id = (answer.get("metadata") or {}).get("key")
+            if answer.get("error"):
+                results[custom_id] = RuntimeError(f"Batch request {custom_id} failed: {answer['error'].get('message', answer['error'])}")
+                continue
+            try:
+                results[custom_id] = self._parse(answer["response"], json)
+            except Exception as e:
+                results[custom_id] = e
+        return results
+
+    def cancel_batch(self, batch_id: str):
+        url = f"{self._batch_root()}/{batch_id}:cancel"
+        self.client(url).post(url, headers=self.headers, params={"key": self.api_key}).raise_for_status()
@@ -0,0 +1,187 @@
+from typing import AsyncIterator, Callable, Iterator
+import json
+
+from src.image import ImageSource
+from src.message import BaseMessage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Images at least this large (raw bytes) are base64-encoded while the body is sent instead of inlined
+STREAM_IMAGES_FROM = 2**20
+
+_IMAGE_MARK = "\x00image\x00"
+
+
+def _materialize(obj):
+    if isinstance(obj, ImageSource):
+        return obj.base64()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps(obj, default: Callable) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def dumps(obj) -> bytes:
+    """Compact UTF-8 JSON, with orjson when it is installed. Images are inlined as base64."""
+    return _dumps(obj, _materialize)
+
+
+class Fragment(dict):
+    """A message in one provider's wire form, serialized at most once.
+
+    It is a plain dict to anything that reads the payload (batch files,
+    `dumps`), while `encode_body` splices the cached bytes instead of
+    serializing it again. Images stay `ImageSource` references between the
+    bytes, so the cache never holds their base64. Fragments are shared between
+    requests; never mutate one.
+    """
+    __slots__ = ("_segments",)
+
+    def __init__(self, value: dict):
+        super().__init__(value)
+        self._segments: list[bytes | ImageSource] | None = None
+
+    @property
+    def segments(self) -> list[bytes | ImageSource]:
+        if self._segments is None:
+            images = []
+
+            def mark(obj):
+                if isinstance(obj, ImageSource):
+                    images.append(obj)
+                    return _IMAGE_MARK
+                return _materialize(obj)
+
+            raw = _dumps(self, mark)
+            parts = raw.split(_dumps(_IMAGE_MARK, mark))
+            if len(parts) != len(images) + 1:
+                # The marker also occurs in the text; inline the images instead
+                self._segments = [dumps(self)]
+            else:
+                self._segments = [parts[0]]
+                for image, part in zip(images, parts[1:]):
+                    self._segments += [image, part]
+        return self._segments
+
+
+class StreamingBody:
+    """A request body whose large images are base64-encoded while it is sent.
+
+    `length` is exact, so the request keeps a Content-Length instead of
+    chunked transfer encoding.
+    """
+    def __init__(self, pieces: list[bytes | ImageSource]):
+        self.pieces = pieces
+        self.length = sum(len(piece) if isinstance(piece, bytes) else piece.base64_length() + 2 for piece in pieces)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for piece in self.pieces:
+            if isinstance(piece, bytes):
+                yield piece
+            else:
+                yield b'"'
+                yield from piece.iter_base64()
+                yield b'"'
+
+    async def aiter(self) -> AsyncIterator[bytes]:
+        for chunk in self:
+            yield chunk
+
+
+def _segments(value) -> list[bytes | ImageSource]:
+    if isinstance(value, Fragment):
+        return value.segments
+    if isinstance(value, ImageSource):
+        return [value]
+    if isinstance(value, list) and any(isinstance(item, (Fragment, ImageSource)) for item in value):
+        segments = [b"["]
+        for i, item in enumerate(value):
+            if i:
+                segments.append(b",")
+            segments += _segments(item)
+        segments.append(b"]")
+        return segments
+    return [dumps(value)]
+
+
+def encode_body(payload: dict) -> bytes | StreamingBody:
+    """Serialize a request payload, reusing the bytes of every `Fragment` in its top-level values and lists.
+
+    Returns a `StreamingBody` when it carries an image of `STREAM_IMAGES_FROM`
+    bytes or more, else the bytes.
+    """
+    pieces: list[bytes | ImageSource] = []
+    pending = [b"{"]
+    for i, (key, value) in enumerate(payload.items()):
+        pending.append((b"," if i else b"") + dumps(key) + b":")
+        for segment in _segments(value):
+            if isinstance(segment, bytes):
+                pending.append(segment)
+            elif segment.base64_data is None and segment.size() >= STREAM_IMAGES_FROM:
+                pieces += [b"".join(pending), segment]
+                pending = []
+            else:
+                pending.append(dumps(segment.base64()))
+    pending.append(b"}")
+    if not pieces:
+        return b"".join(pending)
+    return StreamingBody(pieces + [b"".join(pending)])
+
+
+def request_body(payload: dict, headers: dict, asynchronous: bool = False) -> tuple[bytes | Iterator[bytes] | AsyncIterator[bytes], dict]:
+    """(content, headers) to send `payload` with httpx; a streamed body gets its Content-Length header here."""
+    body = encode_body(payload)
+    if isinstance(body, bytes):
+        return body, headers
+    return body.aiter() if asynchronous else iter(body), {**headers, "Content-Length": str(body.length)}
+
+
+Rule = Callable[[BaseMessage], tuple[str, dict] | None]
+
+
+class MessageEncoder:
+    """Converts messages to one provider's wire form, each message once.
+
+    `rules` maps message classes to functions returning (kind, wire dict), or
+    None to leave the message out; kind tells the adapter where it goes, e.g.
+    "system" vs "message". Subclasses use the rule of their nearest mapped base.
+    The result is cached on the message per encoder and reused while its
+    `content` is the same object, so a growing conversation only encodes its
+    new turns.
+    """
+    def __init__(self, name: str, rules: dict[type, Rule]):
+        self.name = name
+        self._rules: dict[type, Rule | None] = dict(rules)
+
+    def _rule(self, cls: type) -> Rule | None:
+        try:
+            return self._rules[cls]
+        except KeyError:
+            rule = next((self._rules[base] for base in cls.__mro__ if base in self._rules), None)
+            self._rules[cls] = rule
+            return rule
+
+    def __call__(self, message: BaseMessage) -> tuple[str, Fragment] | None:
+        cache = message.__dict__.get("_encoded")
+        if cache is None:
+            cache = message._encoded = {}
+        content = message.content
+        hit = cache.get(self.name)
+        if hit is not None and hit[0] is content:
+            return hit[1]
+        rule = self._rule(type(message))
+        encoded = rule(message) if rule is not None else None
+        if encoded is not None:
+            encoded = (encoded[0], Fragment(encoded[1]))
+        cache[self.name] = (content, encoded)
+        return encoded
+
+    def encode(self, messages: list[BaseMessage]) -> list[tuple[str, Fragment]]:
+        """(kind, fragment) for every message the provider takes, in order."""
+        return [encoded for encoded in map(self, messages) if encoded is not None]
@@ -1,238 +1,287 @@
-from requests import RequestException,HTTPError,ConnectionError
+from httpx import TransportError,HTTPStatusError,ConnectError
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
 from src.message import AIMessage,BaseMessage,HumanMessage,ImageMessage
 from typing import Generator,AsyncGenerator
 from src.inference import BaseInference
-from httpx import Client,AsyncClient
+from src.inference.stream_parser import iter_sse,aiter_sse,parse_json
+from src.inference.batch_api import GeminiBatchAPI
+from src.inference.encoding import MessageEncoder,request_body
+from src.prompt_cache import ContextCache,Prefix
+from src.tokenizer import family_of
 from json import loads
-import requests
+import logging
 
-class ChatGemini(BaseInference):
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json=False) -> AIMessage:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
-        params={'key':self.api_key}
-        contents=[]
-        system_instruct=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
-            else:
-                system_instruction={
-                    'parts':{
-                        'text': message.content
-                    }
-                }
+logger=logging.getLogger(__name__)
 
-        payload={
-            'contents': contents,
-            'generationConfig':{
-                'temperature': temperature,
-                'responseMimeType':'application/json' if json else 'text/plain'
-            }
-        }
-        if system_instruction:
-            payload['system_instruction']=system_instruction
-        try:
-            with Client() as client:
-                response=client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
-            # print(json_obj)
-            if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
-            if json:
-                content=loads(json_obj['candidates'][0]['content']['parts'][0]['text'])
-            else:
-                content=json_obj['candidates'][0]['content']['parts'][0]['text']
-            return AIMessage(content)
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    async def async_invoke(self, messages: list[BaseMessage],json=False) -> AIMessage:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
-        params={'key':self.api_key}
+# Gemini scales larger images down to fit this anyway
+MAX_IMAGE_SIDE=3072
+
+def _image(message:ImageMessage)->tuple[str,dict]:
+    text,image=message.content
+    image=image and image.fit(MAX_IMAGE_SIDE)
+    mime_type=image.mime_type if image else 'image/jpeg'
+    return 'message',{'role':'user','parts':[{'text':text},{'inline_data':{'mime_type':mime_type,'data':image}}]}
+
+ENCODER=MessageEncoder('gemini',{
+    HumanMessage:lambda message:('message',{'role':'user','parts':[{'text':message.content}]}),
+    AIMessage:lambda message:('message',{'role':'model','parts':[{'text':message.content}]}),
+    ImageMessage:_image,
+    BaseMessage:lambda message:('system',{'parts':{'text':message.content}}),
+})
+
+class ChatGemini(BaseInference,GeminiBatchAPI):
+    prompt_cache_type=ContextCache
+
+    def _url(self,method:str)->str:
+        return self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:{method}"
+
+    def _root(self)->str:
+        return self.base_url.split('/models/')[0] if self.base_url else "https://generativelanguage.googleapis.com/v1beta"
+
+    def _cache_step(self,messages:list[BaseMessage])->tuple[str,Prefix,str|None]|None:
+        if not isinstance(self.prompt_cache,ContextCache):
+            return None
+        # The cache holds the system instruction, so the cached prefix has to cover every system message
+        min_length=max((i+1 for i,message in enumerate(messages) if not isinstance(message,(HumanMessage,AIMessage,ImageMessage))),default=0)
+        return self.prompt_cache.plan(messages,family_of(self),min_length)
+
+    def _cache_request(self,action:str,prefix:Prefix,name:str|None,messages:list[BaseMessage])->tuple[str,str,dict,dict]:
+        '''(method, url, params, body) creating the cache for `prefix`, or extending cache `name`.'''
+        ttl=f'{self.prompt_cache.ttl:g}s'
+        if action=='create':
+            payload=self._payload(messages[:prefix.length])
+            body={'model':f'models/{self.model}','contents':payload['contents'],'ttl':ttl}
+            if 'system_instruction' in payload:
+                body['system_instruction']=payload['system_instruction']
+            return 'POST',f'{self._root()}/cachedContents',{'key':self.api_key},body
+        return 'PATCH',f'{self._root()}/{name}',{'key':self.api_key,'updateMask':'ttl'},{'ttl':ttl}
+
+    def _cache_done(self,action:str,prefix:Prefix,name:str|None,json_obj:dict)->str:
+        if action=='create':
+            name=json_obj['name']
+            self.prompt_cache.created(prefix,name)
+        else:
+            self.prompt_cache.refreshed(prefix)
+        return name
+
+    def _cache_failed(self,action:str,prefix:Prefix,err:Exception):
+        logger.warning('Context cache %s failed, sending uncached: %s',action,err)
+        self.prompt_cache.failed(prefix)
+
+    def _cache_rejected(self,cached:tuple[str,int]|None,err:HTTPStatusError):
+        # The provider dropped the cache before its local expiry; the next attempt goes uncached
+        if cached and err.response.status_code in (400,403,404):
+            self.prompt_cache.forget(cached[0])
+
+    def _cached_content(self,messages:list[BaseMessage])->tuple[str,int]|None:
+        '''(name, prefix length) of a `cachedContents` entry holding the stable prefix of `messages`, created or extended first if needed.'''
+        step=self._cache_step(messages)
+        if step is None:
+            return None
+        action,prefix,name=step
+        if action!='use':
+            method,url,params,body=self._cache_request(action,prefix,name,messages)
+            content,headers=request_body(body,self.headers)
+            try:
+                response=self.client(url).request(method,url,headers=headers,content=content,params=params)
+                response.raise_for_status()
+                name=self._cache_done(action,prefix,name,response.json())
+            except Exception as err:
+                self._cache_failed(action,prefix,err)
+                return None
+            except BaseException:
+                self.prompt_cache.failed(prefix)
+                raise
+        return name,prefix.length
+
+    async def _acached_content(self,messages:list[BaseMessage])->tuple[str,int]|None:
+        step=self._cache_step(messages)
+        if step is None:
+            return None
+        action,prefix,name=step
+        if action!='use':
+            method,url,params,body=self._cache_request(action,prefix,name,messages)
+            content,headers=request_body(body,self.headers,asynchronous=True)
+            try:
+                response=await self.async_client(url).request(method,url,headers=headers,content=content,params=params)
+                response.raise_for_status()
+                name=self._cache_done(action,prefix,name,response.json())
+            except Exception as err:
+                self._cache_failed(action,prefix,err)
+                return None
+            except BaseException:
+                self.prompt_cache.failed(prefix)
+                raise
+        return name,prefix.length
+
+    def release_caches(self):
+        '''Delete the context caches still alive instead of leaving them to expire; `close` does this.'''
+        if not isinstance(self.prompt_cache,ContextCache):
+            return
+        for name in self.prompt_cache.take_names():
+            url=f'{self._root()}/{name}'
+            try:
+                self.client(url).delete(url,params={'key':self.api_key}).raise_for_status()
+            except (HTTPStatusError,TransportError) as err:
+                logger.warning('Could not delete context cache %s: %s',name,err)
+
+    async def arelease_caches(self):
+        if not isinstance(self.prompt_cache,ContextCache):
+            return
+        for name in self.prompt_cache.take_names():
+            url=f'{self._root()}/{name}'
+            try:
+                (await self.async_client(url).delete(url,params={'key':self.api_key})).raise_for_status()
+            except (HTTPStatusError,TransportError) as err:
+                logger.warning('Could not delete context cache %s: %s',name,err)
+
+    def close(self):
+        self.release_caches()
+        super().close()
+
+    async def aclose(self):
+        await self.arelease_caches()
+        await super().aclose()
+
+    def _payload(self,messages:list[BaseMessage],json=False,cached:tuple[str,int]|None=None)->dict:
+        if cached:
+            messages=messages[cached[1]:]
         contents=[]
         system_instruction=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
+        for kind,fragment in ENCODER.encode(messages):
+            if kind=='system':
+                system_instruction=fragment
             else:
-                system_instruction={
-                    'parts':{
-                        'text': message.content
-                    }
-                }
+                contents.append(fragment)
 
         payload={
             'contents': contents,
             'generationConfig':{
-                'temperature': temperature,
+                'temperature': self.temperature,
                 'responseMimeType':'application/json' if json else 'text/plain'
             }
         }
         if system_instruction:
             payload['system_instruction']=system_instruction
+        if cached:
+            payload['cached_content']=cached[0]
+        return payload
+
+    def _parse(self,json_obj:dict,json=False)->AIMessage:
+        if json_obj.get('error'):
+            raise Exception(json_obj['error']['message'])
+        if json:
+            content=loads(json_obj['candidates'][0]['content']['parts'][0]['text'])
+        else:
+            content=json_obj['candidates'][0]['content']['parts'][0]['text']
+        usage=json_obj.get('usageMetadata')
+        if usage:
+            usage={
+                'prompt_tokens':usage.get('promptTokenCount',0),
+                'completion_tokens':usage.get('candidatesTokenCount',0),
+                'total_tokens':usage.get('totalTokenCount',0),
+                'cached_tokens':usage.get('cachedContentTokenCount',0)
+            }
+        return AIMessage(content,usage=usage)
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    def invoke(self, messages: list[BaseMessage],json=False) -> AIMessage:
+        url=self._url('generateContent')
+        params={'key':self.api_key}
+        cached=self._cached_content(messages)
+        payload=self._payload(messages,json,cached)
+        content,headers=request_body(payload,self.headers)
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
-            # print(json_obj)
-            if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
-            if json:
-                content=loads(json_obj['candidates'][0]['content']['parts'][0]['text'])
-            else:
-                content=json_obj['candidates'][0]['content']['parts'][0]['text']
-            return AIMessage(content)
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+            response=self.client(url).post(url=url,headers=headers,content=content,params=params)
+            response.raise_for_status()
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            self._cache_rejected(cached,err)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    async def ainvoke(self, messages: list[BaseMessage],json=False) -> AIMessage:
+        url=self._url('generateContent')
+        params={'key':self.api_key}
+        cached=await self._acached_content(messages)
+        payload=self._payload(messages,json,cached)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
+        try:
+            response=await self.async_client(url).post(url=url,headers=headers,content=content,params=params)
+            response.raise_for_status()
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            self._cache_rejected(cached,err)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async_invoke=ainvoke
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
     def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
-        '''Work in progress'''
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:streamGenerateContent"
+        url=self._url('streamGenerateContent')
         params={'alt':'sse','key':self.api_key}
-        contents=[]
-        system_instruction=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
-            else:
-                system_instruction={
-                    'parts':{
-                        'text': message.content
-                    }
-                }
+        cached=self._cached_content(messages)
+        payload=self._payload(messages,json,cached)
+        content,headers=request_body(payload,self.headers)
+        try:
+            with self.client(url).stream('POST',url=url,headers=headers,content=content,params=params) as response:
+                if response.is_error:
+                    response.read()
+                response.raise_for_status()
+                for data in iter_sse(response.iter_bytes()):
+                    chunk=parse_json(data)
+                    yield chunk['candidates'][0]['content']['parts'][0]['text']
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            self._cache_rejected(cached,err)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
 
-        payload={
-            'contents': contents,
-            'generationConfig':{
-                'temperature': temperature,
-                'responseMimeType':'application/json' if json else 'text/plain'
-            }
-        }
-        if system_instruction:
-            payload['system_instruction']=system_instruction
-        
+    async def astream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        url=self._url('streamGenerateContent')
+        params={'alt':'sse','key':self.api_key}
+        cached=await self._acached_content(messages)
+        payload=self._payload(messages,json,cached)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
         try:
-            response=requests.post(url=url,headers=headers,json=payload,params=params,stream=True)
-            response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            for chunk in chunks:
-                if chunk:
-                    chunk=loads(chunk.replace('data: ',''))
+            async with self.async_client(url).stream('POST',url=url,headers=headers,content=content,params=params) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                async for data in aiter_sse(response.aiter_bytes()):
+                    chunk=parse_json(data)
                     yield chunk['candidates'][0]['content']['parts'][0]['text']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
-    
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            self._cache_rejected(cached,err)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
     def available_models(self):
-        url='https://generativelanguage.googleapis.com/v1beta/models'
+        url=f'{self._root()}/models'
         headers=self.headers
         params={'key':self.api_key}
         try:
-            with Client() as client:
-                response=client.get(url=url,headers=headers,params=params)
+            response=self.client(url).get(url=url,headers=headers,params=params)
             response.raise_for_status()
             json_obj=response.json()
             models=json_obj['models']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
-        return [model['displayName'] for model in models]
\ No newline at end of file
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+        return [model['displayName'] for model in models]
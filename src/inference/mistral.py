@@ -1,109 +1,145 @@
 from src.message import AIMessage,BaseMessage,SystemMessage,ImageMessage,HumanMessage
-from requests import RequestException,HTTPError,ConnectionError
+from httpx import TransportError,HTTPStatusError,ConnectError
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
-from src.inference import BaseInference
-from httpx import Client,AsyncClient
-from typing import Generator
-from typing import Literal
+from src.inference import BaseInference,error_message
+from src.inference.stream_parser import iter_sse,aiter_sse,parse_json
+from src.inference.batch_api import MistralBatchAPI
+from src.inference.encoding import MessageEncoder,request_body
+from typing import Generator,AsyncGenerator
 from json import loads
-import requests
-import base64
+import logging
 
-class ChatMistral(BaseInference):
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json:bool=False)->AIMessage:
-        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.mistral.ai/v1/chat/completions"
-        contents=[]
-        for message in messages:
-            if isinstance(message,(SystemMessage,HumanMessage,AIMessage)):
-                contents.append(message.to_dict())
-            if isinstance(message,ImageMessage):
-                text,image_data=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':{
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image_url',
-                                'image_url':image_data
-                            }
-                        }
-                    }
-                ])
+logger=logging.getLogger(__name__)
+
+def _image(message:ImageMessage)->tuple[str,dict]:
+    text,image=message.content
+    return 'message',{'role':'user','content':[{'type':'text','text':text},{'type':'image_url','image_url':image and image.fit()}]}
+
+ENCODER=MessageEncoder('mistral',{
+    SystemMessage:lambda message:('message',message.to_dict()),
+    HumanMessage:lambda message:('message',message.to_dict()),
+    AIMessage:lambda message:('message',message.to_dict()),
+    ImageMessage:_image,
+})
+
+class ChatMistral(BaseInference,MistralBatchAPI):
+    def _url(self)->str:
+        return self.base_url or "https://api.mistral.ai/v1/chat/completions"
+
+    def _batch_root(self)->str:
+        return self._url().removesuffix('/chat/completions')
 
+    def _payload(self,messages:list[BaseMessage],json:bool=False,stream:bool=False)->dict:
+        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
+        contents=[fragment for _,fragment in ENCODER.encode(messages)]
         payload={
             "model": self.model,
             "messages": contents,
-            "temperature": temperature,
+            "temperature": self.temperature,
             "response_format": {
                 "type": "json_object" if json else "text"
             },
-            "stream":False,
-        }
-        try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
-            # print(json_object)
-            if json_object.get('error'):
-                raise Exception(json_object['error']['message'])
-            if json:
-                content=loads(json_object['choices'][0]['message']['content'])
-            else:
-                content=json_object['choices'][0]['message']['content']
-            return AIMessage(content)
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
-        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.groq.com/openai/v1/chat/completions"
-        messages=[message.to_dict() for message in messages]
-        payload={
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "stream":True,
+            "stream":stream,
         }
+        return payload
+
+    def _parse(self,json_object:dict,json:bool=False)->AIMessage:
+        if json_object.get('error'):
+            raise Exception(json_object['error']['message'])
         if json:
-            payload["response_format"]={
-                "type": "json_object"
-            }
+            content=loads(json_object['choices'][0]['message']['content'])
+        else:
+            content=json_object['choices'][0]['message']['content']
+        return AIMessage(content,usage=json_object.get('usage'))
+
+    def _delta(self,event:dict)->str|None:
+        choices=event.get('choices')
+        if choices:
+            return choices[0]['delta'].get('content','')
+        return None
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    def invoke(self, messages: list[BaseMessage],json:bool=False)->AIMessage:
+        url=self._url()
+        self._observe_prefixes(messages)
+        payload=self._payload(messages,json)
+        content,headers=request_body(payload,self.headers)
+        try:
+            response=self.client(url).post(url=url,content=content,headers=headers)
+            response.raise_for_status()
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',error_message(err.response),err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    async def ainvoke(self, messages: list[BaseMessage],json:bool=False)->AIMessage:
+        url=self._url()
+        self._observe_prefixes(messages)
+        payload=self._payload(messages,json)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
         try:
-            response=requests.post(url=url,json=payload,headers=headers,timeout=None)
+            response=await self.async_client(url).post(url=url,content=content,headers=headers)
             response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            for chunk in chunks:
-                chunk=chunk.replace('data: ','')
-                if chunk and chunk!='[DONE]':
-                    delta=loads(chunk)['choices'][0]['delta']
-                    yield delta.get('content','')
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',error_message(err.response),err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        url=self._url()
+        self._observe_prefixes(messages)
+        payload=self._payload(messages,json,stream=True)
+        content,headers=request_body(payload,self.headers)
+        try:
+            with self.client(url).stream('POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    response.read()
+                response.raise_for_status()
+                for data in iter_sse(response.iter_bytes()):
+                    delta=self._delta(parse_json(data))
+                    if delta is not None:
+                        yield delta
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',error_message(err.response),err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async def astream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        url=self._url()
+        self._observe_prefixes(messages)
+        payload=self._payload(messages,json,stream=True)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
+        try:
+            async with self.async_client(url).stream('POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                async for data in aiter_sse(response.aiter_bytes()):
+                    delta=self._delta(parse_json(data))
+                    if delta is not None:
+                        yield delta
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',error_message(err.response),err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
     def available_models(self):
-        url="https://api.mistral.ai/v1/models"
+        url=f"{self._batch_root()}/models"
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        response=requests.get(url=url,headers=headers)
+        response=self.client(url).get(url=url,headers=headers)
         response.raise_for_status()
         models=response.json()
         return [model['id'] for model in models['data']]
\ No newline at end of file
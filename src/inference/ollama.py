@@ -1,139 +1,181 @@
 from src.message import AIMessage,BaseMessage,SystemMessage,HumanMessage,ImageMessage
+from httpx import TransportError,HTTPStatusError,ConnectError
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
-from requests import RequestException,HTTPError
 from typing import AsyncGenerator,Generator
-from httpx import Client,AsyncClient,get
 from src.inference import BaseInference
+from src.inference.stream_parser import iter_ndjson,aiter_ndjson,parse_json
+from src.inference.encoding import MessageEncoder,request_body
+from src.image import ImageSource
 from json import loads
-from io import BytesIO
-import requests
-import base64
-import re
+import logging
+
+logger=logging.getLogger(__name__)
+
+ENCODER=MessageEncoder('ollama',{
+    SystemMessage:lambda message:('message',message.to_dict()),
+    HumanMessage:lambda message:('message',message.to_dict()),
+    AIMessage:lambda message:('message',message.to_dict()),
+    # The image itself goes to the request's top-level "images"
+    ImageMessage:lambda message:('image',HumanMessage(message.content[0]).to_dict()),
+})
+
+def _tags_url(base_url:str)->str:
+    # base_url is an endpoint such as http://host:11434/api/chat; the model list lives next to it
+    root=base_url.rsplit('/api/',1)[0] if base_url else 'http://localhost:11434'
+    return f'{root}/api/tags'
 
 class ChatOllama(BaseInference):
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self,messages: list[BaseMessage],json=False)->AIMessage:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "http://localhost:11434/api/chat"
+    http2=False
+    # A local server keeps the previous prompt's KV cache on its own
+    prompt_cache_type=None
+
+    def _url(self)->str:
+        return self.base_url or "http://localhost:11434/api/chat"
+
+    def _payload(self,messages:list[BaseMessage],json=False,stream=False)->dict:
         contents=[]
         images=[]
         for message in messages:
-            if isinstance(message,[SystemMessage,HumanMessage,AIMessage]):
-                contents.append(message)
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append(HumanMessage(text))
-                images.append(image)
-        payload={
+            encoded=ENCODER(message)
+            if encoded is None:
+                continue
+            kind,fragment=encoded
+            contents.append(fragment)
+            if kind=='image':
+                image=message.content[1]
+                images.append(image and image.fit())
+        return {
             "model": self.model,
             "messages": contents,
             "images":images,
             "options":{
-                "temperature": temperature,
+                "temperature": self.temperature,
             },
             "format":'json' if json else '',
-            "stream":False
+            "stream":stream
         }
+
+    def _parse(self,json_obj:dict,json=False)->AIMessage:
+        if json:
+            content=loads(json_obj['message']['content'])
+        else:
+            content=json_obj['message']['content']
+        usage={
+            'prompt_tokens':json_obj.get('prompt_eval_count',0),
+            'completion_tokens':json_obj.get('eval_count',0)
+        }
+        usage['total_tokens']=usage['prompt_tokens']+usage['completion_tokens']
+        return AIMessage(content,usage=usage)
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    def invoke(self,messages: list[BaseMessage],json=False)->AIMessage:
+        url=self._url()
+        payload=self._payload(messages,json)
+        content,headers=request_body(payload,self.headers)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
+            response=self.client(url).post(url=url,content=content,headers=headers)
             response.raise_for_status()
-            json_obj=response.json()
-            if json:
-                content=loads(json_obj['message']['content'])
-            else:
-                content=json_obj['message']['content']
-            return AIMessage(content)
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-    
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(TransportError))
+    async def ainvoke(self,messages: list[BaseMessage],json=False)->AIMessage:
+        url=self._url()
+        payload=self._payload(messages,json)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
+        try:
+            response=await self.async_client(url).post(url=url,content=content,headers=headers)
+            response.raise_for_status()
+            return self._parse(response.json(),json)
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+
     def stream(self,messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        url=self._url()
+        payload=self._payload(messages,json,stream=True)
+        content,headers=request_body(payload,self.headers)
+        try:
+            with self.client(url).stream('POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    response.read()
+                response.raise_for_status()
+                for line in iter_ndjson(response.iter_bytes()):
+                    yield parse_json(line)['message']['content']
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async def astream(self,messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        url=self._url()
+        payload=self._payload(messages,json,stream=True)
+        content,headers=request_body(payload,self.headers,asynchronous=True)
+        try:
+            async with self.async_client(url).stream(method='POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                async for line in aiter_ndjson(response.aiter_bytes()):
+                    yield parse_json(line)['message']['content']
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async_stream=astream
+
+    def available_models(self):
+        url=_tags_url(self.base_url)
         headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "http://localhost:11434/api/chat"
-        contents=[]
-        images=[]
-        for message in messages:
-            if isinstance(message,[SystemMessage,HumanMessage,AIMessage]):
-                contents.append(message)
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append(HumanMessage(text))
-                images.append(image)
-        payload={
-            "model": self.model,
-            "messages": contents,
-            "images":images,
-            "options":{
-                "temperature": temperature,
-            },
-            "format":'json' if json else '',
-            "stream":True
-        }
         try:
-            response=requests.post(url=url,json=payload,headers=headers,stream=True)
+            response=self.client(url).get(url=url,headers=headers)
             response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            return (loads(chunk)['message']['content'] for chunk in chunks)
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
-    async def async_stream(self,messages: list[BaseMessage],json=False)->AsyncGenerator:
+            models=response.json()
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+        return [model['name'] for model in models['models']]
+
+        
+class Ollama(BaseInference):
+    http2=False
+    prompt_cache_type=None
+
+    def invoke(self, query:str,images_path:list[str]=[],json=False)->AIMessage:
         headers=self.headers
         temperature=self.temperature
-        url=self.base_url or "http://localhost:11434/api/chat"
-        contents=[]
-        images=[]
-        for message in messages:
-            if isinstance(message,[SystemMessage,HumanMessage,AIMessage]):
-                contents.append(message)
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append(HumanMessage(text))
-                images.append(image)
+        url=self.base_url or "http://localhost:11434/api/generate"
         payload={
             "model": self.model,
-            "messages": contents,
-            "images":images,
+            "prompt": query,
             "options":{
                 "temperature": temperature,
             },
             "format":'json' if json else '',
-            "stream":True
+            "stream":False
         }
+        if images_path:
+            payload['images'] = [ImageSource.parse(image_path) for image_path in images_path]
+        content,headers=request_body(payload,headers)
         try:
-            async with AsyncClient() as client:
-                async with client.stream(method='POST',url=url,json=payload,headers=headers,timeout=None) as response:
-                    async for chunk in response.aiter_lines():
-                        yield loads(chunk)['response']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
-    def available_models(self):
-        url='http://localhost:11434/api/tags'
-        headers=self.headers
-        try:
-            with Client() as client:
-                response=client.get(url=url,headers=headers)
-            models=response.json()
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
-        return [model['name'] for model in models['models']]
+            response=self.client(url).post(url=url,content=content,headers=headers)
+            json_obj=response.json()
+            return AIMessage(json_obj['response'])
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
 
-        
-class Ollama(BaseInference):
-    def invoke(self, query:str,images_path:list[str]=[],json=False)->AIMessage:
+    async def ainvoke(self, query:str,images_path:list[str]=[],json=False)->AIMessage:
         headers=self.headers
         temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/generate"
@@ -147,34 +189,15 @@ class Ollama(BaseInference):
             "stream":False
         }
         if images_path:
-            payload['images'] = [self.__image_to_base64(image_path) for image_path in images_path]
+            payload['images'] = [ImageSource.parse(image_path) for image_path in images_path]
+        content,headers=request_body(payload,headers,asynchronous=True)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
+            response=await self.async_client(url).post(url=url,content=content,headers=headers)
             json_obj=response.json()
             return AIMessage(json_obj['response'])
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-
-    def __is_url(self,image_path:str)->bool:
-        url_pattern = re.compile(r'^https?://')
-        return url_pattern.match(image_path) is not None
-
-    def __is_file_path(self,image_path:str)->bool:
-        file_path_pattern = re.compile(r'^([./~]|([a-zA-Z]:)|\\|//)?\.?\/?[a-zA-Z0-9._-]+(\.[a-zA-Z0-9]+)?$')
-        return file_path_pattern.match(image_path) is not None
-
-    def __image_to_base64(self,image_source: str) -> str:
-        if self.__is_url(image_source):
-            response = get(image_source)
-            bytes = BytesIO(response.content)
-            image_bytes = bytes.read()
-        elif self.__is_file_path(image_source):
-            with open(image_source, 'rb') as image:
-                image_bytes = image.read()
-        else:
-            raise ValueError("Invalid image source. Must be a URL or file path.")
-        return base64.b64encode(image_bytes).decode('utf-8')
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
 
     def stream(self,query:str,images_path:list[str]=[],json=False)->Generator[str,None,None]:
         headers=self.headers
@@ -183,25 +206,29 @@ class Ollama(BaseInference):
         payload={
             "model": self.model,
             "prompt": query,
-            "images":[self.__image_to_base64(image_path) for image_path in images_path],
+            "images":[ImageSource.parse(image_path) for image_path in images_path],
             "options":{
                 "temperature": temperature,
             },
             "format":'json' if json else '',
             "stream":True
         }
+        content,headers=request_body(payload,headers)
         try:
-            response=requests.post(url=url,json=payload,headers=headers,stream=True)
-            response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            return (loads(chunk)['response'] for chunk in chunks)
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-
-    async def async_stream(self,query:str,images_path:list[str]=[],json=False)->AsyncGenerator:
+            with self.client(url).stream('POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    response.read()
+                response.raise_for_status()
+                for line in iter_ndjson(response.iter_bytes()):
+                    yield parse_json(line)['response']
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async def astream(self,query:str,images_path:list[str]=[],json=False)->AsyncGenerator[str,None]:
         headers=self.headers
         temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/generate"
@@ -215,29 +242,35 @@ class Ollama(BaseInference):
             "stream":True
         }
         if images_path:
-            payload['images'] = [self.__image_to_base64(image_path) for image_path in images_path]
+            payload['images'] = [ImageSource.parse(image_path) for image_path in images_path]
+        content,headers=request_body(payload,headers,asynchronous=True)
         try:
-            async with AsyncClient() as client:
-                async with client.stream(method='POST',url=url,json=payload,headers=headers,timeout=None) as response:
-                    async for chunk in response.aiter_lines():
-                        yield loads(chunk)['response']
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
-    
+            async with self.async_client(url).stream(method='POST',url=url,content=content,headers=headers) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                async for line in aiter_ndjson(response.aiter_bytes()):
+                    yield parse_json(line)['response']
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
+
+    async_stream=astream
+
     def available_models(self):
-        url='http://localhost:11434/api/tags'
+        url=_tags_url(self.base_url)
         headers=self.headers
         try:
-            with Client() as client:
-                response=client.get(url=url,headers=headers)
+            response=self.client(url).get(url=url,headers=headers)
+            response.raise_for_status()
             models=response.json()
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
+        except HTTPStatusError as err:
+            logger.warning('Error: %s, Status Code: %s',err.response.text,err.response.status_code)
+            raise
+        except ConnectError as err:
+            logger.warning('Connection error: %s',err)
+            raise
         return [model['name'] for model in models['models']]
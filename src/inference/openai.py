@@ -1,161 +1,198 @@
 from typing import Generator, AsyncGenerator
 from tenacity import retry, stop_after_attempt, retry_if_exception_type
-from requests import RequestException, HTTPError, ConnectionError
-from httpx import Client, AsyncClient
+from httpx import TransportError, HTTPStatusError, ConnectError
 from json import loads
-import requests
+import logging
 
-from src.inference import BaseInference
+from src.inference import BaseInference, ConnectionPool
+from src.inference.stream_parser import iter_sse, aiter_sse, parse_json
+from src.inference.batch_api import OpenAIBatchAPI
+from src.inference.encoding import MessageEncoder, request_body
+from src.prompt_cache import PromptCache, Prefix
 from src.message import AIMessage, BaseMessage, HumanMessage, ImageMessage
 
+logger = logging.getLogger(__name__)
 
-class ChatOpenAI(BaseInference):
-    def __init__(self, model: str, api_key: str, temperature: float = 0.7):
-        self.model = model
-        self.api_key = api_key
-        self.temperature = temperature
-        self.base_url = "https://api.openai.com/v1"
+ENCODER = MessageEncoder("openai", {
+    HumanMessage: lambda message: ("message", {"role": "user", "content": message.content}),
+    AIMessage: lambda message: ("message", {"role": "assistant", "content": message.content}),
+    # Images go to the separate image endpoint
+    ImageMessage: lambda message: None,
+    BaseMessage: lambda message: ("system", {"role": "system", "content": message.content}),
+})
 
-    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage], json_output=False) -> AIMessage:
-        headers = {
+
+class ChatOpenAI(BaseInference, OpenAIBatchAPI):
+    def __init__(self, model: str, api_key: str, temperature: float = 0.7, base_url: str = "", pool: ConnectionPool | None = None,
+                 prompt_cache: PromptCache | bool = True):
+        super().__init__(model=model, api_key=api_key, base_url=base_url or "https://api.openai.com/v1", temperature=temperature,
+                         pool=pool, prompt_cache=prompt_cache)
+
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-        contents = []
-        system_instruction = None
+    def _batch_root(self) -> str:
+        return self.base_url
 
+    def _image_prompt(self, messages: list[BaseMessage]) -> str | None:
+        # OpenAI image endpoint is separate
         for msg in messages:
-            if isinstance(msg, HumanMessage):
-                contents.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                contents.append({"role": "assistant", "content": msg.content})
-            elif isinstance(msg, ImageMessage):
-                # OpenAI image endpoint is separate
+            if isinstance(msg, ImageMessage):
                 text, _ = msg.content
-                return self.generate_image(text)
-            else:
-                system_instruction = msg.content
-
-        payload = {
-            "model": self.model,
-            "messages": [{"role": "system", "content": system_instruction}] + contents if system_instruction else contents,
-            "temperature": self.temperature
-        }
-
-        try:
-            with Client() as client:
-                response = client.post(f"{self.base_url}/chat/completions", headers=headers, json=payload, timeout=None)
-            response.raise_for_status()
-            resp_json = response.json()
-            content = resp_json['choices'][0]['message']['content']
-            if json_output:
-                content = loads(content)
-            return AIMessage(content)
-        except HTTPError as err:
-            print(f"HTTP Error: {err.response.text}")
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
-
-    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(RequestException))
-    async def async_invoke(self, messages: list[BaseMessage], json_output=False) -> AIMessage:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+                return text
+        return None
 
+    def _payload(self, messages: list[BaseMessage], json: bool = False, stream: bool = False, prefixes: list[Prefix] = ()) -> dict:
         contents = []
         system_instruction = None
 
-        for msg in messages:
-            if isinstance(msg, HumanMessage):
-                contents.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                contents.append({"role": "assistant", "content": msg.content})
-            elif isinstance(msg, ImageMessage):
-                text, _ = msg.content
-                return self.generate_image(text)
+        for kind, fragment in ENCODER.encode(messages):
+            if kind == "system":
+                system_instruction = fragment
             else:
-                system_instruction = msg.content
+                contents.append(fragment)
 
         payload = {
             "model": self.model,
-            "messages": [{"role": "system", "content": system_instruction}] + contents if system_instruction else contents,
+            "messages": [system_instruction] + contents if system_instruction and system_instruction["content"] else contents,
             "temperature": self.temperature
         }
+        if json:
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream"] = True
+        if prefixes:
+            # Keyed on the shortest stable prefix, so a growing conversation keeps landing on the servers that cache it
+            payload["prompt_cache_key"] = prefixes[-1].digest[:32]
+        return payload
+
+    def _parse(self, resp_json: dict, json: bool = False) -> AIMessage:
+        content = resp_json['choices'][0]['message']['content']
+        if json:
+            content = loads(content)
+        return AIMessage(content, usage=resp_json.get('usage'))
+
+    def _delta(self, event: dict) -> str | None:
+        if event.get("choices") and event["choices"][0].get("delta", {}).get("content"):
+            return event["choices"][0]["delta"]["content"]
+        return None
+
+    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(TransportError))
+    def invoke(self, messages: list[BaseMessage], json: bool = False, json_output: bool = False) -> AIMessage:
+        json = json or json_output
+        prompt = self._image_prompt(messages)
+        if prompt is not None:
+            return self.generate_image(prompt)
+        payload = self._payload(messages, json, prefixes=self._observe_prefixes(messages))
+        content, headers = request_body(payload, self._headers())
 
-        async with AsyncClient() as client:
-            response = await client.post(f"{self.base_url}/chat/completions", headers=headers, json=payload, timeout=None)
-            resp_json = response.json()
-            content = resp_json['choices'][0]['message']['content']
-            if json_output:
-                content = loads(content)
-            return AIMessage(content)
+        try:
+            url = f"{self.base_url}/chat/completions"
+            response = self.client(url).post(url, headers=headers, content=content)
+            response.raise_for_status()
+            return self._parse(response.json(), json)
+        except HTTPStatusError as err:
+            logger.warning("HTTP Error: %s", err.response.text)
+            raise
+        except ConnectError as err:
+            logger.warning("Connection error: %s", err)
+            raise
+
+    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(TransportError))
+    async def ainvoke(self, messages: list[BaseMessage], json: bool = False, json_output: bool = False) -> AIMessage:
+        json = json or json_output
+        prompt = self._image_prompt(messages)
+        if prompt is not None:
+            return await self.agenerate_image(prompt)
+        payload = self._payload(messages, json, prefixes=self._observe_prefixes(messages))
+        content, headers = request_body(payload, self._headers(), asynchronous=True)
 
-    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(RequestException))
-    def stream(self, messages: list[BaseMessage], json_output=False) -> Generator[str, None, None]:
+        try:
+            url = f"{self.base_url}/chat/completions"
+            response = await self.async_client(url).post(url, headers=headers, content=content)
+            response.raise_for_status()
+            return self._parse(response.json(), json)
+        except HTTPStatusError as err:
+            logger.warning("HTTP Error: %s", err.response.text)
+            raise
+        except ConnectError as err:
+            logger.warning("Connection error: %s", err)
+            raise
+
+    async_invoke = ainvoke
+
+    @retry(stop=stop_after_attempt(3), retry=retry_if_exception_type(TransportError))
+    def stream(self, messages: list[BaseMessage], json: bool = False, json_output: bool = False) -> Generator[str, None, None]:
         # OpenAI does support streaming via SSE
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-        contents = []
-        system_instruction = None
-
-        for msg in messages:
-            if isinstance(msg, HumanMessage):
-                contents.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                contents.append({"role": "assistant", "content": msg.content})
-            else:
-                system_instruction = msg.content
-
-        payload = {
-            "model": self.model,
-            "messages": [{"role": "system", "content": system_instruction}] + contents if system_instruction else contents,
-            "temperature": self.temperature,
-            "stream": True
-        }
-
-        response = requests.post(f"{self.base_url}/chat/completions", headers=headers, json=payload, stream=True)
-        response.raise_for_status()
-        for line in response.iter_lines(decode_unicode=True):
-            if line and line.startswith("data: "):
-                chunk = loads(line.replace("data: ", ""))
-                if "choices" in chunk and chunk["choices"][0].get("delta", {}).get("content"):
-                    yield chunk["choices"][0]["delta"]["content"]
+        payload = self._payload(messages, json or json_output, stream=True, prefixes=self._observe_prefixes(messages))
+        content, headers = request_body(payload, self._headers())
+        url = f"{self.base_url}/chat/completions"
+        with self.client(url).stream("POST", url, headers=headers, content=content) as response:
+            if response.is_error:
+                response.read()
+            response.raise_for_status()
+            for data in iter_sse(response.iter_bytes()):
+                delta = self._delta(parse_json(data))
+                if delta:
+                    yield delta
+
+    async def astream(self, messages: list[BaseMessage], json: bool = False, json_output: bool = False) -> AsyncGenerator[str, None]:
+        payload = self._payload(messages, json or json_output, stream=True, prefixes=self._observe_prefixes(messages))
+        content, headers = request_body(payload, self._headers(), asynchronous=True)
+        url = f"{self.base_url}/chat/completions"
+        async with self.async_client(url).stream("POST", url, headers=headers, content=content) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for data in aiter_sse(response.aiter_bytes()):
+                delta = self._delta(parse_json(data))
+                if delta:
+                    yield delta
 
     def available_models(self):
         headers = {"Authorization": f"Bearer {self.api_key}"}
         try:
-            with Client() as client:
-                resp = client.get(f"{self.base_url}/models", headers=headers)
+            url = f"{self.base_url}/models"
+            resp = self.client(url).get(url, headers=headers)
             resp.raise_for_status()
             models = resp.json().get("data", [])
             return [m["id"] for m in models]
-        except HTTPError as err:
-            print(f"HTTP Error: {err.response.text}")
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
+        except HTTPStatusError as err:
+            logger.warning("HTTP Error: %s", err.response.text)
+            raise
+        except ConnectError as err:
+            logger.warning("Connection error: %s", err)
+            raise
 
     def generate_image(self, prompt: str) -> AIMessage:
-        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
         payload = {"prompt": prompt, "n": 1, "size": "1024x1024"}
         try:
-            with Client() as client:
-                resp = client.post(f"{self.base_url}/images/generations", headers=headers, json=payload)
+            url = f"{self.base_url}/images/generations"
+            resp = self.client(url).post(url, headers=self._headers(), json=payload)
+            resp.raise_for_status()
+            image_url = resp.json()["data"][0]["url"]
+            return AIMessage(f"[Image generated] URL: {image_url}")
+        except HTTPStatusError as err:
+            logger.warning("HTTP Error: %s", err.response.text)
+            raise
+        except ConnectError as err:
+            logger.warning("Connection error: %s", err)
+            raise
+
+    async def agenerate_image(self, prompt: str) -> AIMessage:
+        payload = {"prompt": prompt, "n": 1, "size": "1024x1024"}
+        try:
+            url = f"{self.base_url}/images/generations"
+            resp = await self.async_client(url).post(url, headers=self._headers(), json=payload)
             resp.raise_for_status()
             image_url = resp.json()["data"][0]["url"]
             return AIMessage(f"[Image generated] URL: {image_url}")
-        except HTTPError as err:
-            print(f"HTTP Error: {err.response.text}")
-            exit()
-        except ConnectionError as err:
-            print(err)
-            exit()
+        except HTTPStatusError as err:
+            logger.warning("HTTP Error: %s", err.response.text)
+            raise
+        except ConnectError as err:
+            logger.warning("Connection error: %s", err)
+            raise
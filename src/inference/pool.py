@@ -0,0 +1,109 @@
+from httpx import Client,AsyncClient,Limits,Timeout
+from weakref import WeakKeyDictionary
+from urllib.parse import urlsplit
+from src.telemetry import current_span
+import threading
+import asyncio
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE=True
+except ImportError:
+    HTTP2_AVAILABLE=False
+
+def _trace(request):
+    # Lets the current telemetry span time connection setup; a no-op when telemetry is off
+    span=current_span()
+    if span:
+        request.extensions['trace']=span.trace
+
+async def _atrace(request):
+    span=current_span()
+    if span:
+        request.extensions['trace']=span.atrace
+
+class ConnectionPool:
+    """Long-lived HTTP clients shared by the inference adapters.
+
+    One client is kept per origin (scheme + host + port), so the connection
+    limits below apply per provider host and keep-alive connections are reused
+    across invoke, stream and available_models calls. Async clients are bound
+    to the event loop that created them.
+    """
+    def __init__(self,max_connections:int=100,max_keepalive_connections:int=20,keepalive_expiry:float=30.0,connect_timeout:float=10.0,
+                 read_timeout:float|None=300.0,pool_timeout:float|None=60.0,http2:bool=True):
+        self.limits=Limits(max_connections=max_connections,max_keepalive_connections=max_keepalive_connections,keepalive_expiry=keepalive_expiry)
+        # LLM responses can take minutes, so a read may wait long, but not forever: a stalled
+        # connection abandoned by a stream's timeout is then closed and given back to the pool.
+        # Waiting for a free connection is bounded too, so an exhausted pool fails instead of hanging.
+        self.timeout=Timeout(None,connect=connect_timeout,read=read_timeout,pool=pool_timeout)
+        self.http2=http2 and HTTP2_AVAILABLE
+        self._clients:dict[tuple[str,bool],Client]={}
+        self._async_clients:WeakKeyDictionary[asyncio.AbstractEventLoop,dict[tuple[str,bool],AsyncClient]]=WeakKeyDictionary()
+        self._lock=threading.Lock()
+
+    def _key(self,url:str,http2:bool)->tuple[str,bool]:
+        parts=urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}',http2 and self.http2
+
+    def client(self,url:str,http2:bool=True)->Client:
+        key=self._key(url,http2)
+        client=self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client=self._clients.get(key)
+                if client is None:
+                    client=Client(http2=key[1],limits=self.limits,timeout=self.timeout,event_hooks={'request':[_trace]})
+                    self._clients[key]=client
+        return client
+
+    def async_client(self,url:str,http2:bool=True)->AsyncClient:
+        key=self._key(url,http2)
+        loop=asyncio.get_running_loop()
+        with self._lock:
+            clients=self._async_clients.setdefault(loop,{})
+            client=clients.get(key)
+            if client is None:
+                client=AsyncClient(http2=key[1],limits=self.limits,timeout=self.timeout,event_hooks={'request':[_atrace]})
+                clients[key]=client
+        return client
+
+    def close(self):
+        """Close the sync clients. The pool stays usable and reconnects lazily."""
+        with self._lock:
+            clients=list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    async def aclose(self):
+        """Close the sync clients and the async clients of the running loop."""
+        self.close()
+        loop=asyncio.get_running_loop()
+        with self._lock:
+            clients=list(self._async_clients.pop(loop,{}).values())
+        for client in clients:
+            await client.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*exc):
+        await self.aclose()
+
+_default_pool=None
+_default_pool_lock=threading.Lock()
+
+def get_default_pool()->ConnectionPool:
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool=ConnectionPool()
+    return _default_pool
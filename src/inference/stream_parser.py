@@ -0,0 +1,133 @@
+from json import JSONDecoder
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+DONE = b"[DONE]"
+
+_decode = JSONDecoder().decode
+
+
+def parse_json(data: bytes):
+    """`json.loads` for the UTF-8 payloads above, skipping its per-call encoding detection."""
+    return _decode(data.decode())
+
+
+class SSEDecoder:
+    """Incremental server-sent events decoder working on raw bytes.
+
+    Feed it network reads of any size; it returns the `data` payload of every
+    event completed so far. Multi-line `data:` fields are joined with newlines,
+    comment lines (keep-alives such as ": ping") and other fields are skipped.
+    Lines end in LF or CRLF, whichever the first line uses. Reads are split
+    into events in one pass and the usual single-line event is sliced out
+    without looking at it line by line; only an incomplete trailing event is
+    carried over to the next read.
+    """
+    def __init__(self):
+        self._tail = b""
+        self._newline = None
+        self._separator = None
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        buffer = self._tail + chunk if self._tail else chunk
+        if self._newline is None:
+            end = buffer.find(b"\n")
+            if end < 0:
+                self._tail = buffer
+                return []
+            self._newline = b"\r\n" if end and buffer[end - 1] == 13 else b"\n"
+            self._separator = self._newline * 2
+        newline = self._newline
+        blocks = buffer.split(self._separator)
+        self._tail = blocks.pop()
+        events = [block[6:] for block in blocks if block.startswith(b"data: ") and newline not in block]
+        if len(events) == len(blocks):
+            return events
+        # Comments, other fields or multi-line data somewhere in this read
+        events = []
+        for block in blocks:
+            if block.startswith(b"data: ") and newline not in block:
+                events.append(block[6:])
+            elif block:
+                data = self._event(block)
+                if data is not None:
+                    events.append(data)
+        return events
+
+    def _event(self, block: bytes) -> bytes | None:
+        lines = block.split(self._newline)
+        data = [line[6:] if line[5:6] == b" " else line[5:] for line in lines if line.startswith(b"data:")]
+        return b"\n".join(data) if data else None
+
+    def flush(self) -> list[bytes]:
+        """The last event, if the connection closed without a trailing blank line."""
+        return self.feed(self._separator or b"\n\n") if self._tail.strip() else []
+
+
+class NDJSONDecoder:
+    """Incremental newline-delimited JSON decoder; returns each complete, non-blank line as bytes."""
+    def __init__(self):
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        buffer = self._tail + chunk if self._tail else chunk
+        lines = buffer.split(b"\n")
+        self._tail = lines.pop()
+        return [line for line in lines if line and line != b"\r"]
+
+    def flush(self) -> list[bytes]:
+        return self.feed(b"\n") if self._tail else []
+
+
+def _until_done(events: list[bytes]) -> tuple[list[bytes], bool]:
+    if DONE in events:
+        return events[:events.index(DONE)], True
+    return events, False
+
+
+def iter_sse(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Event payloads from a byte stream such as `response.iter_bytes()`, up to `[DONE]`; the stream is read to its end."""
+    decoder = SSEDecoder()
+    chunks = iter(chunks)
+    for chunk in chunks:
+        events, done = _until_done(decoder.feed(chunk))
+        yield from events
+        if done:
+            # Read the rest of the body, so the keep-alive connection goes back to the pool instead of being closed
+            for _ in chunks:
+                pass
+            return
+    yield from _until_done(decoder.flush())[0]
+
+
+async def aiter_sse(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Async counterpart of `iter_sse`, e.g. over `response.aiter_bytes()`."""
+    decoder = SSEDecoder()
+    chunks = aiter(chunks)
+    async for chunk in chunks:
+        events, done = _until_done(decoder.feed(chunk))
+        for data in events:
+            yield data
+        if done:
+            async for _ in chunks:
+                pass
+            return
+    for data in _until_done(decoder.flush())[0]:
+        yield data
+
+
+def iter_ndjson(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """JSON lines from a byte stream such as `response.iter_bytes()`."""
+    decoder = NDJSONDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+
+async def aiter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Async counterpart of `iter_ndjson`."""
+    decoder = NDJSONDecoder()
+    async for chunk in chunks:
+        for line in decoder.feed(chunk):
+            yield line
+    for line in decoder.flush():
+        yield line
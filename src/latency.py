@@ -0,0 +1,173 @@
+from collections import defaultdict
+from typing import Literal
+import threading
+import math
+
+from src.routing import RankedCandidates
+
+Metric = Literal["latency", "ttft", "tps"]
+
+
+class QuantileSketch:
+    """Streaming quantiles over roughly the last `window` samples in a few hundred bytes.
+
+    Values are counted in logarithmic buckets, so any quantile is answered
+    within `accuracy` relative error however many samples were seen. Two
+    generations of buckets are kept and the older one is dropped every
+    `window` samples, which makes the sketch rolling.
+    """
+    def __init__(self, accuracy: float = 0.02, window: int = 512):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.window = window
+        self._current: dict[int, int] = defaultdict(int)
+        self._previous: dict[int, int] = {}
+        self._count = 0
+        self._previous_count = 0
+
+    def add(self, value: float):
+        self._current[math.ceil(math.log(max(value, 1e-9)) / self._log_gamma)] += 1
+        self._count += 1
+        if self._count >= self.window:
+            self._previous, self._previous_count = self._current, self._count
+            self._current, self._count = defaultdict(int), 0
+
+    def quantile(self, percentile: float) -> float | None:
+        """Value at `percentile` (0-100), or None before the first sample."""
+        total = self._count + self._previous_count
+        if total == 0:
+            return None
+        buckets = defaultdict(int, self._previous)
+        for index, count in self._current.items():
+            buckets[index] += count
+        rank = percentile / 100 * (total - 1)
+        seen = 0
+        for index in sorted(buckets):
+            seen += buckets[index]
+            if seen > rank:
+                break
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def __len__(self) -> int:
+        return self._count + self._previous_count
+
+
+class LatencyTracker:
+    def __init__(self, accuracy: float = 0.02, window: int = 512):
+        """Rolling time-to-first-token, total latency and output tokens/sec per model.
+
+        Args:
+            accuracy (float): Relative error of the reported percentiles.
+            window (int): Roughly how many recent samples per metric are kept.
+        """
+        self.accuracy = accuracy
+        self.window = window
+        self._sketches: dict[str, dict[str, QuantileSketch]] = {}
+        self._lock = threading.Lock()
+
+    def key(self, entry: dict) -> str:
+        return f"{entry['llm'].name.lower()}:{entry['llm'].model}"
+
+    def _sketch(self, entry: dict, metric: Metric) -> QuantileSketch | None:
+        sketches = self._sketches.get(self.key(entry))
+        return None if sketches is None else sketches.get(metric)
+
+    def record(self, entry: dict, latency: float, ttft: float | None = None, output_tokens: int | None = None):
+        """Record one finished request. `ttft` is only known for streams.
+
+        Throughput is only recorded alongside a TTFT, since a non-streamed
+        latency cannot tell prompt processing from generation.
+        """
+        with self._lock:
+            sketches = self._sketches.setdefault(self.key(entry), {})
+            samples = {"latency": latency}
+            if ttft is not None:
+                samples["ttft"] = ttft
+                if output_tokens and latency > ttft:
+                    samples["tps"] = output_tokens / (latency - ttft)
+            for metric, value in samples.items():
+                sketch = sketches.get(metric)
+                if sketch is None:
+                    sketch = sketches[metric] = QuantileSketch(self.accuracy, self.window)
+                sketch.add(value)
+
+    def quantile(self, entry: dict, metric: Metric, percentile: float) -> float | None:
+        with self._lock:
+            sketch = self._sketch(entry, metric)
+            return None if sketch is None else sketch.quantile(percentile)
+
+    def predict(self, entry: dict, metric: Literal["latency", "ttft"], percentile: float, completion_tokens: int) -> float | None:
+        """Expected seconds until the first token (`ttft`) or the whole answer (`latency`)."""
+        ttft = self.quantile(entry, "ttft", percentile)
+        if metric == "ttft":
+            return ttft
+        tps = self.quantile(entry, "tps", 50)
+        if ttft is not None and tps:
+            return ttft + completion_tokens / tps
+        return self.quantile(entry, "latency", percentile)
+
+    def snapshot(self) -> dict[str, dict]:
+        """p50/p95 per metric and model ("provider:model"), for dashboards."""
+        snapshot = {}
+        with self._lock:
+            for key, sketches in self._sketches.items():
+                stats = {"samples": len(sketches["latency"])}
+                for metric, sketch in sketches.items():
+                    stats[f"{metric}_p50"] = round(sketch.quantile(50), 4)
+                    stats[f"{metric}_p95"] = round(sketch.quantile(95), 4)
+                snapshot[key] = stats
+        return snapshot
+
+
+class Objective:
+    def __init__(self, optimize: Literal["cost", "latency", "quality"] = "cost", slo: float | None = None,
+                 metric: Literal["latency", "ttft"] = "latency", percentile: float = 95):
+        """What `rank_llms` optimizes for a task type.
+
+        Args:
+            optimize (str): "cost" ranks by benchmark score per dollar (the default
+                ranking), "latency" by predicted latency, "quality" by benchmark score.
+            slo (float | None): Seconds. Models predicted to miss it rank after all
+                models that meet it.
+            metric (str): "latency" for the whole answer, "ttft" for the first token
+                (interactive streaming).
+            percentile (float): Percentile of the measured distribution that is
+                predicted, e.g. 95 to plan for the tail.
+        """
+        self.optimize = optimize
+        self.slo = slo
+        self.metric = metric
+        self.percentile = percentile
+
+    def order(self, candidates: RankedCandidates, tracker: LatencyTracker, completion_tokens: int) -> RankedCandidates:
+        """Re-order ranked candidates for this objective. Ties keep the cost ranking."""
+        if self.optimize == "cost" and self.slo is None:
+            return candidates
+        views = list(candidates)
+        predicted = {id(view): tracker.predict(view.entry, self.metric, self.percentile, completion_tokens) for view in views}
+        # Unmeasured models are assumed typical so they still get traffic and measurements
+        known = sorted(value for value in predicted.values() if value is not None)
+        typical = known[len(known) // 2] if known else None
+
+        def key(view):
+            seconds = predicted[id(view)]
+            if seconds is None:
+                seconds = typical
+            misses_slo = self.slo is not None and seconds is not None and seconds > self.slo
+            if self.optimize == "latency":
+                primary = math.inf if seconds is None else seconds
+            elif self.optimize == "quality":
+                primary = -view["benchmark_score"]
+            else:
+                primary = -view.rank_score
+            return misses_slo, primary, -view.rank_score
+
+        views.sort(key=key)
+        return RankedCandidates(iter(views))
+
+
+OBJECTIVES = {
+    "cheapest": Objective("cost"),
+    "fastest": Objective("latency"),
+    "fastest-first-token": Objective("latency", metric="ttft"),
+}
@@ -39,11 +39,45 @@ class LLMSwitcher(BaseInference):
         raise RuntimeError("All LLM's failed after maximum retries")
 """
 
+from contextlib import asynccontextmanager, contextmanager
+from httpx import HTTPStatusError
+from typing import AsyncIterator, Iterable, Iterator
+import threading
+import logging
+import asyncio
+import queue
+import time
+
 from src.inference import BaseInference
 from src.message import BaseMessage, AIMessage
+from src.hedging import HedgePolicy
+from src.cache import ResponseCache, make_key
+from src.semantic_cache import SemanticCache
+from src.tokenizer import count_prompt_tokens, count_text_tokens, family_of, usage_tokens
+from src.routing import RoutingIndex, RankedLLM, RankedCandidates
+from src.quota import QuotaLedger
+from src.rate_limit import RateLimiter
+from src.health import HealthMonitor
+from src.latency import LatencyTracker, Objective, OBJECTIVES
+from src.streaming import FailoverStream, AsyncFailoverStream
+from src.batch import ModelSlots, Checkpoint, DeferredBatch, pending_jobs
+from src.coalesce import SingleFlight, SharedStream, AsyncSharedStream, flight_key
+from src.telemetry import Telemetry, NULL_SPAN, current_span
+from src.compaction import HistoryCompactor
+from src.classifier import TaskClassifier
+from src.scheduler import Admission, Scheduler
+
+logger = logging.getLogger(__name__)
 
 class LLMSwitcher:
-    def __init__(self, llms: list[dict], max_retries: int = 3):
+    def __init__(self, llms: list[dict], max_retries: int = 3, hedge: HedgePolicy | None = None, cache: ResponseCache | None = None,
+                 semantic_cache: SemanticCache | None = None, quota: QuotaLedger | None = None,
+                 rate_limiter: RateLimiter | None = None, rate_limit_wait: float = 30.0, health: HealthMonitor | None = None,
+                 latency: LatencyTracker | None = None, objectives: dict[str, Objective | str] | None = None,
+                 stream_first_token_timeout: float | None = 30.0, stream_stall_timeout: float | None = 30.0,
+                 single_flight: SingleFlight | None = None, telemetry: Telemetry | None = None,
+                 compactor: HistoryCompactor | None = None, classifier: TaskClassifier | None = None,
+                 scheduler: Scheduler | None = None):
         """
         Args:
             llms (list[dict]): Each dict must have:
@@ -54,13 +88,85 @@ class LLMSwitcher:
                     "free_limit_tokens": int,
                     "benchmark_score": int
                 }
+                and may set "cached_price_per_1k_tokens" for prompt tokens served
+                from the provider's prompt cache, and "context_window" and
+                "max_output_tokens" (see `rank_llms`).
             max_retries (int): Max retries per LLM before switching.
+            hedge (HedgePolicy | None): Opt-in hedging. When set, a backup request is sent
+                to the next ranked model if the current one has not answered within the
+                policy's delay, and the first successful answer wins.
+            cache (ResponseCache | None): Exact-match response cache consulted by
+                `invoke_task`/`ainvoke_task`. Hits cost no free-quota tokens.
+            semantic_cache (SemanticCache | None): Near-duplicate prompt cache checked
+                after an exact-match miss.
+            quota (QuotaLedger | None): Free-tier ledger. Pass a ledger with a `path` to
+                persist quota across restarts and share it between processes. Each
+                entry's `free_limit_tokens` is the limit per reset window; the entry
+                then tracks what remains.
+            rate_limiter (RateLimiter | None): Client-side RPM/TPM buckets. Models whose
+                buckets are empty are routed around; only when every capable model is
+                limited does the request wait, for at most `rate_limit_wait` seconds.
+            health (HealthMonitor | None): Circuit breakers and health scores per model.
+                Failing or slow models rank lower, open circuits are skipped without a
+                request and probed in the background. Defaults to `HealthMonitor()`.
+            latency (LatencyTracker | None): Rolling TTFT, latency and tokens/sec per model.
+            objectives (dict[str, Objective | str] | None): What to optimize per task type,
+                as an `Objective` or one of "cheapest", "fastest", "fastest-first-token".
+                Task types not listed rank by benchmark score per dollar.
+            stream_first_token_timeout (float | None): Seconds a stream may take to send its
+                first token before the next model is tried. None waits indefinitely.
+            stream_stall_timeout (float | None): Seconds a stream may pause between chunks
+                before it is resumed on the next model.
+            single_flight (SingleFlight | None): Coalesces identical concurrent requests
+                (same messages, task type and params) onto one upstream call, and fans
+                one upstream stream out to identical concurrent stream requests.
+            telemetry (Telemetry | None): Receives a span per request with ranking, queue
+                wait, connect, TTFT and total time, tokens, cost, retries and failovers.
+                Off by default, in which case instrumentation costs next to nothing.
+            compactor (HistoryCompactor | None): Trims the conversation to the budget of the
+                model about to answer: its context window less the room for the answer,
+                and the compactor's `max_prompt_tokens`. Without one, history is sent whole.
+            classifier (TaskClassifier | None): Picks the task type and expected answer length of
+                requests made without a task type. Defaults to the rule-based `TaskClassifier()`.
+            scheduler (Scheduler | None): Caps the requests running upstream at once and queues the
+                rest by priority, fair share per tenant and deadline (the `priority`, `tenant` and
+                `deadline` arguments of the task methods). Without one, requests are not queued.
         """
         self.llms = llms
+        self.index = RoutingIndex(llms)
+        self._scan(llms)
+        self.quota = quota or QuotaLedger()
+        self._quota_version = None
+        for entry in llms:
+            entry.setdefault("free_limit_per_window", entry["free_limit_tokens"])
+            self.quota.register(self._quota_key(entry), entry["free_limit_per_window"], entry["llm"].name)
+        self._sync_quota()
         self.max_retries = max_retries
+        self.hedge = hedge
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.rate_limiter = rate_limiter
+        self.rate_limit_wait = rate_limit_wait
+        self.health = health or HealthMonitor()
+        self.latency = latency or LatencyTracker()
+        self.objectives = {
+            task_type: OBJECTIVES[objective] if isinstance(objective, str) else objective
+            for task_type, objective in (objectives or {}).items()
+        }
+        self.stream_first_token_timeout = stream_first_token_timeout
+        self.stream_stall_timeout = stream_stall_timeout
+        self.single_flight = single_flight
+        self.telemetry = telemetry
+        self.compactor = compactor
+        self.classifier = classifier or TaskClassifier()
+        self.scheduler = scheduler
 
     def estimate_tokens_for_task(self, task_type: str) -> int:
-        """Rough token estimate based on task type."""
+        """Rough token estimate based on task type.
+
+        Used as the whole estimate when the messages are unknown, and as the
+        expected completion size on top of the counted prompt otherwise.
+        """
         estimates = {
             "small": 300,
             "medium": 1000,
@@ -72,85 +178,825 @@ class LLMSwitcher:
         }
         return estimates.get(task_type, 500)
 
-    def rank_llms(self, task_type: str):
-        """Rank models by benchmark score and estimated cost."""
-        token_estimate = self.estimate_tokens_for_task(task_type)
-        capable_llms = [l for l in self.llms if task_type in l["tasks"]]
+    def estimate_tokens(self, llm: BaseInference, messages: list[BaseMessage] | None, task_type: str,
+                        completion_tokens: int | None = None) -> int:
+        """Prompt tokens counted with the provider's tokenizer family plus the expected completion.
+
+        `completion_tokens` replaces the per-task completion estimate, e.g. with the classifier's.
+        """
+        completion = self.estimate_tokens_for_task(task_type) if completion_tokens is None else completion_tokens
+        if messages is None:
+            return completion
+        return count_prompt_tokens(messages, family_of(llm)) + completion
 
-        if not capable_llms:
-            raise RuntimeError(f"No LLM available for task type '{task_type}'")
+    def classify_task(self, messages: list[BaseMessage]) -> tuple[str, int]:
+        """(task type, expected completion tokens) of a request, from the `classifier`.
 
-        ranked = []
-        for l in capable_llms:
-            # Calculate effective cost with free quota
-            if token_estimate <= l["free_limit_tokens"]:
-                cost = 0.0
-            else:
-                cost = ((token_estimate - l["free_limit_tokens"]) / 1000) * l["price_per_1k_tokens"]
+        The task type is the classifier's most preferred one that some model serves.
+        """
+        return self.classifier.choose(messages, self.index.task_types())
+
+    def _task(self, messages: list[BaseMessage], task_type: str | None) -> tuple[str, int | None]:
+        """The given task type, or the classified one with its expected completion tokens."""
+        if task_type is not None:
+            return task_type, None
+        return self.classify_task(messages)
+
+    def rank_llms(self, task_type: str, messages: list[BaseMessage] | None = None, deferred: bool = False,
+                  completion_tokens: int | None = None) -> RankedCandidates:
+        """Rank models by benchmark score and estimated cost.
+
+        When `messages` is given, token estimates come from the actual prompt
+        rather than the fixed per-task constants. Results are views over the
+        `llms` entries served from the routing index, not copies.
+
+        Prompt tokens that should hit a model's provider-side prompt cache (a
+        prefix it was sent within the cache lifetime, see `src/prompt_cache.py`)
+        are costed at the entry's `cached_price_per_1k_tokens`, so requests
+        sharing a long prefix lean towards the model that has it cached.
+
+        Models whose `context_window` cannot hold the prompt next to the expected
+        answer (at most their `max_output_tokens`) are left out. With a
+        `compactor`, a model only has to fit the pinned system prompt and the
+        last turn, since the history is trimmed to its budget before sending.
+
+        `deferred` ranks for provider batch endpoints instead: only models whose
+        adapter supports them, costed at the entry's `batch_price_per_1k_tokens`
+        (half the regular price by default) with no free quota, and without a
+        latency objective since answers take hours anyway.
+
+        `completion_tokens` overrides the expected answer length of `task_type`.
+        """
+        if self.quota.poll() != self._quota_version:
+            self._sync_quota()
+
+        estimates = {}
+
+        def tokens_for(entry: dict) -> int:
+            family = family_of(entry["llm"])
+            if family not in estimates:
+                estimates[family] = self.estimate_tokens(entry["llm"], messages, task_type, completion_tokens)
+            return estimates[family]
+
+        if deferred:
+            ranked = self.index.rank_deferred(task_type, tokens_for, self.health.penalties)
+            if messages is not None and self._windowed:
+                ranked = RankedCandidates(self._within_window(ranked, messages, task_type, compacted=False, completion_tokens=completion_tokens))
+            return ranked
+        ranked = self.index.rank(task_type, tokens_for, self.health.penalties, self._cached_tokens(messages))
+        if messages is not None and self._windowed:
+            ranked = RankedCandidates(self._within_window(ranked, messages, task_type, self.compactor is not None, completion_tokens))
+        objective = self.objectives.get(task_type)
+        if objective is None:
+            return ranked
+        return objective.order(ranked, self.latency, self.estimate_tokens_for_task(task_type) if completion_tokens is None else completion_tokens)
+
+    def _scan(self, llms: list[dict]):
+        """Note which entries have a cached-token price (and a prompt cache) and whether any has a context window."""
+        self._cache_priced = [entry for entry in llms if "cached_price_per_1k_tokens" in entry and getattr(entry["llm"], "prompt_cache", None) is not None]
+        self._windowed = any("context_window" in entry for entry in llms)
+
+    def _prompt_budget(self, entry: dict, task_type: str, completion_tokens: int | None = None) -> int | None:
+        """Prompt tokens that fit the model's context window next to the expected answer; None if unknown."""
+        window = entry.get("context_window")
+        if window is None:
+            return None
+        completion = self.estimate_tokens_for_task(task_type) if completion_tokens is None else completion_tokens
+        return window - min(completion, entry.get("max_output_tokens", window))
+
+    def _within_window(self, ranked: RankedCandidates, messages: list[BaseMessage], task_type: str,
+                       compacted: bool, completion_tokens: int | None = None) -> Iterator[RankedLLM]:
+        """`ranked` without the models whose context window cannot take the prompt, even compacted when `compacted`."""
+        completion = self.estimate_tokens_for_task(task_type) if completion_tokens is None else completion_tokens
+        minimum = {}
+        skipped = fitted = 0
+        for selected in ranked:
+            budget = self._prompt_budget(selected.entry, task_type, completion)
+            # Compaction reserves the same room for the answer as this check
+            selected.completion_tokens = completion
+            if budget is not None:
+                if compacted:
+                    budget = self.compactor.budget(budget)
+                    family = family_of(selected["llm"])
+                    if family not in minimum:
+                        minimum[family] = self.compactor.minimum_tokens(messages, family)
+                    needed = minimum[family]
+                else:
+                    needed = selected.token_estimate - completion
+                if needed > budget:
+                    logger.info("Skipping %s: a %d-token prompt does not fit its %d-token budget", selected["llm"].model, needed, budget)
+                    skipped += 1
+                    continue
+            fitted += 1
+            yield selected
+        if skipped and not fitted:
+            raise RuntimeError(f"No LLM for task type '{task_type}' has a context window that fits this prompt")
+
+    def _fit(self, selected: RankedLLM, messages: list[BaseMessage], task_type: str) -> list[BaseMessage]:
+        """`messages` compacted to the selected model's budget."""
+        if self.compactor is None:
+            return messages
+        budget = self._prompt_budget(selected.entry, task_type, selected.completion_tokens)
+        return self.compactor.compact(messages, budget, family_of(selected["llm"]))
+
+    async def _afit(self, selected: RankedLLM, messages: list[BaseMessage], task_type: str) -> list[BaseMessage]:
+        if self.compactor is None:
+            return messages
+        budget = self._prompt_budget(selected.entry, task_type, selected.completion_tokens)
+        return await self.compactor.acompact(messages, budget, family_of(selected["llm"]))
+
+    def _cached_tokens(self, messages: list[BaseMessage] | None) -> dict[int, int]:
+        """id(entry) -> prompt tokens of `messages` expected to hit that model's prompt cache."""
+        if messages is None or not self._cache_priced:
+            return {}
+        cached = {}
+        for entry in self._cache_priced:
+            tokens = entry["llm"].prompt_cache.warm_tokens(messages)
+            if tokens:
+                cached[id(entry)] = tokens
+        return cached
+
+    def health_status(self) -> dict[str, dict]:
+        """Circuit state, error rate and latency EWMA per model ("provider:model"), for dashboards."""
+        return self.health.snapshot()
+
+    def latency_status(self) -> dict[str, dict]:
+        """Measured TTFT, latency and tokens/sec percentiles per model, for dashboards."""
+        return self.latency.snapshot()
+
+    def scheduler_status(self) -> dict:
+        """Slots in use, queue depth per priority and tenant, rejections and wait-time percentiles; empty without a scheduler."""
+        return self.scheduler.snapshot() if self.scheduler is not None else {}
 
-            score = l["benchmark_score"] / (cost + 1e-6)  # prevent divide by zero
-            ranked.append({**l, "rank_score": score, "estimated_cost": cost, "token_estimate": token_estimate})
+    def _acquire(self, admission: Admission):
+        """A scheduler slot for `admission` (None without a scheduler), with the queue wait timed into the request's span."""
+        if self.scheduler is None:
+            return None
+        ticket = self.scheduler.acquire(admission)
+        current_span().waited(ticket.waited)
+        return ticket
 
-        ranked.sort(key=lambda x: x["rank_score"], reverse=True)
+    async def _aacquire(self, admission: Admission):
+        if self.scheduler is None:
+            return None
+        ticket = await self.scheduler.aacquire(admission)
+        current_span().waited(ticket.waited)
+        return ticket
+
+    def _release(self, ticket):
+        if ticket is not None:
+            self.scheduler.release(ticket)
+
+    @contextmanager
+    def _slot(self, admission: Admission):
+        ticket = self._acquire(admission)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def _aslot(self, admission: Admission):
+        ticket = await self._aacquire(admission)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def _span(self, operation: str, task_type: str):
+        return NULL_SPAN if self.telemetry is None else self.telemetry.span(operation, task_type)
+
+    def _ranked(self, task_type: str, messages: list[BaseMessage], span=NULL_SPAN, completion_tokens: int | None = None) -> RankedCandidates:
+        """`rank_llms`, timed into the request's span."""
+        span = span or current_span()
+        if not span:
+            return self.rank_llms(task_type, messages, completion_tokens=completion_tokens)
+        started = time.perf_counter()
+        ranked = self.rank_llms(task_type, messages, completion_tokens=completion_tokens)
+        span.ranked(time.perf_counter() - started)
         return ranked
 
-    def _consume_quota(self, selected: dict, tokens_used: int):
+    def refresh_index(self):
+        """Rebuild the routing index after `self.llms` was edited in place."""
+        self.index.rebuild(self.llms)
+        self._scan(self.llms)
+
+    def update_llm(self, selected: dict | RankedLLM, **changes):
+        """Change routing fields of a model (e.g. price_per_1k_tokens, free_limit_tokens) and re-rank it."""
+        entry = selected.entry if isinstance(selected, RankedLLM) else selected
+        self.index.update(entry, **changes)
+        self._scan(self.llms)
+
+    def _quota_key(self, entry: dict) -> str:
+        return self.quota.key(entry["llm"].name, entry["llm"].model)
+
+    def _sync_quota(self):
+        """Pull remaining quota from the ledger (resets, other processes) into the routing index."""
+        self._quota_version = self.quota.version
+        for entry in self.llms:
+            remaining = self.quota.remaining(self._quota_key(entry))
+            if remaining != entry["free_limit_tokens"]:
+                self.index.set_quota(entry, remaining)
+
+    def _consume_quota(self, selected: RankedLLM, tokens_used: int):
         """Reduce the free token quota after usage."""
-        selected["free_limit_tokens"] = max(0, selected["free_limit_tokens"] - tokens_used)
+        remaining = self.quota.consume(self._quota_key(selected.entry), tokens_used)
+        self.index.set_quota(selected.entry, remaining)
+
+    def _build_reason(self, selected: dict, task_type: str) -> str:
+        if selected["estimated_cost"] == 0:
+            cost_reason = "covered by free token quota"
+        else:
+            cost_reason = f"expected cost ${selected['estimated_cost']:.4f}"
+        return (
+            f"Selected {selected['llm'].model} due to high benchmark ({selected['benchmark_score']}) "
+            f"and {cost_reason} for {task_type} task."
+        )
+
+    def _cache_key(self, selected: dict, messages: list[BaseMessage], task_type: str, json: bool) -> str | None:
+        llm = selected["llm"]
+        if self.cache is None or not self.cache.cacheable(llm.temperature):
+            return None
+        return make_key(messages, task_type, llm.model, llm.temperature, json)
+
+    def _cached(self, ranked_llms: list[dict], messages: list[BaseMessage], task_type: str, json: bool) -> tuple[str, str, float, str] | None:
+        """Return a cached answer from any capable model, in rank order."""
+        if self.cache is None:
+            return self._semantic_cached(ranked_llms, messages, task_type, json)
+        keyed = [(selected, self._cache_key(selected, messages, task_type, json)) for selected in ranked_llms]
+        keyed = [(selected, key) for selected, key in keyed if key is not None]
+        # One lookup per request, so a miss counts once however many models could have answered
+        hit = self.cache.get_first([key for _, key in keyed]) if keyed else None
+        if hit is not None:
+            position, content = hit
+            selected = keyed[position][0]
+            reason = f"Served {selected['llm'].model} response from cache for {task_type} task."
+            return content, selected["llm"].model, 0.0, reason
+        return self._semantic_cached(ranked_llms, messages, task_type, json)
+
+    def _semantic_cached(self, ranked_llms: list[dict], messages: list[BaseMessage], task_type: str, json: bool) -> tuple[str, str, float, str] | None:
+        if self.semantic_cache is None:
+            return None
+        if not any(self.semantic_cache.cacheable(selected["llm"].temperature) for selected in ranked_llms):
+            return None
+        hit = self.semantic_cache.lookup(messages, task_type, json)
+        if hit is None:
+            return None
+        content, model = hit
+        return content, model, 0.0, f"Served similar {model} response from semantic cache for {task_type} task."
+
+    def _store(self, selected: dict, result: AIMessage, messages: list[BaseMessage], task_type: str, json: bool):
+        key = self._cache_key(selected, messages, task_type, json)
+        if key is not None:
+            self.cache.set(key, result.content)
+        if self.semantic_cache is not None and self.semantic_cache.cacheable(selected["llm"].temperature):
+            self.semantic_cache.store(messages, task_type, selected["llm"].model, result.content, json)
+
+    def _claim(self, selected: RankedLLM, wait: bool = True, span=NULL_SPAN) -> bool:
+        """Take `selected`'s rate-limit tokens and claim its breaker right before a request is sent to it.
 
-    def invoke_task(self, messages: list[BaseMessage], task_type: str) -> tuple[str, str, float, str]:
+        Only waits for tokens (up to `rate_limit_wait`) when `wait`; otherwise a
+        rate-limited model is passed over and nothing is spent on it.
+        """
+        span = span or current_span()
+        if not self.health.available(selected.entry):
+            return False
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire(selected.entry, selected.token_estimate):
+            if not wait:
+                return False
+            started = time.perf_counter()
+            acquired = self.rate_limiter.acquire(selected.entry, selected.token_estimate, timeout=self.rate_limit_wait)
+            span.waited(time.perf_counter() - started)
+            if not acquired:
+                return False
+        # A half-open breaker's single trial is only claimed once the tokens are in hand
+        return self.health.allow(selected.entry)
+
+    async def _aclaim(self, selected: RankedLLM, wait: bool = True, span=NULL_SPAN) -> bool:
+        """Async counterpart of `_claim`."""
+        span = span or current_span()
+        if not self.health.available(selected.entry):
+            return False
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire(selected.entry, selected.token_estimate):
+            if not wait:
+                return False
+            started = time.perf_counter()
+            acquired = await self.rate_limiter.aacquire(selected.entry, selected.token_estimate, timeout=self.rate_limit_wait)
+            span.waited(time.perf_counter() - started)
+            if not acquired:
+                return False
+        return self.health.allow(selected.entry)
+
+    def _admitted(self, ranked_llms, span=NULL_SPAN) -> Iterator[RankedLLM]:
+        """Yield candidates in rank order, skipping open circuits and rate-limited models, then wait on the rate-limited ones.
+
+        Each candidate is claimed only when the next one is pulled, i.e. when it is about to be sent.
+        """
+        span = span or current_span()
+        deferred = []
+        for selected in ranked_llms:
+            if self._claim(selected, False, span):
+                yield selected
+            elif self.rate_limiter is not None and self.health.available(selected.entry):
+                deferred.append(selected)
+        for selected in sorted(deferred, key=lambda s: self.rate_limiter.wait_time(s.entry, s.token_estimate)):
+            if self._claim(selected, True, span):
+                yield selected
+
+    async def _aadmitted(self, ranked_llms, span=NULL_SPAN) -> AsyncIterator[RankedLLM]:
+        """Async counterpart of `_admitted`."""
+        span = span or current_span()
+        deferred = []
+        for selected in ranked_llms:
+            if await self._aclaim(selected, False, span):
+                yield selected
+            elif self.rate_limiter is not None and self.health.available(selected.entry):
+                deferred.append(selected)
+        for selected in sorted(deferred, key=lambda s: self.rate_limiter.wait_time(s.entry, s.token_estimate)):
+            if await self._aclaim(selected, True, span):
+                yield selected
+
+    def _is_rate_limited(self, error: Exception) -> bool:
+        return isinstance(error, HTTPStatusError) and error.response.status_code == 429
+
+    def _record(self, selected: dict, started: float, error: Exception | None = None,
+                ttft: float | None = None, output_tokens: int | None = None):
+        """Feed one attempt into the model's health and latency; rate limiting is not a health problem."""
+        latency = time.perf_counter() - started
+        if error is None:
+            self.health.record_success(selected.entry, latency)
+            self.latency.record(selected.entry, latency, ttft, output_tokens)
+        elif not self._is_rate_limited(error):
+            self.health.record_failure(selected.entry, latency)
+
+    def _should_retry(self, selected: dict, error: Exception, retries: int) -> bool:
+        """Whether to retry the same model; 429s and open circuits move on right away."""
+        if self._is_rate_limited(error):
+            if self.rate_limiter is not None:
+                try:
+                    retry_after = float(error.response.headers.get("retry-after", 1))
+                except ValueError:
+                    retry_after = 1.0
+                self.rate_limiter.penalize(selected.entry, retry_after)
+            return False
+        if retries >= self.max_retries or not self.health.closed(selected.entry):
+            return False
+        return self.rate_limiter is None or self.rate_limiter.try_acquire(selected.entry, selected.token_estimate)
+
+    def _invoke_with_retries(self, selected: dict, messages: list[BaseMessage], json: bool = False, task_type: str | None = None) -> AIMessage:
+        """Call the selected model, retrying it while `_should_retry` allows; with `task_type`, compacts the history for it first."""
+        if task_type is not None:
+            messages = self._fit(selected, messages, task_type)
+        span = current_span()
+        retries = 0
+        while True:
+            span.attempt(selected)
+            started = time.perf_counter()
+            try:
+                result = selected["llm"].invoke(messages, json=json)
+            except Exception as e:
+                logger.warning("Error with %s: %s", selected["llm"].model, e)
+                span.failed(selected, e)
+                self._record(selected, started, e)
+                retries += 1
+                if not self._should_retry(selected, e, retries):
+                    raise
+            else:
+                self._record(selected, started)
+                return result
+
+    async def _ainvoke_with_retries(self, selected: dict, messages: list[BaseMessage], json: bool = False, task_type: str | None = None) -> AIMessage:
+        if task_type is not None:
+            messages = await self._afit(selected, messages, task_type)
+        span = current_span()
+        retries = 0
+        while True:
+            span.attempt(selected)
+            started = time.perf_counter()
+            try:
+                result = await selected["llm"].ainvoke(messages, json=json)
+            except Exception as e:
+                logger.warning("Error with %s: %s", selected["llm"].model, e)
+                span.failed(selected, e)
+                self._record(selected, started, e)
+                retries += 1
+                if not self._should_retry(selected, e, retries):
+                    raise
+            else:
+                self._record(selected, started)
+                return result
+
+    def _output_tokens(self, selected: dict, chunk: str) -> int:
+        return count_text_tokens(chunk, family_of(selected["llm"]))
+
+    def _complete(self, selected: dict, result: AIMessage, task_type: str, reserved: int = 0) -> tuple[str, str, float, str]:
+        # Update free quota after successful usage; only the answering model is charged.
+        # Provider-reported usage replaces the estimate when available; `reserved` was charged up front.
+        self._consume_quota(selected, (usage_tokens(result.usage) or selected["token_estimate"]) - reserved)
+        span = current_span()
+        if span:
+            usage = result.usage or {}
+            tokens_out = usage.get("completion_tokens")
+            if tokens_out is None and isinstance(result.content, str):
+                tokens_out = self._output_tokens(selected, result.content)
+            span.succeeded(selected, usage.get("prompt_tokens", selected["token_estimate"] - self.estimate_tokens_for_task(task_type)), tokens_out)
+        reason = self._build_reason(selected, task_type)
+        return result.content, selected["llm"].model, selected["estimated_cost"], reason
+
+    def invoke_task(self, messages: list[BaseMessage], task_type: str | None = None, json: bool = False,
+                    priority: str = "default", tenant: str = "default", deadline: float | None = None) -> tuple[str, str, float, str]:
         """Invoke a task on the best-ranked LLM.
 
+        Without `task_type`, the `classifier` picks it and the expected answer
+        length from the messages (see `classify_task`).
+
+        With a `scheduler`, the request waits for an upstream slot by `priority`
+        and `tenant`, and raises `AdmissionRejected` if it would not be answered
+        within `deadline` seconds (cache hits never wait).
+
+        With `single_flight`, a request identical to one already in flight waits
+        for and shares that request's answer instead of calling a model itself.
+
         Returns:
             response_content (str),
             model_name (str),
             estimated_cost (float),
             reason (str)
         """
-        ranked_llms = self.rank_llms(task_type)
+        task_type, completion_tokens = self._task(messages, task_type)
+        admission = Admission.within(deadline, priority, tenant)
+        with self._span("invoke", task_type):
+            if self.single_flight is not None:
+                key = flight_key("invoke", messages, task_type, json)
+                return self.single_flight.do(key, lambda: self._invoke_task(messages, task_type, json, completion_tokens, admission))
+            return self._invoke_task(messages, task_type, json, completion_tokens, admission)
 
-        for selected in ranked_llms:
-            retries = 0
-            while retries < self.max_retries:
+    def _invoke_task(self, messages: list[BaseMessage], task_type: str, json: bool,
+                     completion_tokens: int | None = None, admission: Admission = Admission()) -> tuple[str, str, float, str]:
+        ranked_llms = self._ranked(task_type, messages, completion_tokens=completion_tokens)
+
+        cached = self._cached(ranked_llms, messages, task_type, json)
+        if cached is not None:
+            current_span().cached(cached[1])
+            return cached
+
+        with self._slot(admission):
+            if self.hedge is not None:
+                # Candidates are claimed by the hedger as it sends them, so a backup that is never sent costs nothing
+                selected, result = self.hedge.run(ranked_llms, lambda s: self._invoke_with_retries(s, messages, json, task_type), self._claim)
+                self._store(selected, result, messages, task_type, json)
+                return self._complete(selected, result, task_type)
+
+            for selected in self._admitted(ranked_llms):
                 try:
-                    result: AIMessage = selected["llm"].invoke(messages)
-
-                    # Update free quota after successful usage
-                    self._consume_quota(selected, selected["token_estimate"])
-
-                    # Build reason
-                    if selected["estimated_cost"] == 0:
-                        cost_reason = "covered by free token quota"
-                    else:
-                        cost_reason = f"expected cost ${selected['estimated_cost']:.4f}"
-                    reason = (
-                        f"Selected {selected['llm'].model} due to high benchmark ({selected['benchmark_score']}) "
-                        f"and {cost_reason} for {task_type} task."
-                    )
-
-                    return result.content, selected["llm"].model, selected["estimated_cost"], reason
-                except Exception as e:
-                    print(f"Error with {selected['llm'].model}: {e}")
-                    retries += 1
+                    result = self._invoke_with_retries(selected, messages, json, task_type)
+                except Exception:
+                    continue
+                self._store(selected, result, messages, task_type, json)
+                return self._complete(selected, result, task_type)
 
         raise RuntimeError("All suitable LLMs failed for this task")
 
-    def stream_task(self, messages: list[BaseMessage], task_type: str):
-        """Stream response from the best-ranked LLM."""
-        ranked_llms = self.rank_llms(task_type)
+    def stream_task(self, messages: list[BaseMessage], task_type: str | None = None, first_token_timeout: float | None = None,
+                    stall_timeout: float | None = None, resume: bool = True, priority: str = "default", tenant: str = "default",
+                    deadline: float | None = None) -> tuple[FailoverStream | SharedStream, str]:
+        """Stream response from the best-ranked LLM, failing over to the next one if it breaks.
 
-        for selected in ranked_llms:
-            retries = 0
-            while retries < self.max_retries:
+        Returns once the first token has arrived, so the returned model is the one
+        answering. Timeouts default to the switcher's `stream_first_token_timeout`
+        and `stream_stall_timeout`. If the stream breaks mid-answer it continues on
+        the next model (see `FailoverStream`); `stream.models` lists every model used.
+        With `single_flight`, identical concurrent stream requests share one upstream
+        stream and each get a `SharedStream` of it from the first chunk.
+        Without `task_type`, the `classifier` picks it as in `invoke_task`. With a
+        `scheduler`, the stream holds an upstream slot until it ends or is closed.
+        """
+        task_type, completion_tokens = self._task(messages, task_type)
+        admission = Admission.within(deadline, priority, tenant)
+        first_token_timeout = self.stream_first_token_timeout if first_token_timeout is None else first_token_timeout
+        stall_timeout = self.stream_stall_timeout if stall_timeout is None else stall_timeout
+
+        # The span lives on the stream and ends with it
+        span = self._span("stream", task_type)
+        opened = []
+
+        def open_stream() -> FailoverStream:
+            opened.append(True)
+            try:
+                ranked_llms = self._ranked(task_type, messages, span, completion_tokens)
+                ticket = self._acquire(admission)
+            except BaseException as e:
+                span.end(e)
+                raise
+            return FailoverStream(
+                self, self._admitted(ranked_llms, span), messages,
+                first_token_timeout=first_token_timeout, stall_timeout=stall_timeout, resume=resume, span=span,
+                task_type=task_type, on_close=ticket and (lambda: self._release(ticket)),
+            ).start()
+
+        if self.single_flight is not None:
+            key = flight_key("stream", messages, task_type, first_token_timeout, stall_timeout, resume)
+            stream = self.single_flight.stream(key, open_stream)
+            if not opened:
+                span.end()
+        else:
+            stream = open_stream()
+        return stream, stream.model
+
+    async def ainvoke_task(self, messages: list[BaseMessage], task_type: str | None = None, json: bool = False,
+                           priority: str = "default", tenant: str = "default", deadline: float | None = None) -> tuple[str, str, float, str]:
+        """Async counterpart of `invoke_task`, using each adapter's native `ainvoke`.
+
+        Ranking, retries, failover, quota consumption and coalescing behave exactly
+        as in the sync path, so many routed requests can share one event loop.
+        """
+        task_type, completion_tokens = self._task(messages, task_type)
+        admission = Admission.within(deadline, priority, tenant)
+        with self._span("ainvoke", task_type):
+            if self.single_flight is not None:
+                key = flight_key("invoke", messages, task_type, json)
+                return await self.single_flight.ado(key, lambda: self._ainvoke_task(messages, task_type, json, completion_tokens, admission))
+            return await self._ainvoke_task(messages, task_type, json, completion_tokens, admission)
+
+    async def _ainvoke_task(self, messages: list[BaseMessage], task_type: str, json: bool,
+                            completion_tokens: int | None = None, admission: Admission = Admission()) -> tuple[str, str, float, str]:
+        ranked_llms = self._ranked(task_type, messages, completion_tokens=completion_tokens)
+
+        cached = self._cached(ranked_llms, messages, task_type, json)
+        if cached is not None:
+            current_span().cached(cached[1])
+            return cached
+
+        async with self._aslot(admission):
+            if self.hedge is not None:
+                selected, result = await self.hedge.arun(ranked_llms, lambda s: self._ainvoke_with_retries(s, messages, json, task_type), self._aclaim)
+                self._store(selected, result, messages, task_type, json)
+                return self._complete(selected, result, task_type)
+
+            async for selected in self._aadmitted(ranked_llms):
+                try:
+                    result = await self._ainvoke_with_retries(selected, messages, json, task_type)
+                except Exception:
+                    continue
+                self._store(selected, result, messages, task_type, json)
+                return self._complete(selected, result, task_type)
+
+        raise RuntimeError("All suitable LLMs failed for this task")
+
+    async def astream_task(self, messages: list[BaseMessage], task_type: str | None = None, first_token_timeout: float | None = None,
+                           stall_timeout: float | None = None, resume: bool = True, priority: str = "default", tenant: str = "default",
+                           deadline: float | None = None) -> tuple[AsyncFailoverStream | AsyncSharedStream, str]:
+        """Async counterpart of `stream_task`; returns an async iterator and the model name."""
+        task_type, completion_tokens = self._task(messages, task_type)
+        admission = Admission.within(deadline, priority, tenant)
+        first_token_timeout = self.stream_first_token_timeout if first_token_timeout is None else first_token_timeout
+        stall_timeout = self.stream_stall_timeout if stall_timeout is None else stall_timeout
+
+        span = self._span("astream", task_type)
+        opened = []
+
+        async def open_stream() -> AsyncFailoverStream:
+            opened.append(True)
+            try:
+                ranked_llms = self._ranked(task_type, messages, span, completion_tokens)
+                ticket = await self._aacquire(admission)
+            except BaseException as e:
+                span.end(e)
+                raise
+            return await AsyncFailoverStream(
+                self, self._aadmitted(ranked_llms, span), messages,
+                first_token_timeout=first_token_timeout, stall_timeout=stall_timeout, resume=resume, span=span,
+                task_type=task_type, on_close=ticket and (lambda: self._release(ticket)),
+            ).start()
+
+        if self.single_flight is not None:
+            key = flight_key("stream", messages, task_type, first_token_timeout, stall_timeout, resume)
+            stream = await self.single_flight.astream(key, open_stream)
+            if not opened:
+                span.end()
+        else:
+            stream = await open_stream()
+        return stream, stream.model
+
+    async def _batch_slot(self, slots: ModelSlots, messages: list[BaseMessage], task_type: str, failed: set[int],
+                          completion_tokens: int | None = None) -> RankedLLM | None:
+        """Take a slot on the best-ranked model with room, waiting while capable models are busy."""
+        while True:
+            busy = False
+            waits = []
+            # Re-ranked on every pass so quota reserved by other jobs is seen
+            for selected in self.rank_llms(task_type, messages, completion_tokens=completion_tokens):
+                if id(selected.entry) in failed:
+                    continue
+                if not slots.has_room(selected.entry):
+                    busy = True
+                    continue
+                if not self.health.available(selected.entry):
+                    continue
+                if self.rate_limiter is not None and not self.rate_limiter.try_acquire(selected.entry, selected.token_estimate):
+                    waits.append(self.rate_limiter.wait_time(selected.entry, selected.token_estimate))
+                    continue
+                if not self.health.allow(selected.entry):
+                    continue
+                slots.take(selected.entry)
+                return selected
+            if not busy and not waits:
+                return None
+            started = time.perf_counter()
+            await slots.wait(min(waits) if waits else None)
+            current_span().waited(time.perf_counter() - started)
+
+    async def _batch_job(self, slots: ModelSlots, messages: list[BaseMessage], task_type: str | None, json: bool,
+                         admission: Admission) -> tuple[str, str, float, str]:
+        task_type, completion_tokens = self._task(messages, task_type)
+        with self._span("batch", task_type):
+            return await self._run_batch_job(slots, messages, task_type, json, completion_tokens, admission)
+
+    async def _run_batch_job(self, slots: ModelSlots, messages: list[BaseMessage], task_type: str, json: bool,
+                             completion_tokens: int | None = None, admission: Admission = Admission()) -> tuple[str, str, float, str]:
+        ranked_llms = self._ranked(task_type, messages, completion_tokens=completion_tokens)
+        cached = self._cached(ranked_llms, messages, task_type, json)
+        if cached is not None:
+            current_span().cached(cached[1])
+            return cached
+
+        async with self._aslot(admission):
+            failed = set()
+            while True:
+                selected = await self._batch_slot(slots, messages, task_type, failed, completion_tokens)
+                if selected is None:
+                    raise RuntimeError("All suitable LLMs failed for this task")
+                # Reserve the free quota up front so concurrent jobs cannot all spend the same tokens
+                reserved = selected["token_estimate"]
+                self._consume_quota(selected, reserved)
+                try:
+                    result = await self._ainvoke_with_retries(selected, messages, json, task_type)
+                except BaseException as e:
+                    self._consume_quota(selected, -reserved)
+                    if not isinstance(e, Exception):
+                        raise
+                    failed.add(id(selected.entry))
+                    continue
+                finally:
+                    slots.release(selected.entry)
+                self._store(selected, result, messages, task_type, json)
+                return self._complete(selected, result, task_type, reserved)
+
+    async def ainvoke_many(self, jobs: Iterable[tuple[list[BaseMessage], str | None]], json: bool = False, concurrency: int = 32,
+                           max_per_model: int = 8, checkpoint: str | None = None, priority: str = "batch",
+                           tenant: str = "default") -> AsyncIterator[tuple[int, tuple[str, str, float, str] | Exception]]:
+        """Run many (messages, task_type) jobs and yield (index, result) in completion order.
+
+        Jobs are read lazily and at most `concurrency` run at once. Each job goes to
+        the best-ranked model that has a free slot; a model takes at most its entry's
+        `max_concurrency` (default `max_per_model`) jobs at a time, so work spills over
+        to the next capable models instead of queueing. Free quota is reserved when a
+        job is dispatched. A failed job yields its exception instead of a result and
+        does not stop the batch. A job whose task type is None is classified.
+
+        With `checkpoint`, every result the caller has taken is appended to that JSONL
+        file, and jobs already recorded there are skipped (not yielded again) when the
+        same batch is started again after a crash.
+
+        With a `scheduler`, every job also queues for an upstream slot, at the
+        "batch" `priority` by default so that interactive requests go first.
+        """
+        record = Checkpoint(checkpoint) if checkpoint else None
+        admission = Admission(priority, tenant)
+        slots = ModelSlots(lambda entry: entry.get("max_concurrency", max_per_model))
+        pending = iter(pending_jobs(jobs, record))
+        running: dict[asyncio.Task, int] = {}
+        try:
+            while True:
+                while len(running) < concurrency:
+                    item = next(pending, None)
+                    if item is None:
+                        break
+                    index, (messages, task_type) = item
+                    running[asyncio.ensure_future(self._batch_job(slots, messages, task_type, json, admission))] = index
+                if not running:
+                    return
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        yield index, e
+                        continue
+                    yield index, result
+                    # Recorded once the caller asks for more, so a crash re-runs rather than drops it
+                    if record is not None:
+                        record.write(index, result)
+        finally:
+            for task in running:
+                task.cancel()
+            if record is not None:
+                record.close()
+
+    def invoke_many(self, jobs: Iterable[tuple[list[BaseMessage], str | None]], json: bool = False, concurrency: int = 32,
+                    max_per_model: int = 8, checkpoint: str | None = None, priority: str = "batch",
+                    tenant: str = "default") -> Iterator[tuple[int, tuple[str, str, float, str] | Exception]]:
+        """Sync counterpart of `ainvoke_many`; the jobs run on a private event loop thread."""
+        results = queue.SimpleQueue()
+        end = object()
+        running = {}
+
+        async def pump():
+            running["loop"], running["task"] = asyncio.get_running_loop(), asyncio.current_task()
+            batch = self.ainvoke_many(jobs, json, concurrency, max_per_model, checkpoint, priority, tenant)
+            try:
+                async for item in batch:
+                    taken = running["loop"].create_future()
+                    results.put((item, taken))
+                    # Move on (and checkpoint this result) only once the caller has it
+                    await taken
+            finally:
+                await batch.aclose()
+
+        def run():
+            try:
+                asyncio.run(pump())
+            except BaseException as e:
+                results.put(e)
+            finally:
+                results.put(end)
+
+        thread = threading.Thread(target=run, name="invoke-many", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is end:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                result, taken = item
+                yield result
+                running["loop"].call_soon_threadsafe(lambda: taken.done() or taken.set_result(None))
+        finally:
+            if thread.is_alive():
                 try:
-                    stream = selected["llm"].stream(messages)
+                    running["loop"].call_soon_threadsafe(running["task"].cancel)
+                except RuntimeError:
+                    pass  # the loop already finished
+            thread.join()
 
-                    # Update free quota for streaming tasks
-                    self._consume_quota(selected, selected["token_estimate"])
+    def submit_deferred(self, jobs: Iterable[tuple[list[BaseMessage], str | None]], json: bool = False) -> DeferredBatch:
+        """Submit (messages, task_type) jobs to provider batch endpoints for bulk, low-priority work.
 
-                    return stream, selected["llm"].model
+        Each job goes to its best model under the deferred cost model (see
+        `rank_llms`), and the jobs of one model are submitted as one provider
+        batch. If a submission fails, its jobs move on to their next candidate.
+        Returns a `DeferredBatch`; `collect()` waits for the answers, which are
+        keyed by job index. Free quota is not consumed, since batch endpoints
+        bill every token. Jobs whose task type is None are classified.
+        """
+        batch = DeferredBatch(json)
+        queued = []
+        for index, (messages, task_type) in enumerate(jobs):
+            task_type, completion_tokens = self._task(messages, task_type)
+            queued.append((index, messages, task_type, iter(self.rank_llms(task_type, messages, deferred=True, completion_tokens=completion_tokens))))
+        while queued:
+            groups: dict[int, list] = {}
+            for job in queued:
+                index, messages, task_type, candidates = job
+                selected = next((s for s in candidates if self.health.allow(s.entry)), None)
+                if selected is None:
+                    batch.fail(index, RuntimeError("All suitable LLMs failed to accept this deferred task"))
+                    continue
+                groups.setdefault(id(selected.entry), []).append((job, selected))
+            queued = []
+            for group in groups.values():
+                selected = group[0][1]
+                started = time.perf_counter()
+                try:
+                    batch_id = selected["llm"].submit_batch([(str(job[0]), job[1]) for job, _ in group], json)
                 except Exception as e:
-                    print(f"Streaming error with {selected['llm'].model}: {e}")
-                    retries += 1
+                    logger.warning("Batch submission error with %s: %s", selected["llm"].model, e)
+                    self._record(selected, started, e)
+                    queued.extend(job for job, _ in group)
+                    continue
+                reason = "Deferred to the {} batch endpoint for {} task at expected cost ${:.4f}."
+                batch.add(selected["llm"], batch_id, {
+                    str(job[0]): (job[0], chosen["estimated_cost"], reason.format(chosen["llm"].model, job[2], chosen["estimated_cost"]))
+                    for job, chosen in group
+                })
+        return batch
+
+    async def asubmit_deferred(self, jobs: Iterable[tuple[list[BaseMessage], str | None]], json: bool = False) -> DeferredBatch:
+        """Async counterpart of `submit_deferred`; uploads run in a worker thread."""
+        return await asyncio.to_thread(self.submit_deferred, jobs, json)
 
-        raise RuntimeError("All suitable LLMs failed for streaming task")
+    def resume_deferred(self, state: dict) -> DeferredBatch:
+        """Rebuild a `DeferredBatch` from its `state()`, e.g. in a later process."""
+        llms = {(entry["llm"].name, entry["llm"].model): entry["llm"] for entry in self.llms}
+        batch = DeferredBatch(state.get("json", False))
+        for saved in state["batches"]:
+            llm = llms.get((saved["provider"], saved["model"]))
+            if llm is None:
+                raise KeyError(f"No {saved['provider']} model {saved['model']} configured to resume batch {saved['batch_id']}")
+            batch.add(llm, saved["batch_id"], {custom_id: tuple(job) for custom_id, job in saved["jobs"].items()})
+        for index, error in state.get("failed", {}).items():
+            batch.fail(int(index), RuntimeError(error))
+        return batch
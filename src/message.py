@@ -1,8 +1,6 @@
-from io import BytesIO
 from abc import ABC
-import requests
-import base64
-import re
+
+from src.image import ImageSource
 
 class BaseMessage(ABC):
     def to_dict(self) -> dict[str, str]:
@@ -13,7 +11,8 @@ class BaseMessage(ABC):
 
     def __repr__(self):
         class_name = self.__class__.__name__
-        attrs = ", ".join(f"{k}={v}" for k, v in self.__dict__.items())
+        # Private attributes are caches, e.g. the adapters' encoded forms
+        attrs = ", ".join(f"{k}={v}" for k, v in self.__dict__.items() if not k.startswith('_'))
         return f"{class_name}({attrs})"
 
 
@@ -24,9 +23,11 @@ class HumanMessage(BaseMessage):
 
 
 class AIMessage(BaseMessage):
-    def __init__(self, content: str):
+    def __init__(self, content: str, usage: dict | None = None):
         self.role = 'assistant'
         self.content = content
+        # Provider-reported token usage: prompt_tokens, completion_tokens, total_tokens
+        self.usage = usage
 
 
 class SystemMessage(BaseMessage):
@@ -36,32 +37,29 @@ class SystemMessage(BaseMessage):
 
 
 class ImageMessage(BaseMessage):
-    def __init__(self, text: str = None, image_path: str = None, image_base_64: str = None):
+    def __init__(self, text: str = None, image_path: str = None, image_base_64: str = None, downscale: bool | int = False):
+        """An image with optional text. `content` is `(text, ImageSource | None)`.
+
+        The image is read lazily: a file is memory-mapped and a URL downloaded when
+        a request is encoded (see `src/image.py`), so conversation history only holds
+        a reference. With `downscale`, it is resized locally to the provider's maximum
+        resolution (or to `downscale` pixels on the longer side); this needs Pillow.
+        """
         self.role = 'user'
-        if image_base_64 is not None or image_path is None:
-            self.content = (text, image_base_64)
-        elif image_path is not None or image_base_64 is None:
-            self.content = (text, self.__image_to_base64(image_path))
+        if image_base_64 is not None:
+            self.content = (text, ImageSource(base64_data=image_base_64))
+        elif image_path is not None:
+            self.content = (text, ImageSource.parse(image_path, downscale=downscale))
         else:
-            raise ValueError("image_path and image_base_64 cannot be both None or both not None")
-
-    def __is_url(self, path: str) -> bool:
-        return bool(re.match(r'^https?://', path))
-
-    def __is_file_path(self, path: str) -> bool:
-        pattern = r'^([./~]|([a-zA-Z]:)|\\|//)?\.?/?[a-zA-Z0-9._-]+(\.[a-zA-Z0-9]+)?$'
-        return bool(re.match(pattern, path))
+            self.content = (text, None)
 
-    def __image_to_base64(self, source: str) -> str:
-        if self.__is_url(source):
-            response = requests.get(source)
-            image_bytes = BytesIO(response.content).read()
-        elif self.__is_file_path(source):
-            with open(source, 'rb') as f:
-                image_bytes = f.read()
-        else:
-            raise ValueError("Invalid image source. Must be a URL or file path.")
-        return base64.b64encode(image_bytes).decode('utf-8')
+    def to_dict(self) -> dict[str, str]:
+        # Identifies the image by content hash instead of inlining its base64
+        text, image = self.content
+        return {
+            'role': self.role,
+            'content': f'{text}' if image is None else f'{text} [image sha256:{image.digest}]'
+        }
 
 
 class ToolMessage(BaseMessage):
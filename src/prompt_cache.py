@@ -0,0 +1,197 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha256
+import threading
+import json
+import time
+
+from src.message import BaseMessage, SystemMessage, HumanMessage, ImageMessage
+from src.tokenizer import count_prompt_tokens
+
+
+@dataclass(frozen=True)
+class Prefix:
+    """The first `length` messages of a request, identified by their content."""
+    length: int
+    digest: str
+
+
+@dataclass
+class CachedPrefix:
+    tokens: int
+    uses: int = 0
+    seen_until: float = 0.0  # uses within this window count towards stability
+    name: str | None = None  # provider handle of an explicit cache
+    expires_at: float = 0.0  # when the provider drops the explicit cache
+    pending: bool = False  # a create or refresh is in flight
+    retry_at: float = 0.0  # after a failed create, no new attempt before this
+
+
+def message_digest(message: BaseMessage) -> bytes:
+    """Content hash of a message, cached on it while its `content` is the same object."""
+    cached = message.__dict__.get("_digest")
+    if cached is not None and cached[0] is message.content:
+        return cached[1]
+    normalized = json.dumps([type(message).__name__, message.to_dict()], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    digest = sha256(normalized.encode("utf-8")).digest()
+    message._digest = (message.content, digest)
+    return digest
+
+
+class PromptCache:
+    """Message prefixes sent to one model, for the provider's automatic prompt cache.
+
+    OpenAI, Groq and Mistral cache a prompt prefix they have seen in the last
+    few minutes and bill it at a discount. `observe` records the prefixes of
+    every request; one of at least `min_tokens` tokens sent within `ttl`
+    seconds is warm, and `warm_tokens` tells the cost model how much of a new
+    prompt should hit.
+
+    Two prefixes are tracked per request: everything before the last user
+    turn, shared by requests with a fixed system prompt and few-shot examples,
+    and the leading system messages, which stay fixed while a conversation grows.
+    """
+    def __init__(self, ttl: float = 300.0, min_tokens: int = 1024, min_uses: int = 1, max_entries: int = 1024):
+        """
+        Args:
+            ttl (float): Seconds the provider keeps an unused prefix.
+            min_tokens (int): Shortest prefix the provider caches.
+            min_uses (int): Sends within `ttl` before a prefix counts as stable.
+            max_entries (int): Prefixes remembered, least recently used dropped first.
+        """
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.min_uses = min_uses
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedPrefix] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prefixes(self, messages: list[BaseMessage]) -> list[Prefix]:
+        """Candidate prefixes of `messages`, longest first."""
+        last_user = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], (HumanMessage, ImageMessage))), 0)
+        system = 0
+        while system < last_user and isinstance(messages[system], SystemMessage):
+            system += 1
+        lengths = {length for length in (last_user, system) if length > 0}
+        prefixes = []
+        running = sha256()
+        for i, message in enumerate(messages[:last_user]):
+            running.update(message_digest(message))
+            if i + 1 in lengths:
+                prefixes.append(Prefix(i + 1, running.copy().hexdigest()))
+        return prefixes[::-1]
+
+    def _record(self, messages: list[BaseMessage], family: str) -> list[tuple[Prefix, CachedPrefix]]:
+        now = time.monotonic()
+        recorded = []
+        for prefix in self.prefixes(messages):
+            with self._lock:
+                entry = self._entries.get(prefix.digest)
+            if entry is None:
+                entry = CachedPrefix(count_prompt_tokens(messages[:prefix.length], family))
+            with self._lock:
+                entry = self._entries.setdefault(prefix.digest, entry)
+                self._entries.move_to_end(prefix.digest)
+                if entry.seen_until <= now:
+                    entry.uses = 0
+                entry.uses += 1
+                entry.seen_until = now + self.ttl
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            recorded.append((prefix, entry))
+        return recorded
+
+    def _stable(self, entry: CachedPrefix) -> bool:
+        return entry.uses >= self.min_uses and entry.tokens >= self.min_tokens
+
+    def observe(self, messages: list[BaseMessage], family: str) -> list[Prefix]:
+        """Record that `messages` are being sent; returns their stable prefixes, longest first."""
+        return [prefix for prefix, entry in self._record(messages, family) if self._stable(entry)]
+
+    def _warm(self, entry: CachedPrefix, now: float) -> bool:
+        return entry.tokens >= self.min_tokens and entry.seen_until > now
+
+    def warm_tokens(self, messages: list[BaseMessage]) -> int:
+        """Prompt tokens of `messages` expected to be served from the provider's cache."""
+        now = time.monotonic()
+        for prefix in self.prefixes(messages):
+            entry = self._entries.get(prefix.digest)
+            if entry is not None and self._warm(entry, now):
+                return entry.tokens
+        return 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ContextCache(PromptCache):
+    """Explicit provider caches (Gemini `cachedContents`) for stable prefixes.
+
+    Creating a cache costs a request and its storage is billed by the hour, so
+    a prefix is only cached once it has been sent `min_uses` times within
+    `ttl`. The cache lives for `ttl` seconds, is extended while requests keep
+    using it and otherwise left to expire; the adapter deletes the live ones
+    on close. `plan` tells the adapter what to do for a request and the
+    adapter reports back with `created`, `refreshed` or `failed`.
+    """
+    def __init__(self, ttl: float = 300.0, min_tokens: int = 4096, min_uses: int = 2, max_entries: int = 64):
+        super().__init__(ttl=ttl, min_tokens=min_tokens, min_uses=min_uses, max_entries=max_entries)
+
+    def _warm(self, entry: CachedPrefix, now: float) -> bool:
+        return entry.name is not None and entry.expires_at > now
+
+    def plan(self, messages: list[BaseMessage], family: str, min_length: int = 0) -> tuple[str, Prefix, str | None] | None:
+        """("use", prefix, name), ("refresh", prefix, name) when the cache expires soon, ("create", prefix, None),
+        or None to send the request uncached. Only prefixes of at least `min_length` messages are considered.
+        """
+        recorded = self._record(messages, family)
+        now = time.monotonic()
+        with self._lock:
+            for prefix, entry in recorded:
+                if prefix.length < min_length:
+                    continue
+                if self._warm(entry, now):
+                    if entry.expires_at - now < self.ttl / 2 and not entry.pending:
+                        entry.pending = True
+                        return "refresh", prefix, entry.name
+                    return "use", prefix, entry.name
+                if self._stable(entry) and not entry.pending and entry.retry_at <= now:
+                    entry.pending = True
+                    return "create", prefix, None
+        return None
+
+    def created(self, prefix: Prefix, name: str):
+        self._update(prefix, name=name, expires_at=time.monotonic() + self.ttl)
+
+    def refreshed(self, prefix: Prefix):
+        self._update(prefix, expires_at=time.monotonic() + self.ttl)
+
+    def failed(self, prefix: Prefix):
+        """A create or refresh failed; the prefix goes uncached for `ttl` seconds."""
+        self._update(prefix, name=None, retry_at=time.monotonic() + self.ttl)
+
+    def forget(self, name: str):
+        """The provider no longer has cache `name`."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.name == name:
+                    entry.name = None
+
+    def _update(self, prefix: Prefix, **changes):
+        with self._lock:
+            entry = self._entries.get(prefix.digest)
+            if entry is None:
+                return
+            entry.pending = False
+            for key, value in changes.items():
+                setattr(entry, key, value)
+
+    def take_names(self) -> list[str]:
+        """Names of the caches still alive, forgetting them; for deleting them on shutdown."""
+        now = time.monotonic()
+        with self._lock:
+            names = [entry.name for entry in self._entries.values() if entry.name is not None and entry.expires_at > now]
+            for entry in self._entries.values():
+                entry.name = None
+        return names
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from typing import Literal
+import threading
+import atexit
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+Window = Literal["daily", "monthly"] | None
+
+
+def window_id(window: Window, now: float | None = None) -> str:
+    """Identifier of the reset window `now` falls in (UTC)."""
+    now = time.time() if now is None else now
+    if window == "daily":
+        return f"d{int(now // 86400)}"
+    if window == "monthly":
+        t = time.gmtime(now)
+        return f"m{t.tm_year}-{t.tm_mon:02d}"
+    return "all"
+
+
+class QuotaLedger:
+    def __init__(self, path: str | None = None, windows: dict[str, Window] | None = None, flush_interval: float = 1.0):
+        """Free-tier token ledger shared by every LLMSwitcher (and process) using the same `path`.
+
+        Consumption is recorded in memory and written behind in batches, so the
+        routing hot path never waits on disk. Each flush also reloads what other
+        processes consumed, so they can overspend each other by at most one
+        flush interval of traffic.
+
+        Args:
+            path (str | None): SQLite file for the shared, persistent ledger. None keeps it in memory.
+            windows (dict[str, Window] | None): Reset window per provider name (e.g. {"gemini": "daily"}).
+                Providers not listed never reset.
+            flush_interval (float): Seconds between background flushes when `path` is set.
+        """
+        self.path = path
+        self.windows = {provider.lower(): window for provider, window in (windows or {}).items()}
+        self.flush_interval = flush_interval
+        self.version = 0
+        self._limits: dict[str, int] = {}
+        self._providers: dict[str, str] = {}
+        self._used: dict[tuple[str, str], int] = {}
+        self._pending: dict[tuple[str, str], int] = defaultdict(int)
+        self._in_flight: dict[tuple[str, str], int] = {}
+        self._day = int(time.time() // 86400)
+        self._lock = threading.Lock()
+        # Serializes use of the connection, which the flusher thread and callers share
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._stop = threading.Event()
+        self._flusher = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota_usage ("
+                "key TEXT NOT NULL, window TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (key, window))"
+            )
+            self._flusher = threading.Thread(target=self._flush_loop, name="quota-ledger-flush", daemon=True)
+            self._flusher.start()
+            # Written-behind usage would otherwise be lost on exit
+            atexit.register(self.close)
+
+    def key(self, provider: str, model: str) -> str:
+        return f"{provider.lower()}:{model}"
+
+    def register(self, key: str, limit: int, provider: str):
+        """Declare a model's free-token limit per window. The first registration of a key wins."""
+        with self._lock:
+            self._limits.setdefault(key, limit)
+            self._providers[key] = provider.lower()
+        if self._conn is not None:
+            with self._db_lock:
+                self._reload()
+
+    def _window(self, key: str) -> str:
+        return window_id(self.windows.get(self._providers.get(key, "")))
+
+    def remaining(self, key: str) -> int:
+        with self._lock:
+            return self._remaining(key)
+
+    def _remaining(self, key: str) -> int:
+        # Called with `_lock` held
+        slot = (key, self._window(key))
+        used = self._used.get(slot, 0) + self._pending.get(slot, 0) + self._in_flight.get(slot, 0)
+        return max(0, self._limits.get(key, 0) - used)
+
+    def consume(self, key: str, tokens: int) -> int:
+        """Record usage and return the remaining free tokens. Never blocks on disk."""
+        slot = (key, self._window(key))
+        with self._lock:
+            if self._conn is None:
+                self._used[slot] = self._used.get(slot, 0) + tokens
+            else:
+                self._pending[slot] += tokens
+            return self._remaining(key)
+
+    def poll(self) -> int:
+        """Cheap per-request check that bumps `version` when a reset window may have rolled over."""
+        day = int(time.time() // 86400)
+        if day != self._day:
+            self._day = day
+            self.version += 1
+        return self.version
+
+    def flush(self):
+        """Write pending usage and pick up consumption from other processes."""
+        with self._db_lock:
+            if self._conn is None:
+                return
+            with self._lock:
+                # Swapped-out usage keeps counting as in flight until the reload sees it on disk
+                pending, self._pending = self._pending, defaultdict(int)
+                self._in_flight = pending
+            if pending:
+                try:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    self._conn.executemany(
+                        "INSERT INTO quota_usage (key, window, used) VALUES (?, ?, ?) "
+                        "ON CONFLICT(key, window) DO UPDATE SET used = used + excluded.used",
+                        [(key, window, tokens) for (key, window), tokens in pending.items() if tokens],
+                    )
+                    self._conn.execute("COMMIT")
+                except sqlite3.Error:
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    with self._lock:
+                        for slot, tokens in pending.items():
+                            self._pending[slot] += tokens
+                        self._in_flight = {}
+                    raise
+            self._reload()
+
+    def _reload(self):
+        # Called with `_db_lock` held
+        with self._lock:
+            slots = [(key, self._window(key)) for key in self._limits]
+        windows = sorted({window for _, window in slots})
+        rows = self._conn.execute(
+            f"SELECT key, window, used FROM quota_usage WHERE window IN ({','.join('?' * len(windows))})", windows
+        ).fetchall() if windows else []
+        stored = {(key, window): used for key, window, used in rows}
+        used = {slot: stored.get(slot, 0) for slot in slots}
+        with self._lock:
+            self._in_flight = {}
+            if used != self._used:
+                self._used = used
+                self.version += 1
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Quota ledger flush failed: %s", e)
+
+    def close(self):
+        """Stop the flusher and write the remaining usage; also runs at interpreter exit."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        atexit.unregister(self.close)
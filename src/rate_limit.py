@@ -0,0 +1,134 @@
+import threading
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding up to `capacity` units, refilled at `per_minute` units a minute."""
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available; 0 if they are now."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # Requests larger than the bucket go through once it is full instead of never
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def block(self, seconds: float, now: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.level = 0.0
+
+
+class RateLimiter:
+    def __init__(self, provider_limits: dict[str, dict[str, float]] | None = None):
+        """Client-side requests-per-minute and tokens-per-minute limits.
+
+        Per-model limits come from the `rpm`/`tpm` fields of each `llms` entry
+        (see models.json). Provider-wide limits shared by all of a provider's
+        models can be given here, e.g. {"groq": {"rpm": 30, "tpm": 6000}}.
+        """
+        self.provider_limits = {provider.lower(): limits for provider, limits in (provider_limits or {}).items()}
+        self._buckets: dict[str, list[tuple[TokenBucket, str]]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, entry: dict) -> str:
+        return f"{entry['llm'].name.lower()}:{entry['llm'].model}"
+
+    def _limits_for(self, entry: dict) -> list[tuple[TokenBucket, str]]:
+        key = self._key(entry)
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = []
+            if entry.get("rpm"):
+                buckets.append((TokenBucket(entry["rpm"]), "requests"))
+            if entry.get("tpm"):
+                buckets.append((TokenBucket(entry["tpm"]), "tokens"))
+            provider = entry["llm"].name.lower()
+            limits = self.provider_limits.get(provider)
+            if limits:
+                shared = self._buckets.setdefault(f"{provider}:*", [])
+                if not shared:
+                    if limits.get("rpm"):
+                        shared.append((TokenBucket(limits["rpm"]), "requests"))
+                    if limits.get("tpm"):
+                        shared.append((TokenBucket(limits["tpm"]), "tokens"))
+                buckets += shared
+            self._buckets[key] = buckets
+        return buckets
+
+    def _wait_time(self, buckets: list[tuple[TokenBucket, str]], tokens: int, now: float) -> float:
+        return max((bucket.wait_time(1 if unit == "requests" else tokens, now) for bucket, unit in buckets), default=0.0)
+
+    def _take(self, buckets: list[tuple[TokenBucket, str]], tokens: int):
+        for bucket, unit in buckets:
+            bucket.take(1 if unit == "requests" else tokens)
+
+    def wait_time(self, entry: dict, tokens: int) -> float:
+        with self._lock:
+            return self._wait_time(self._limits_for(entry), tokens, time.monotonic())
+
+    def try_acquire(self, entry: dict, tokens: int) -> bool:
+        """Take one request and `tokens` tokens from the model's buckets if all of them have room."""
+        with self._lock:
+            buckets = self._limits_for(entry)
+            if self._wait_time(buckets, tokens, time.monotonic()) > 0:
+                return False
+            self._take(buckets, tokens)
+            return True
+
+    def acquire(self, entry: dict, tokens: int, timeout: float | None = None) -> bool:
+        """Block until the buckets have room, or return False if that takes longer than `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                buckets = self._limits_for(entry)
+                now = time.monotonic()
+                wait = self._wait_time(buckets, tokens, now)
+                if wait == 0:
+                    self._take(buckets, tokens)
+                    return True
+                if deadline is not None and now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+    async def aacquire(self, entry: dict, tokens: int, timeout: float | None = None) -> bool:
+        """Async counterpart of `acquire`; waits without blocking the event loop."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                buckets = self._limits_for(entry)
+                now = time.monotonic()
+                wait = self._wait_time(buckets, tokens, now)
+                if wait == 0:
+                    self._take(buckets, tokens)
+                    return True
+                if deadline is not None and now + wait > deadline:
+                    return False
+            await asyncio.sleep(wait)
+
+    def penalize(self, entry: dict, seconds: float):
+        """Empty the model's buckets for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._limits_for(entry)
+            if not buckets:
+                bucket = TokenBucket(60)
+                buckets.append((bucket, "requests"))
+            for bucket, _ in buckets:
+                bucket.block(seconds, now)
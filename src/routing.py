@@ -0,0 +1,256 @@
+from bisect import insort
+from heapq import merge
+from typing import Callable, Iterator
+import threading
+
+from src.tokenizer import family_of
+from src.inference.batch_api import BatchAPI
+
+EPSILON = 1e-6  # prevent divide by zero
+BATCH_DISCOUNT = 0.5  # batch endpoints bill about half the synchronous price
+
+
+class RankedLLM:
+    """Ranking result for one model: a view over its `llms` entry plus the per-request numbers.
+
+    Supports the same `selected["..."]` access the ranked dicts used to, without
+    copying the entry. Writes go through to the entry.
+    """
+    __slots__ = ("entry", "rank_score", "estimated_cost", "token_estimate", "completion_tokens")
+    _fields = frozenset(__slots__)
+
+    def __init__(self, entry: dict, rank_score: float, estimated_cost: float, token_estimate: int,
+                 completion_tokens: int | None = None):
+        self.entry = entry
+        self.rank_score = rank_score
+        self.estimated_cost = estimated_cost
+        self.token_estimate = token_estimate
+        # The answer length `token_estimate` reserves, when the ranking checked it against a context window
+        self.completion_tokens = completion_tokens
+
+    def __getitem__(self, key: str):
+        if key in self._fields:
+            return getattr(self, key)
+        return self.entry[key]
+
+    def __setitem__(self, key: str, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            self.entry[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields or key in self.entry
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+    def __repr__(self):
+        return f"RankedLLM(model={self.entry['llm'].model}, rank_score={self.rank_score:.4g}, estimated_cost={self.estimated_cost:.4f})"
+
+
+def score_entry(entry: dict, token_estimate: int, cached_tokens: int = 0) -> tuple[float, float]:
+    """(rank_score, estimated_cost) of a model for a request of `token_estimate` tokens.
+
+    `cached_tokens` of them are expected to hit the provider's prompt cache
+    and are billed at `cached_price`; free quota covers the first tokens.
+    """
+    if token_estimate <= entry["free_limit_tokens"]:
+        cost = 0.0
+    else:
+        billable = token_estimate - entry["free_limit_tokens"]
+        cost = (billable / 1000) * entry["price_per_1k_tokens"]
+        if cached_tokens:
+            cost -= (min(cached_tokens, billable) / 1000) * (entry["price_per_1k_tokens"] - cached_price(entry))
+    return entry["benchmark_score"] / (cost + EPSILON), cost
+
+
+def cached_price(entry: dict) -> float:
+    """Price per 1k prompt tokens served from the provider's prompt cache; no discount unless the entry sets one."""
+    return entry.get("cached_price_per_1k_tokens", entry["price_per_1k_tokens"])
+
+
+def batch_price(entry: dict) -> float:
+    """Price per 1k tokens through the provider's batch endpoint."""
+    return entry.get("batch_price_per_1k_tokens", entry["price_per_1k_tokens"] * BATCH_DISCOUNT)
+
+
+class RankedCandidates:
+    """Lazily materialized rank order.
+
+    Views are produced as they are consumed, so a request that succeeds on the
+    first model never scores the rest. Iterating again replays the views
+    already produced.
+    """
+    def __init__(self, source: Iterator[RankedLLM]):
+        self._source = source
+        self._views: list[RankedLLM] = []
+
+    def _fill(self, count: int | None = None):
+        while self._source is not None and (count is None or len(self._views) < count):
+            view = next(self._source, None)
+            if view is None:
+                self._source = None
+            else:
+                self._views.append(view)
+
+    def __iter__(self) -> Iterator[RankedLLM]:
+        i = 0
+        while True:
+            if i == len(self._views):
+                self._fill(i + 1)
+                if i == len(self._views):
+                    return
+            yield self._views[i]
+            i += 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) or index < 0:
+            self._fill()
+        else:
+            self._fill(index + 1)
+        return self._views[index]
+
+    def __len__(self) -> int:
+        self._fill()
+        return len(self._views)
+
+    def __bool__(self) -> bool:
+        self._fill(1)
+        return bool(self._views)
+
+
+class RoutingIndex:
+    """task_type -> candidates, kept in rank order between requests.
+
+    Paid models without free quota rank by benchmark / price regardless of the
+    request size, so they are stored pre-sorted per tokenizer family (the token
+    estimate is shared within a family). Models with free quota, or free
+    pricing, depend on the request size and are scored per request; there are
+    only a handful of them. A request lazily merges these already-sorted runs
+    instead of scoring and sorting every model. Quota and price changes move a
+    single entry between runs.
+
+    Runs are replaced rather than mutated on update, so ranking reads them
+    without taking the lock.
+    """
+    def __init__(self, llms: list[dict]):
+        self._lock = threading.Lock()
+        self.rebuild(llms)
+
+    def rebuild(self, llms: list[dict]):
+        with self._lock:
+            self._free: dict[str, tuple[dict, ...]] = {}
+            self._paid: dict[str, tuple[tuple[dict, ...], ...]] = {}
+            for entry in llms:
+                self._add(entry)
+
+    def task_types(self) -> set[str]:
+        """Task types at least one model serves."""
+        return {task_type for task_type, entries in self._free.items() if entries} | {task_type for task_type, runs in self._paid.items() if runs}
+
+    def _is_paid(self, entry: dict) -> bool:
+        return entry["free_limit_tokens"] <= 0 and entry["price_per_1k_tokens"] > 0
+
+    def _paid_key(self, entry: dict) -> float:
+        return -entry["benchmark_score"] / entry["price_per_1k_tokens"]
+
+    def _add(self, entry: dict):
+        for task_type in entry["tasks"]:
+            if self._is_paid(entry):
+                runs = {family_of(run[0]["llm"]): list(run) for run in self._paid.get(task_type, ())}
+                insort(runs.setdefault(family_of(entry["llm"]), []), entry, key=self._paid_key)
+                self._paid[task_type] = tuple(tuple(run) for run in runs.values())
+            else:
+                self._free[task_type] = self._free.get(task_type, ()) + (entry,)
+
+    def _remove(self, entry: dict):
+        for task_type in entry["tasks"]:
+            self._free[task_type] = tuple(e for e in self._free.get(task_type, ()) if e is not entry)
+            runs = (tuple(e for e in run if e is not entry) for run in self._paid.get(task_type, ()))
+            self._paid[task_type] = tuple(run for run in runs if run)
+
+    def update(self, entry: dict, **changes):
+        """Apply changes such as price_per_1k_tokens or free_limit_tokens and re-slot the entry."""
+        with self._lock:
+            self._remove(entry)
+            entry.update(changes)
+            self._add(entry)
+
+    def consume(self, entry: dict, tokens_used: int):
+        """Reduce an entry's free quota."""
+        self.set_quota(entry, max(0, entry["free_limit_tokens"] - tokens_used))
+
+    def set_quota(self, entry: dict, remaining: int):
+        """Set an entry's remaining free quota; it only moves when it runs out or is refilled."""
+        with self._lock:
+            if (remaining > 0) == (entry["free_limit_tokens"] > 0):
+                entry["free_limit_tokens"] = remaining
+                return
+            self._remove(entry)
+            entry["free_limit_tokens"] = remaining
+            self._add(entry)
+
+    def _paid_run(self, entries: tuple[dict, ...], token_estimate: int, scored: set[int]) -> Iterator[RankedLLM]:
+        for entry in entries:
+            if id(entry) in scored:
+                continue
+            cost = (token_estimate / 1000) * entry["price_per_1k_tokens"]
+            yield RankedLLM(entry, entry["benchmark_score"] / (cost + EPSILON), cost, token_estimate)
+
+    def rank(self, task_type: str, tokens_for: Callable[[dict], int], penalties: dict[int, float] | None = None,
+             cached: dict[int, int] | None = None) -> RankedCandidates:
+        """Candidates for `task_type` in rank order. `tokens_for(entry)` gives the request's token estimate.
+
+        `penalties` maps id(entry) to a rank-score multiplier for the few models
+        that are not fully healthy, and `cached` maps id(entry) to the prompt
+        tokens expected to hit that model's prompt cache. Those models leave
+        their pre-sorted run and are scored per request like the free ones.
+        """
+        free = self._free.get(task_type, ())
+        paid = self._paid.get(task_type, ())
+        if not free and not paid:
+            raise RuntimeError(f"No LLM available for task type '{task_type}'")
+        penalties = penalties or {}
+        cached = cached or {}
+
+        free_views = []
+        for entry in free:
+            token_estimate = tokens_for(entry)
+            score, cost = score_entry(entry, token_estimate, cached.get(id(entry), 0))
+            free_views.append(RankedLLM(entry, score * penalties.get(id(entry), 1.0), cost, token_estimate))
+        scored = penalties.keys() | cached.keys()
+        if scored:
+            for run in paid:
+                for entry in run:
+                    if id(entry) in scored:
+                        token_estimate = tokens_for(entry)
+                        score, cost = score_entry(entry, token_estimate, cached.get(id(entry), 0))
+                        free_views.append(RankedLLM(entry, score * penalties.get(id(entry), 1.0), cost, token_estimate))
+        free_views.sort(key=lambda view: view.rank_score, reverse=True)
+
+        runs = [self._paid_run(run, tokens_for(run[0]), scored) for run in paid]
+        if not runs:
+            return RankedCandidates(iter(free_views))
+        return RankedCandidates(merge(free_views, *runs, key=lambda view: -view.rank_score))
+
+    def rank_deferred(self, task_type: str, tokens_for: Callable[[dict], int], penalties: dict[int, float] | None = None) -> RankedCandidates:
+        """Batch-capable candidates for `task_type`, ranked by benchmark score per batch dollar.
+
+        Batch endpoints bill every token at the batch price, so free quota does
+        not apply. There are few such models and they are scored per request.
+        """
+        entries = self._free.get(task_type, ()) + tuple(entry for run in self._paid.get(task_type, ()) for entry in run)
+        penalties = penalties or {}
+        views = []
+        for entry in entries:
+            if not isinstance(entry["llm"], BatchAPI):
+                continue
+            token_estimate = tokens_for(entry)
+            cost = (token_estimate / 1000) * batch_price(entry)
+            score = entry["benchmark_score"] / (cost + EPSILON) * penalties.get(id(entry), 1.0)
+            views.append(RankedLLM(entry, score, cost, token_estimate))
+        if not views:
+            raise RuntimeError(f"No batch-capable LLM available for task type '{task_type}'")
+        views.sort(key=lambda view: view.rank_score, reverse=True)
+        return RankedCandidates(iter(views))
@@ -0,0 +1,278 @@
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, Sequence
+import threading
+import asyncio
+import heapq
+import math
+import time
+
+from src.latency import QuantileSketch
+
+
+class AdmissionRejected(RuntimeError):
+    """A request was turned away: the queue is full, or it would not be answered before its deadline."""
+
+
+class DeadlineExceeded(AdmissionRejected):
+    """A request was still queued at its deadline."""
+
+
+@dataclass(frozen=True)
+class Admission:
+    """Who a request is for and how urgent it is.
+
+    `deadline` is the `time.monotonic()` by which the answer is wanted; build
+    one from a timeout with `Admission.within`.
+    """
+    priority: str = "default"
+    tenant: str = "default"
+    deadline: float | None = None
+    cost: float = 1.0  # share of the tenant's fair share one request uses
+
+    @classmethod
+    def within(cls, timeout: float | None, priority: str = "default", tenant: str = "default") -> "Admission":
+        return cls(priority, tenant, None if timeout is None else time.monotonic() + timeout)
+
+
+@dataclass(eq=False)
+class Ticket:
+    """A queued or admitted request; `Scheduler.release` takes it back."""
+    admission: Admission
+    finish: float
+    enqueued: float
+    state: str = "queued"  # "queued", "granted", "released" or "abandoned"
+    admitted: float | None = None
+    event: threading.Event | None = None
+    future: asyncio.Future | None = None
+    loop: asyncio.AbstractEventLoop | None = field(default=None, repr=False)
+
+    @property
+    def waited(self) -> float:
+        return (self.admitted or time.monotonic()) - self.enqueued
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    """Admits requests to `max_concurrency` upstream slots by priority, then by fair share.
+
+    Priority classes are served strictly in order: a queued "interactive"
+    request always goes before "default" and "batch" ones. Within a class,
+    tenants (e.g. API keys) share the slots by weighted fair queuing: each
+    request gets a virtual finish time of its tenant's previous one plus
+    `cost / weight`, and the earliest goes first, so a tenant with weight 2
+    is admitted twice as often as one with weight 1 while both have work
+    queued, and a tenant submitting a burst cannot starve the others.
+
+    A request with a deadline is rejected on arrival when the queue ahead of
+    it, at the measured time a slot is held, means it would not be answered
+    in time, and dropped if it is still queued at its deadline. Both raise
+    `AdmissionRejected`, so callers can shed load or retry elsewhere at once
+    instead of timing out later. Sync callers block in `acquire`, async ones
+    await `aacquire`; both share the same slots.
+    """
+    def __init__(self, max_concurrency: int = 16, priorities: Sequence[str] = ("interactive", "default", "batch"),
+                 weights: dict[str, float] | None = None, max_queue: int = 10000, accuracy: float = 0.02, window: int = 512):
+        """
+        Args:
+            max_concurrency (int): Requests running upstream at once.
+            priorities (Sequence[str]): Priority classes, most urgent first.
+            weights (dict[str, float] | None): Fair-share weight per tenant; others get 1.
+            max_queue (int): Queued requests beyond which new ones are rejected.
+            accuracy (float): Relative error of the reported wait-time percentiles.
+            window (int): Recent samples the percentiles cover.
+        """
+        self.max_concurrency = max_concurrency
+        self.priorities = tuple(priorities)
+        self.weights = dict(weights or {})
+        self.max_queue = max_queue
+        self._rank = {priority: rank for rank, priority in enumerate(self.priorities)}
+        self._lock = threading.Lock()
+        self._queues: list[list[tuple[float, int, Ticket]]] = [[] for _ in self.priorities]
+        self._depth = [0] * len(self.priorities)
+        self._tenant_depth: dict[str, int] = {}
+        self._virtual = [0.0] * len(self.priorities)
+        self._last_finish: dict[tuple[int, str], float] = {}
+        self._sequence = 0
+        self.in_flight = 0
+        self.counts = {"admitted": 0, "rejected": 0, "expired": 0}
+        self._waits = {priority: QuantileSketch(accuracy, window) for priority in self.priorities}
+        self._service = QuantileSketch(accuracy, window)
+
+    # -----------------------
+    # Queue
+    # -----------------------
+
+    def _expected_finish(self, rank: int) -> float | None:
+        """Seconds until a request of class `rank` arriving now is likely answered; None before enough samples."""
+        if len(self._service) < 8:
+            return None
+        service = self._service.quantile(50)
+        ahead = sum(self._depth[:rank + 1])
+        free = self.max_concurrency - self.in_flight
+        # Slots free up in waves of `max_concurrency`, each taking about one service time
+        waves = max(0, math.ceil((ahead + 1 - free) / self.max_concurrency))
+        return (waves + 1) * service
+
+    def _enqueue(self, admission: Admission, event: threading.Event | None = None, future: asyncio.Future | None = None) -> Ticket:
+        if admission.priority not in self._rank:
+            raise ValueError(f"Unknown priority {admission.priority!r}; expected one of {self.priorities}")
+        rank = self._rank[admission.priority]
+        now = time.monotonic()
+        with self._lock:
+            if sum(self._depth) >= self.max_queue:
+                self.counts["rejected"] += 1
+                raise AdmissionRejected(f"Request queue is full ({self.max_queue} waiting)")
+            if admission.deadline is not None:
+                expected = self._expected_finish(rank)
+                if admission.deadline <= now or (expected is not None and now + expected > admission.deadline):
+                    self.counts["rejected"] += 1
+                    raise AdmissionRejected(f"A {admission.priority} request would likely be answered in {expected or 0:.2f}s, "
+                                            f"after its deadline in {admission.deadline - now:.2f}s")
+            key = (rank, admission.tenant)
+            start = max(self._virtual[rank], self._last_finish.get(key, 0.0))
+            finish = start + admission.cost / self.weights.get(admission.tenant, 1.0)
+            self._last_finish[key] = finish
+            ticket = Ticket(admission, finish, now, event=event, future=future, loop=future and future.get_loop())
+            if self.in_flight < self.max_concurrency and not any(self._depth):
+                self._virtual[rank] = finish
+                self._grant(ticket, now)
+                return ticket
+            self._sequence += 1
+            heapq.heappush(self._queues[rank], (finish, self._sequence, ticket))
+            self._depth[rank] += 1
+            self._tenant_depth[admission.tenant] = self._tenant_depth.get(admission.tenant, 0) + 1
+        return ticket
+
+    def _grant(self, ticket: Ticket, now: float):
+        ticket.state = "granted"
+        ticket.admitted = now
+        self.in_flight += 1
+        self.counts["admitted"] += 1
+        self._waits[ticket.admission.priority].add(now - ticket.enqueued)
+
+    def _dequeued(self, rank: int, ticket: Ticket):
+        self._depth[rank] -= 1
+        tenant = ticket.admission.tenant
+        self._tenant_depth[tenant] -= 1
+        if not self._tenant_depth[tenant]:
+            del self._tenant_depth[tenant]
+
+    def _dispatch(self):
+        """Grant free slots to the best queued requests; called with the lock held."""
+        now = time.monotonic()
+        for rank, queue in enumerate(self._queues):
+            while queue and self.in_flight < self.max_concurrency:
+                finish, _, ticket = heapq.heappop(queue)
+                if ticket.state != "queued":
+                    continue
+                self._dequeued(rank, ticket)
+                self._virtual[rank] = finish
+                self._grant(ticket, now)
+                if ticket.event is not None:
+                    ticket.event.set()
+                else:
+                    ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+            if self.in_flight >= self.max_concurrency:
+                break
+        if len(self._last_finish) > 4 * len(self._tenant_depth) + 1024:
+            # A tenant whose last finish time has passed is treated the same as a new one
+            self._last_finish = {key: finish for key, finish in self._last_finish.items() if finish > self._virtual[key[0]]}
+
+    def _abandon(self, ticket: Ticket) -> bool:
+        """Take a queued ticket out of the queue; False if it was admitted meanwhile."""
+        with self._lock:
+            if ticket.state != "queued":
+                return False
+            ticket.state = "abandoned"
+            self._dequeued(self._rank[ticket.admission.priority], ticket)
+            return True
+
+    def _expired(self, ticket: Ticket) -> DeadlineExceeded:
+        with self._lock:
+            self.counts["expired"] += 1
+        return DeadlineExceeded(f"A {ticket.admission.priority} request waited {ticket.waited:.2f}s and missed its deadline")
+
+    # -----------------------
+    # Slots
+    # -----------------------
+
+    def acquire(self, admission: Admission = Admission()) -> Ticket:
+        """Block until a slot is free for `admission`; raises `AdmissionRejected` instead of missing its deadline."""
+        ticket = self._enqueue(admission, event=threading.Event())
+        if ticket.state == "granted":
+            return ticket
+        timeout = None if admission.deadline is None else max(0.0, admission.deadline - time.monotonic())
+        try:
+            ticket.event.wait(timeout)
+        except BaseException:
+            if not self._abandon(ticket):
+                self.release(ticket)
+            raise
+        if not self._abandon(ticket):
+            return ticket
+        raise self._expired(ticket)
+
+    async def aacquire(self, admission: Admission = Admission()) -> Ticket:
+        """Async counterpart of `acquire`."""
+        future = asyncio.get_running_loop().create_future()
+        ticket = self._enqueue(admission, future=future)
+        if ticket.state == "granted":
+            return ticket
+        timeout = None if admission.deadline is None else max(0.0, admission.deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(ticket):
+                raise self._expired(ticket) from None
+        except BaseException:
+            if not self._abandon(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Free an admitted ticket's slot for the next queued request."""
+        with self._lock:
+            if ticket.state != "granted":
+                return
+            ticket.state = "released"
+            self.in_flight -= 1
+            self._service.add(time.monotonic() - ticket.admitted)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, admission: Admission = Admission()) -> Iterator[Ticket]:
+        ticket = self.acquire(admission)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, admission: Admission = Admission()) -> AsyncIterator[Ticket]:
+        ticket = await self.aacquire(admission)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def snapshot(self) -> dict:
+        """Slots in use, queue depth per priority and tenant, outcome counts and wait-time percentiles (seconds)."""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queued": dict(zip(self.priorities, self._depth)),
+                "queued_by_tenant": dict(self._tenant_depth),
+                **self.counts,
+                "wait_s": {
+                    priority: {f"p{q}": sketch.quantile(q) for q in (50, 90, 99)}
+                    for priority, sketch in self._waits.items()
+                },
+                "service_s": {f"p{q}": self._service.quantile(q) for q in (50, 90, 99)},
+            }
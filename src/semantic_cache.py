@@ -0,0 +1,186 @@
+from hashlib import blake2b, sha256
+from typing import Any
+import numpy as np
+import threading
+import json
+import time
+import os
+import re
+
+from src.message import BaseMessage, ImageMessage
+from src.prompt_cache import message_digest
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class HashingEmbedder:
+    """CPU-only text embedder: hashed word and character n-gram features, L2-normalized.
+
+    It needs no model download and is deterministic across processes, so
+    snapshots written by one worker can be read by another.
+    """
+    def __init__(self, dim: int = 512, char_ngram: int = 3):
+        self.dim = dim
+        self.char_ngram = char_ngram
+
+    def normalize(self, text: str) -> str:
+        text = _PUNCTUATION.sub(" ", text.lower())
+        return _WHITESPACE.sub(" ", text).strip()
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        digest = int.from_bytes(blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        return digest % self.dim, 1.0 if digest >> 63 else -1.0
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = self.normalize(text)
+        features = text.split()
+        padded = f" {text} "
+        features += [padded[i:i + self.char_ngram] for i in range(len(padded) - self.char_ngram + 1)]
+        for feature in features:
+            index, sign = self._bucket(feature)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    def __init__(self, embedder: HashingEmbedder | None = None, threshold: float = 0.92, thresholds: dict[str, float] | None = None,
+                 max_entries: int = 10_000, ttl: float | None = 3600.0, snapshot_path: str | None = None, allow_nondeterministic: bool = False):
+        """
+        Args:
+            embedder (HashingEmbedder | None): Prompt embedder. Defaults to a 512-dim hashing embedder.
+            threshold (float): Minimum cosine similarity for a hit.
+            thresholds (dict[str, float] | None): Per task_type overrides of `threshold`.
+            max_entries (int): Capacity of the embedding matrix; least recently used entries are evicted.
+            ttl (float | None): Seconds an entry stays valid. None keeps entries until evicted.
+            snapshot_path (str | None): `.npz` file loaded on start and written by `save()`.
+            allow_nondeterministic (bool): Also cache responses generated with temperature > 0.
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.thresholds = thresholds or {}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.allow_nondeterministic = allow_nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((max_entries, self.embedder.dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._entries: list[dict | None] = [None] * max_entries
+        self._size = 0
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.allow_nondeterministic or temperature == 0
+
+    def _split(self, messages: list[BaseMessage]) -> tuple[str, str]:
+        """The last user turn, which is embedded, and a digest of everything around it.
+
+        Only the question is compared by similarity; the system prompt and
+        earlier turns must match exactly. Otherwise a long shared system
+        prompt would make unrelated questions look alike.
+        """
+        last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].role == "user"), None)
+        context = sha256()
+        for i, message in enumerate(messages):
+            if i != last:
+                context.update(message_digest(message))
+        return ("" if last is None else messages[last].content or ""), context.hexdigest()
+
+    def _scope(self, task_type: str, json_output: bool, context: str) -> str:
+        return f"{task_type}:{int(json_output)}:{context}"
+
+    def lookup(self, messages: list[BaseMessage], task_type: str, json_output: bool = False) -> tuple[Any, str] | None:
+        """Return (content, model) of the most similar cached prompt above the task's threshold."""
+        if any(isinstance(message, ImageMessage) for message in messages):
+            return None
+        text, context = self._split(messages)
+        query = self.embedder.embed(text)
+        scope = self._scope(task_type, json_output, context)
+        threshold = self.thresholds.get(task_type, self.threshold)
+        now = time.time()
+        with self._lock:
+            if self._size:
+                scores = self._matrix[:self._size] @ query
+                candidates = np.flatnonzero(scores >= threshold)
+                for index in candidates[np.argsort(scores[candidates])[::-1]]:
+                    entry = self._entries[index]
+                    if entry is None or entry["scope"] != scope:
+                        continue
+                    if entry["expires_at"] is not None and entry["expires_at"] < now:
+                        self._evict(index)
+                        continue
+                    self._last_used[index] = now
+                    self.hits += 1
+                    return entry["content"], entry["model"]
+            self.misses += 1
+        return None
+
+    def store(self, messages: list[BaseMessage], task_type: str, model: str, content: Any, json_output: bool = False):
+        if any(isinstance(message, ImageMessage) for message in messages):
+            return
+        text, context = self._split(messages)
+        vector = self.embedder.embed(text)
+        now = time.time()
+        with self._lock:
+            if self._size < self.max_entries:
+                index = self._size
+                self._size += 1
+            else:
+                index = int(np.argmin(self._last_used[:self._size]))
+            self._matrix[index] = vector
+            self._last_used[index] = now
+            self._entries[index] = {
+                "scope": self._scope(task_type, json_output, context),
+                "model": model,
+                "content": content,
+                "expires_at": now + self.ttl if self.ttl is not None else None,
+            }
+
+    def _evict(self, index: int):
+        self._entries[index] = None
+        self._matrix[index] = 0.0
+        self._last_used[index] = 0.0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": sum(entry is not None for entry in self._entries[:self._size]),
+        }
+
+    def save(self, path: str | None = None):
+        """Write the index to an `.npz` snapshot so it survives restarts."""
+        path = path or self.snapshot_path
+        if path is None:
+            raise ValueError("No snapshot path configured")
+        with self._lock:
+            matrix = self._matrix[:self._size].copy()
+            last_used = self._last_used[:self._size].copy()
+            entries = json.dumps(self._entries[:self._size])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, matrix=matrix, last_used=last_used, entries=np.array(entries))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        with np.load(path) as snapshot:
+            matrix = snapshot["matrix"]
+            last_used = snapshot["last_used"]
+            entries = json.loads(str(snapshot["entries"]))
+        if matrix.shape[1] != self.embedder.dim:
+            raise ValueError(f"Snapshot dimension {matrix.shape[1]} does not match embedder dimension {self.embedder.dim}")
+        # Keep the most recently used entries if the snapshot is larger than this cache
+        keep = np.argsort(last_used)[::-1][:self.max_entries]
+        with self._lock:
+            self._size = len(keep)
+            self._matrix[:self._size] = matrix[keep]
+            self._last_used[:self._size] = last_used[keep]
+            self._entries[:self._size] = [entries[i] for i in keep]
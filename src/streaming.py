@@ -0,0 +1,298 @@
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterator
+import threading
+import logging
+import asyncio
+import queue
+import time
+
+from src.message import BaseMessage, AIMessage, HumanMessage
+from src.routing import RankedLLM
+from src.telemetry import NULL_SPAN, activate, deactivate
+from src.tokenizer import count_prompt_tokens, count_text_tokens, family_of
+
+logger = logging.getLogger(__name__)
+
+CONTINUE_PROMPT = "Continue your previous answer exactly where it stopped. Do not repeat any of it or add a preamble."
+
+_DONE = object()
+
+
+class StreamTimeout(TimeoutError):
+    """A stream produced no first token, or stalled between chunks, within its timeout."""
+
+
+class _Pump:
+    """Runs a blocking stream on a daemon thread so that waiting for a chunk can time out.
+
+    A timed-out stream cannot be interrupted in the middle of a socket read; it is
+    abandoned instead, and its thread closes the stream at the next chunk, or when
+    the pool's read timeout ends the read. The queue is bounded, so an abandoned
+    stream stops being read once it is full.
+    """
+    def __init__(self, open_stream: Callable[[], Iterator[str]], span=NULL_SPAN, max_chunks: int = 256):
+        self.queue = queue.Queue(max_chunks)
+        self.cancelled = threading.Event()
+        threading.Thread(target=self._run, args=(open_stream, span), name="stream-pump", daemon=True).start()
+
+    def _put(self, item: tuple) -> bool:
+        """Hand an item to the reader; False once the stream has been abandoned."""
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, open_stream: Callable[[], Iterator[str]], span):
+        # The request is sent from this thread, so connection setup is timed into the stream's span here
+        activate(span)
+        stream = None
+        try:
+            stream = open_stream()
+            for chunk in stream:
+                if not self._put((chunk, None)):
+                    return
+            self._put((_DONE, None))
+        except Exception as e:
+            self._put((None, e))
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+    def chunks(self, first_token_timeout: float | None, stall_timeout: float | None) -> Iterator[str]:
+        first = True
+        while True:
+            timeout = first_token_timeout if first else stall_timeout
+            try:
+                chunk, error = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                raise StreamTimeout(f"Stream {'sent no first token' if first else 'stalled'} within {timeout}s") from None
+            if error is not None:
+                raise error
+            if chunk is _DONE:
+                return
+            first = first and not chunk
+            yield chunk
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class _FailoverBase:
+    def __init__(self, switcher, candidates, messages: list[BaseMessage], first_token_timeout: float | None = None,
+                 stall_timeout: float | None = None, resume: bool = True, span=NULL_SPAN, task_type: str | None = None,
+                 on_close: Callable[[], None] | None = None):
+        self.switcher = switcher
+        self.span = span
+        self.messages = messages
+        # With a task type, the switcher compacts the history for each model it tries
+        self.task_type = task_type
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.resume = resume
+        self.model: str | None = None
+        self.models: list[str] = []
+        self._candidates = candidates
+        self._parts: list[str] = []
+        # Called once the stream ends, fails or is closed, e.g. to free a scheduler slot
+        self.on_close = on_close
+        self._chunks = self._traced() if span or on_close else self._run()
+        self._primed: list[str] = []
+
+    @property
+    def text(self) -> str:
+        """Everything streamed so far."""
+        return "".join(self._parts)
+
+    def _continued(self) -> list[BaseMessage]:
+        if not self._parts:
+            return self.messages
+        return [*self.messages, AIMessage(self.text), HumanMessage(CONTINUE_PROMPT)]
+
+    def _prompt(self, selected: RankedLLM) -> list[BaseMessage]:
+        if self.task_type is None:
+            return self._continued()
+        return self.switcher._fit(selected, self._continued(), self.task_type)
+
+    async def _aprompt(self, selected: RankedLLM) -> list[BaseMessage]:
+        if self.task_type is None:
+            return self._continued()
+        return await self.switcher._afit(selected, self._continued(), self.task_type)
+
+    def _started(self, selected: RankedLLM):
+        self.span.first_token()
+        self.model = selected["llm"].model
+        self.models.append(self.model)
+        self.switcher._consume_quota(selected, selected["token_estimate"])
+
+    def _failed(self, selected: RankedLLM, started: float, error: Exception, produced: bool, retries: int) -> bool:
+        """Record a failed attempt and say whether to retry the same model; raises if resuming is off."""
+        logger.warning("Streaming error with %s: %s", selected["llm"].model, error)
+        self.span.failed(selected, error)
+        self.switcher._record(selected, started, error)
+        if produced:
+            if not self.resume:
+                raise error
+            return False
+        # A silent model is not worth another full first-token timeout
+        return not isinstance(error, StreamTimeout) and self.switcher._should_retry(selected, error, retries)
+
+    def _finished(self, selected: RankedLLM, started: float, ttft: float | None, output_tokens: int):
+        if ttft is None:
+            # An empty answer still counts as this model's answer
+            self._started(selected)
+        self.switcher._record(selected, started, ttft=ttft, output_tokens=output_tokens)
+        if self.span:
+            family = family_of(selected["llm"])
+            self.span.succeeded(selected, count_prompt_tokens(self.messages, family), count_text_tokens(self.text, family))
+        self.span.end()
+
+
+class FailoverStream(_FailoverBase):
+    """Text stream that fails over between ranked models.
+
+    Until the first token arrives, a failing, erroring or silent model is
+    replaced by the next candidate without the caller noticing. After that, a
+    failure or stall resumes on the next candidate with the partial answer as
+    context (unless `resume` is False, in which case the error is raised).
+    `model` is the model currently streaming and `models` every model that
+    contributed to the answer.
+    """
+    def _run(self) -> Iterator[str]:
+        for selected in self._candidates:
+            retries = 0
+            while True:
+                self.span.attempt(selected)
+                started = time.perf_counter()
+                ttft = None
+                output_tokens = 0
+                pump = _Pump(partial(selected["llm"].stream, self._prompt(selected)), self.span)
+                try:
+                    for chunk in pump.chunks(self.first_token_timeout, self.stall_timeout):
+                        if not chunk:
+                            continue
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                            self._started(selected)
+                        output_tokens += self.switcher._output_tokens(selected, chunk)
+                        self._parts.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    retries += 1
+                    if self._failed(selected, started, e, ttft is not None, retries):
+                        continue
+                    break
+                finally:
+                    pump.cancel()
+                self._finished(selected, started, ttft, output_tokens)
+                return
+        raise RuntimeError("All suitable LLMs failed for streaming task")
+
+    def _traced(self) -> Iterator[str]:
+        try:
+            yield from self._run()
+        except BaseException as e:
+            self.span.end(e)
+            raise
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+    def start(self) -> "FailoverStream":
+        """Wait for the first token so `model` is known; raises if every model fails."""
+        if not self._primed and self.model is None:
+            self._primed.extend(islice(self._chunks, 1))
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if self._primed:
+            return self._primed.pop()
+        return next(self._chunks)
+
+    def close(self):
+        self._chunks.close()
+
+
+class AsyncFailoverStream(_FailoverBase):
+    """Async counterpart of `FailoverStream`; timeouts cancel the underlying request."""
+    async def _run(self) -> AsyncIterator[str]:
+        async for selected in self._candidates:
+            retries = 0
+            while True:
+                self.span.attempt(selected)
+                started = time.perf_counter()
+                ttft = None
+                output_tokens = 0
+                stream = None
+                try:
+                    stream = selected["llm"].astream(await self._aprompt(selected))
+                    while True:
+                        timeout = self.first_token_timeout if ttft is None else self.stall_timeout
+                        # The request is sent on the first read, inside a task that copies the span from here
+                        token = activate(self.span) if ttft is None else None
+                        try:
+                            chunk = await asyncio.wait_for(anext(stream), timeout)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise StreamTimeout(f"Stream {'sent no first token' if ttft is None else 'stalled'} within {timeout}s") from None
+                        finally:
+                            if token is not None:
+                                deactivate(token)
+                        if not chunk:
+                            continue
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                            self._started(selected)
+                        output_tokens += self.switcher._output_tokens(selected, chunk)
+                        self._parts.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    retries += 1
+                    if self._failed(selected, started, e, ttft is not None, retries):
+                        continue
+                    break
+                finally:
+                    if stream is not None:
+                        await stream.aclose()
+                self._finished(selected, started, ttft, output_tokens)
+                return
+        raise RuntimeError("All suitable LLMs failed for streaming task")
+
+    async def _traced(self) -> AsyncIterator[str]:
+        chunks = self._run()
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except BaseException as e:
+            self.span.end(e)
+            raise
+        finally:
+            await chunks.aclose()
+            if self.on_close is not None:
+                self.on_close()
+
+    async def start(self) -> "AsyncFailoverStream":
+        """Wait for the first token so `model` is known; raises if every model fails."""
+        if not self._primed and self.model is None:
+            async for chunk in self._chunks:
+                self._primed.append(chunk)
+                break
+        return self
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self._primed:
+            return self._primed.pop()
+        return await anext(self._chunks)
+
+    async def aclose(self):
+        await self._chunks.aclose()
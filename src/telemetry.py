@@ -0,0 +1,361 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextvars import ContextVar
+from collections import defaultdict
+from typing import Callable
+from bisect import bisect_left
+import threading
+import logging
+import json
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+Sink = Callable[[dict], None]
+
+_CONNECT_EVENTS = ("connection.connect_tcp.", "connection.connect_unix_socket.", "connection.start_tls.")
+
+
+class _NullSpan:
+    """Stands in for a span when telemetry is off, so instrumented code never checks."""
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def ranked(self, seconds: float):
+        pass
+
+    def waited(self, seconds: float):
+        pass
+
+    def attempt(self, selected):
+        pass
+
+    def hedged(self, selected):
+        pass
+
+    def failed(self, selected, error: BaseException):
+        pass
+
+    def first_token(self):
+        pass
+
+    def succeeded(self, selected, tokens_in: int | None = None, tokens_out: int | None = None):
+        pass
+
+    def cached(self, model: str):
+        pass
+
+    def end(self, error: BaseException | None = None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+_current: ContextVar["Span | _NullSpan"] = ContextVar("llm_router_span", default=NULL_SPAN)
+
+
+def current_span() -> "Span | _NullSpan":
+    """The span of the request being handled in this context, or the no-op span."""
+    return _current.get()
+
+
+def activate(span: "Span | _NullSpan"):
+    """Make `span` current in this context, e.g. on a worker thread; returns a token for `deactivate`."""
+    return _current.set(span)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class Span:
+    """Timings and outcome of one routed request, emitted to the telemetry sinks when it ends.
+
+    Used as a context manager it is the current span while the request runs,
+    which is how retries, rate-limit waits and connection setup deep in the
+    call path find it. A stream's span lives on the stream and ends with it.
+    """
+    __slots__ = ("telemetry", "request_id", "operation", "task_type", "model", "status", "started_at", "ranking",
+                 "queue_wait", "connect", "ttft", "latency", "tokens_in", "tokens_out", "cost", "retries",
+                 "failovers", "hedges", "errors", "_hedged", "_t0", "_mark", "_token")
+
+    def __init__(self, telemetry: "Telemetry", operation: str, task_type: str):
+        self.telemetry = telemetry
+        self.request_id = uuid.uuid4().hex
+        self.operation = operation
+        self.task_type = task_type
+        self.model: str | None = None
+        self.status: str | None = None
+        self.started_at = time.time()
+        self.ranking = 0.0
+        self.queue_wait = 0.0
+        self.connect = 0.0
+        self.ttft: float | None = None
+        self.latency: float | None = None
+        self.tokens_in: int | None = None
+        self.tokens_out: int | None = None
+        self.cost: float | None = None
+        self.retries = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.errors: list[str] = []
+        # Models sent a hedge whose first attempt is not yet counted
+        self._hedged: set[str] = set()
+        self._t0 = time.perf_counter()
+        self._mark = self._t0
+        self._token = None
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current.reset(self._token)
+        self.end(exc)
+        return False
+
+    def ranked(self, seconds: float):
+        self.ranking += seconds
+
+    def waited(self, seconds: float):
+        """Time spent queued, e.g. for rate-limit tokens or a batch slot."""
+        self.queue_wait += seconds
+
+    def attempt(self, selected):
+        """A request to `selected` is about to be sent: a retry if it is the same model, else a failover or hedge."""
+        model = selected["llm"].model
+        if model in self._hedged:
+            # Counted in `hedges` when it was launched, not as a failover
+            self._hedged.discard(model)
+        elif self.model is not None:
+            if model == self.model:
+                self.retries += 1
+            else:
+                self.failovers += 1
+        self.model = model
+
+    def hedged(self, selected):
+        """A backup request to `selected` is launched while an earlier one is still running."""
+        self.hedges += 1
+        self._hedged.add(selected["llm"].model)
+
+    def failed(self, selected, error: BaseException):
+        self.errors.append(f"{selected['llm'].model}: {error}")
+
+    def first_token(self):
+        """The first token of the answer arrived; later calls (resumed streams) are ignored."""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._t0
+
+    def succeeded(self, selected, tokens_in: int | None = None, tokens_out: int | None = None):
+        self.model = selected["llm"].model
+        self.cost = selected["estimated_cost"]
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+        self.status = "ok"
+
+    def cached(self, model: str):
+        self.model = model
+        self.status = "cached"
+
+    def trace(self, event: str, info: dict):
+        """httpx/httpcore trace callback; adds up TCP connect and TLS handshake time."""
+        if event.startswith(_CONNECT_EVENTS):
+            now = time.perf_counter()
+            if event.endswith(".complete"):
+                self.connect += now - self._mark
+            self._mark = now
+
+    async def atrace(self, event: str, info: dict):
+        self.trace(event, info)
+
+    def end(self, error: BaseException | None = None):
+        """Finish the span and emit it; later calls are ignored."""
+        if self.latency is not None:
+            return
+        self.latency = time.perf_counter() - self._t0
+        if error is not None:
+            cancelled = not isinstance(error, Exception)
+            self.status = "cancelled" if cancelled else "error"
+            if not cancelled:
+                self.errors.append(str(error))
+        elif self.status is None:
+            # Nothing was sent: another in-flight request answered this one
+            self.status = "coalesced"
+        self.telemetry.emit(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "operation": self.operation,
+            "task_type": self.task_type,
+            "model": self.model,
+            "status": self.status,
+            "started_at": self.started_at,
+            "ranking_s": self.ranking,
+            "queue_wait_s": self.queue_wait,
+            "connect_s": self.connect,
+            "ttft_s": self.ttft,
+            "latency_s": self.latency,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cost": self.cost,
+            "retries": self.retries,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "errors": self.errors,
+        }
+
+
+class Telemetry:
+    def __init__(self, sinks: list[Sink] | None = None):
+        """Event bus for per-request spans.
+
+        Args:
+            sinks (list[Callable[[dict], None]] | None): Called with every finished
+                span as a dict (see `Span.to_dict`), e.g. `JSONLSink` or
+                `PrometheusExporter`. A failing sink is logged and skipped.
+        """
+        self.sinks = list(sinks or [])
+
+    def subscribe(self, sink: Sink):
+        self.sinks.append(sink)
+
+    def span(self, operation: str, task_type: str) -> Span:
+        return Span(self, operation, task_type)
+
+    def emit(self, span: dict):
+        for sink in self.sinks:
+            try:
+                sink(span)
+            except Exception:
+                logger.exception("Telemetry sink %r failed", sink)
+
+
+class JSONLSink:
+    """Appends every span as one JSON line to `path`."""
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def __call__(self, span: dict):
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusExporter:
+    """Aggregates spans into counters and histograms in the Prometheus text format.
+
+    `render()` returns the exposition text; `serve(port)` exposes it on
+    /metrics from a daemon thread.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    HISTOGRAMS = {
+        "ranking_s": ("ranking_seconds", "Time spent ranking candidate models"),
+        "queue_wait_s": ("queue_wait_seconds", "Time spent waiting for rate-limit tokens or a slot"),
+        "connect_s": ("connect_seconds", "TCP connect and TLS handshake time (0 on a reused connection)"),
+        "ttft_s": ("ttft_seconds", "Time to first streamed token"),
+        "latency_s": ("latency_seconds", "Total request latency"),
+    }
+
+    def __init__(self, prefix: str = "llm_router", buckets: tuple[float, ...] = BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._requests: dict[tuple, int] = defaultdict(int)
+        self._counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        # metric -> labels -> [bucket counts..., +Inf count, sum]
+        self._histograms: dict[str, dict[tuple, list[float]]] = defaultdict(dict)
+
+    def __call__(self, span: dict):
+        model = span["model"] or ""
+        labels = (span["task_type"], model)
+        with self._lock:
+            self._requests[(span["operation"], span["task_type"], model, span["status"])] += 1
+            self._counters["retries_total"][labels] += span["retries"]
+            self._counters["failovers_total"][labels] += span["failovers"]
+            self._counters["hedges_total"][labels] += span["hedges"]
+            if span["tokens_in"]:
+                self._counters["tokens_total"][(*labels, "in")] += span["tokens_in"]
+            if span["tokens_out"]:
+                self._counters["tokens_total"][(*labels, "out")] += span["tokens_out"]
+            if span["cost"]:
+                self._counters["cost_dollars_total"][labels] += span["cost"]
+            for field, (metric, _) in self.HISTOGRAMS.items():
+                value = span[field]
+                if value is None:
+                    continue
+                counts = self._histograms[metric].get(labels)
+                if counts is None:
+                    counts = self._histograms[metric][labels] = [0] * (len(self.buckets) + 2)
+                counts[bisect_left(self.buckets, value)] += 1
+                counts[-1] += value
+
+    def _labels(self, names: tuple[str, ...], values: tuple) -> str:
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+        return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [f"# HELP {p}_requests_total Routed requests by outcome", f"# TYPE {p}_requests_total counter"]
+        counters = {
+            "retries_total": ("Retries on the same model", ("task_type", "model")),
+            "failovers_total": ("Switches to another model within a request", ("task_type", "model")),
+            "hedges_total": ("Backup requests sent while an earlier one was still running", ("task_type", "model")),
+            "tokens_total": ("Prompt (in) and completion (out) tokens", ("task_type", "model", "direction")),
+            "cost_dollars_total": ("Estimated cost in dollars", ("task_type", "model")),
+        }
+        with self._lock:
+            for labels, count in self._requests.items():
+                lines.append(f"{p}_requests_total{self._labels(('operation', 'task_type', 'model', 'status'), labels)} {count}")
+            for name, (help_text, names) in counters.items():
+                lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} counter"]
+                for labels, value in self._counters[name].items():
+                    lines.append(f"{p}_{name}{self._labels(names, labels)} {value:g}")
+            for metric, help_text in self.HISTOGRAMS.values():
+                lines += [f"# HELP {p}_{metric} {help_text}", f"# TYPE {p}_{metric} histogram"]
+                for labels, counts in self._histograms[metric].items():
+                    label_text = self._labels(("task_type", "model"), labels)[:-1]
+                    cumulative = 0
+                    for bound, count in zip((*self.buckets, "+Inf"), counts):
+                        cumulative += count
+                        lines.append(f'{p}_{metric}_bucket{label_text},le="{bound}"}} {cumulative}')
+                    lines.append(f"{p}_{metric}_sum{label_text}}} {counts[-1]:g}")
+                    lines.append(f"{p}_{metric}_count{label_text}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="prometheus-exporter", daemon=True).start()
+        return server
@@ -0,0 +1,85 @@
+from math import ceil
+
+from src.message import BaseMessage, ImageMessage
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Adapter name (BaseInference.name) -> tokenizer family
+PROVIDER_FAMILIES = {
+    "OpenAI": "openai",
+    "Gemini": "gemini",
+    "Groq": "llama",
+    "Mistral": "mistral",
+    "Ollama": "llama",
+}
+
+# Average UTF-8 bytes per token for English-heavy chat traffic
+BYTES_PER_TOKEN = {
+    "openai": 4.0,
+    "gemini": 4.2,
+    "llama": 3.8,
+    "mistral": 3.5,
+}
+
+# Framing tokens added per message (role markers, separators) and per image
+MESSAGE_OVERHEAD = {"openai": 4, "gemini": 3, "llama": 5, "mistral": 4}
+IMAGE_TOKENS = {"openai": 765, "gemini": 258, "llama": 1600, "mistral": 1024}
+DEFAULT_FAMILY = "openai"
+
+_encoding = None
+
+
+def family_of(llm) -> str:
+    return PROVIDER_FAMILIES.get(getattr(llm, "name", ""), DEFAULT_FAMILY)
+
+
+def count_text_tokens(text: str, family: str = DEFAULT_FAMILY) -> int:
+    """Token count of a text. Exact for OpenAI when tiktoken is installed, a byte-ratio approximation otherwise."""
+    global _encoding
+    if not text:
+        return 0
+    if family == "openai" and tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN.get(family, BYTES_PER_TOKEN[DEFAULT_FAMILY]))
+
+
+def count_message_tokens(message: BaseMessage, family: str = DEFAULT_FAMILY) -> int:
+    """Token count of a message, cached on it per family while its `content` is the same object."""
+    cached = message.__dict__.get("_tokens")
+    if cached is None or cached[0] is not message.content:
+        cached = message._tokens = (message.content, {})
+    counts = cached[1]
+    tokens = counts.get(family)
+    if tokens is None:
+        tokens = counts[family] = _count_message_tokens(message, family)
+    return tokens
+
+
+def _count_message_tokens(message: BaseMessage, family: str) -> int:
+    overhead = MESSAGE_OVERHEAD.get(family, MESSAGE_OVERHEAD[DEFAULT_FAMILY])
+    if isinstance(message, ImageMessage):
+        text, image = message.content
+        images = IMAGE_TOKENS.get(family, IMAGE_TOKENS[DEFAULT_FAMILY]) if image else 0
+        return overhead + count_text_tokens(text or "", family) + images
+    content = message.content if isinstance(message.content, str) else f"{message.content}"
+    return overhead + count_text_tokens(content, family)
+
+
+def count_prompt_tokens(messages: list[BaseMessage], family: str = DEFAULT_FAMILY) -> int:
+    """Prompt tokens for a message list, including the reply priming tokens."""
+    return sum(count_message_tokens(message, family) for message in messages) + 3
+
+
+def usage_tokens(usage: dict | None) -> int | None:
+    """Total tokens from a normalized provider `usage` dict, if it was reported."""
+    if not usage:
+        return None
+    total = usage.get("total_tokens")
+    if total is None:
+        total = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+    return total or None
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_server import MockServer
+from src.inference import BaseInference
+from src.message import AIMessage, BaseMessage
+
+
+class FakeLLM(BaseInference):
+    """Scripted adapter that answers without touching the network.
+
+    Every call is recorded in `calls` (the messages it was sent). After `delay`
+    seconds it raises the next of `errors`, if any are left, and otherwise
+    answers `reply`, or streams `chunks`. A stream raises `ConnectionError`
+    once `break_after` chunks were sent, or goes silent after `stall_after`
+    until `release` is set.
+    """
+    def __init__(self, model: str, reply="ok", chunks: tuple[str, ...] = ("Hello", ", ", "world"), delay: float = 0.0,
+                 errors: tuple[Exception, ...] = (), break_after: int | None = None, stall_after: int | None = None,
+                 temperature: float = 0.0, usage: dict | None = None, name: str = "Fake"):
+        super().__init__(model=model, temperature=temperature, prompt_cache=False)
+        self.name = name
+        self.reply = reply
+        self.chunks = chunks
+        self.delay = delay
+        self.errors = list(errors)
+        self.break_after = break_after
+        self.stall_after = stall_after
+        self.usage = usage
+        self.calls: list[list[BaseMessage]] = []
+        self.running = 0
+        self.max_running = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def _enter(self, messages: list[BaseMessage]):
+        with self._lock:
+            self.calls.append(messages)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def _exit(self):
+        with self._lock:
+            self.running -= 1
+
+    def _answer(self) -> AIMessage:
+        if self.errors:
+            raise self.errors.pop(0)
+        return AIMessage(self.reply, usage=self.usage)
+
+    def invoke(self, messages: list[BaseMessage], json: bool = False) -> AIMessage:
+        self._enter(messages)
+        try:
+            time.sleep(self.delay)
+            return self._answer()
+        finally:
+            self._exit()
+
+    async def ainvoke(self, messages: list[BaseMessage], json: bool = False) -> AIMessage:
+        self._enter(messages)
+        try:
+            await asyncio.sleep(self.delay)
+            return self._answer()
+        finally:
+            self._exit()
+
+    def stream(self, messages: list[BaseMessage]):
+        self.calls.append(messages)
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        for i, chunk in enumerate(self.chunks):
+            if i == self.break_after:
+                raise ConnectionError("stream broke")
+            if i == self.stall_after:
+                self.release.wait(10)
+            yield chunk
+
+    async def astream(self, messages: list[BaseMessage]):
+        self.calls.append(messages)
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        for i, chunk in enumerate(self.chunks):
+            if i == self.break_after:
+                raise ConnectionError("stream broke")
+            if i == self.stall_after:
+                await asyncio.sleep(10)
+            yield chunk
+
+
+def entry(llm: BaseInference, score: int = 90, tasks: tuple[str, ...] = ("small",), price: float = 0.001, free: int = 0, **fields) -> dict:
+    """An `LLMSwitcher` entry for `llm`."""
+    return {"llm": llm, "tasks": list(tasks), "price_per_1k_tokens": price, "free_limit_tokens": free,
+            "benchmark_score": score, **fields}
+
+
+@pytest.fixture
+def mock_server():
+    with MockServer() as server:
+        yield server
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def test_ainvoke_task_answers_from_the_best_ranked_model():
+    best, other = FakeLLM("best", reply="from best"), FakeLLM("other", reply="from other")
+    switcher = LLMSwitcher([entry(other, score=50), entry(best, score=90)])
+    content, model, cost, reason = asyncio.run(switcher.ainvoke_task(MESSAGES, "small"))
+    assert (content, model) == ("from best", "best")
+    assert "best" in reason
+    assert not other.calls
+
+
+def test_ainvoke_task_fails_over_to_the_next_model():
+    broken, backup = FakeLLM("broken", errors=(ValueError("boom"),) * 10), FakeLLM("backup", reply="saved")
+    switcher = LLMSwitcher([entry(broken, score=90), entry(backup, score=50)], max_retries=2)
+    content, model, _, _ = asyncio.run(switcher.ainvoke_task(MESSAGES, "small"))
+    assert (content, model) == ("saved", "backup")
+    assert len(broken.calls) == 2
+
+
+def test_ainvoke_task_raises_when_every_model_fails():
+    switcher = LLMSwitcher([entry(FakeLLM("a", errors=(ValueError("boom"),) * 10))], max_retries=1)
+    with pytest.raises(RuntimeError, match="All suitable LLMs failed"):
+        asyncio.run(switcher.ainvoke_task(MESSAGES, "small"))
+
+
+def test_concurrent_requests_share_one_event_loop():
+    llm = FakeLLM("a", delay=0.05)
+    switcher = LLMSwitcher([entry(llm)])
+
+    async def run():
+        return await asyncio.gather(*(switcher.ainvoke_task(MESSAGES, "small") for _ in range(50)))
+
+    results = asyncio.run(run())
+    assert [content for content, *_ in results] == ["ok"] * 50
+    # All of them were waiting upstream at the same time
+    assert llm.max_running == 50
+
+
+def test_astream_task_streams_the_whole_answer():
+    switcher = LLMSwitcher([entry(FakeLLM("a", chunks=("one ", "two ", "three")))])
+
+    async def run():
+        stream, model = await switcher.astream_task(MESSAGES, "small")
+        return model, [chunk async for chunk in stream]
+
+    model, chunks = asyncio.run(run())
+    assert model == "a"
+    assert "".join(chunks) == "one two three"
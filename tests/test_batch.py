@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from src.batch import Checkpoint
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from tests.conftest import FakeLLM, entry
+
+
+def jobs(count: int) -> list[tuple[list, str]]:
+    return [([HumanMessage(f"Question {i}")], "small") for i in range(count)]
+
+
+def test_every_job_is_answered_once():
+    llm = FakeLLM("a", delay=0.01)
+    results = dict(LLMSwitcher([entry(llm)]).invoke_many(jobs(20), concurrency=4))
+    assert sorted(results) == list(range(20))
+    assert all(result[:2] == ("ok", "a") for result in results.values())
+    assert llm.max_running <= 4
+
+
+def test_work_spills_over_to_the_next_model():
+    best, other = FakeLLM("best", delay=0.05), FakeLLM("other", delay=0.05)
+    switcher = LLMSwitcher([entry(best, score=90), entry(other, score=50, max_concurrency=2)])
+    results = dict(switcher.invoke_many(jobs(12), concurrency=12, max_per_model=3))
+    assert len(results) == 12
+    assert best.max_running == 3
+    assert other.max_running == 2
+    # The preferred model is packed first
+    assert len(best.calls) >= len(other.calls)
+
+
+def test_failed_job_yields_its_error_and_the_batch_goes_on():
+    llm = FakeLLM("a", errors=(ValueError("boom"),))
+    results = dict(LLMSwitcher([entry(llm)], max_retries=1).invoke_many(jobs(3), concurrency=1))
+    assert isinstance(results[0], RuntimeError)
+    assert results[1][0] == results[2][0] == "ok"
+
+
+def test_checkpoint_skips_finished_jobs(tmp_path):
+    path = str(tmp_path / "batch.jsonl")
+    llm = FakeLLM("a")
+    switcher = LLMSwitcher([entry(llm)])
+    batch = switcher.invoke_many(jobs(5), concurrency=1, checkpoint=path)
+    taken = [next(batch) for _ in range(2)]
+    batch.close()
+    # A result is recorded only once the caller asked for the next one
+    assert list(Checkpoint(path).done) == [taken[0][0]]
+
+    rest = dict(switcher.invoke_many(jobs(5), concurrency=1, checkpoint=path))
+    assert sorted(rest) == [i for i in range(5) if i != taken[0][0]]
+    with open(path, encoding="utf-8") as f:
+        assert sorted(json.loads(line)["index"] for line in f) == list(range(5))
+
+
+def test_checkpoint_ignores_a_partial_last_line(tmp_path):
+    path = tmp_path / "batch.jsonl"
+    path.write_text('{"index": 0, "content": "ok", "model": "a", "cost": 0, "reason": ""}\n{"index": 1, "cont',
+                    encoding="utf-8")
+    checkpoint = Checkpoint(str(path))
+    assert 0 in checkpoint and 1 not in checkpoint
+    checkpoint.close()
+
+
+def test_async_batch():
+    async def run():
+        switcher = LLMSwitcher([entry(FakeLLM("a"))])
+        return {index: result async for index, result in switcher.ainvoke_many(jobs(5), concurrency=2)}
+
+    assert sorted(asyncio.run(run())) == list(range(5))
@@ -0,0 +1,167 @@
+import json
+
+import httpx
+import pytest
+
+from src.inference.batch_api import BatchAPI
+from src.inference.mistral import ChatMistral
+from src.inference.openai import ChatOpenAI
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage
+from tests.conftest import FakeLLM, entry
+
+
+class FakeBatchLLM(FakeLLM, BatchAPI):
+    """`FakeLLM` with an in-memory batch endpoint that finishes once `finish()` is called."""
+    def __init__(self, model: str, submit_errors: tuple[Exception, ...] = (), **options):
+        super().__init__(model, **options)
+        self.submit_errors = list(submit_errors)
+        self.batches: dict[str, list[tuple[str, list]]] = {}
+        self.finished: set[str] = set()
+
+    def submit_batch(self, requests, json=False) -> str:
+        if self.submit_errors:
+            raise self.submit_errors.pop(0)
+        batch_id = f"{self.model}-{len(self.batches)}"
+        self.batches[batch_id] = list(requests)
+        return batch_id
+
+    def batch_status(self, batch_id: str) -> dict:
+        done = batch_id in self.finished
+        return {"id": batch_id, "state": "completed" if done else "in_progress", "done": done}
+
+    def batch_results(self, batch_id: str, json=False) -> dict:
+        return {custom_id: AIMessage(f"{self.model}: {messages[-1].content}") for custom_id, messages in self.batches[batch_id]}
+
+    def cancel_batch(self, batch_id: str):
+        self.finished.add(batch_id)
+
+    def finish(self):
+        self.finished.update(self.batches)
+
+
+def jobs(count: int) -> list[tuple[list, str]]:
+    return [([HumanMessage(f"Question {i}")], "small") for i in range(count)]
+
+
+def test_jobs_of_one_model_are_submitted_as_one_batch():
+    cheap, plain = FakeBatchLLM("cheap"), FakeLLM("plain")
+    switcher = LLMSwitcher([entry(cheap, score=80), entry(plain, score=95, price=0.0001)])
+    batch = switcher.submit_deferred(jobs(3))
+    [requests] = cheap.batches.values()
+    assert [(custom_id, messages[0].content) for custom_id, messages in requests] == [(str(i), f"Question {i}") for i in range(3)]
+    assert not plain.calls
+
+    assert not batch.poll()
+    with pytest.raises(TimeoutError):
+        batch.collect(poll_interval=0.01, timeout=0.05)
+    cheap.finish()
+    results = batch.collect(poll_interval=0.01)
+    assert [result[:2] for result in results.values()] == [(f"cheap: Question {i}", "cheap") for i in range(3)]
+    assert "batch endpoint" in results[0][3]
+
+
+def test_batch_price_defaults_to_half_the_regular_price():
+    a, b = FakeBatchLLM("a"), FakeBatchLLM("b")
+    switcher = LLMSwitcher([entry(a, price=0.001), entry(b, price=0.001, batch_price_per_1k_tokens=0.0001)])
+    assert [s["llm"].model for s in switcher.rank_llms("small", jobs(1)[0][0], deferred=True)] == ["b", "a"]
+    assert [s["llm"].model for s in switcher.rank_llms("small", jobs(1)[0][0])] == ["a", "b"]
+
+
+def test_failed_submission_moves_the_jobs_to_the_next_model():
+    broken, backup = FakeBatchLLM("broken", submit_errors=(ConnectionError("down"),)), FakeBatchLLM("backup")
+    switcher = LLMSwitcher([entry(broken, score=90), entry(backup, score=50)])
+    batch = switcher.submit_deferred(jobs(2))
+    assert not broken.batches and len(backup.batches) == 1
+    backup.finish()
+    assert {result[1] for result in batch.collect(poll_interval=0.01).values()} == {"backup"}
+
+
+def test_jobs_no_model_accepts_fail_alone():
+    switcher = LLMSwitcher([entry(FakeBatchLLM("broken", submit_errors=(ConnectionError("down"),)))])
+    results = switcher.submit_deferred(jobs(2)).collect(poll_interval=0.01)
+    assert all(isinstance(result, RuntimeError) for result in results.values())
+
+
+def test_no_batch_capable_model_raises():
+    with pytest.raises(RuntimeError, match="No batch-capable LLM"):
+        LLMSwitcher([entry(FakeLLM("plain"))]).submit_deferred(jobs(1))
+
+
+def test_missing_answer_becomes_an_error():
+    llm = FakeBatchLLM("a")
+    batch = LLMSwitcher([entry(llm)]).submit_deferred(jobs(2))
+    llm.batches["a-0"].pop()
+    llm.finish()
+    results = batch.collect(poll_interval=0.01)
+    assert results[0][0] == "a: Question 0"
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_state_resumes_in_another_switcher():
+    llm = FakeBatchLLM("a")
+    batch = LLMSwitcher([entry(llm)]).submit_deferred(jobs(2))
+    batch.fail(2, RuntimeError("rejected"))
+    state = json.loads(json.dumps(batch.state()))
+
+    llm.finish()
+    resumed = LLMSwitcher([entry(llm)]).resume_deferred(state)
+    results = resumed.collect(poll_interval=0.01)
+    assert [results[i][0] for i in (0, 1)] == ["a: Question 0", "a: Question 1"]
+    assert str(results[2]) == "rejected"
+    with pytest.raises(KeyError):
+        LLMSwitcher([entry(FakeBatchLLM("other"))]).resume_deferred(state)
+
+
+class Provider:
+    """In-memory OpenAI Files and Batches API."""
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/v1")
+        if path == "/files":
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = request.read()
+            return httpx.Response(200, json={"id": file_id})
+        if path == "/batches":
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"id": batch_id, "status": "in_progress", **json.loads(request.content)}
+            return httpx.Response(200, json={"id": batch_id})
+        if path.startswith("/batches/"):
+            return httpx.Response(200, json=self.batches[path.split("/")[2]])
+        if path.startswith("/files/"):
+            return httpx.Response(200, content=self.files[path.split("/")[2]])
+        return httpx.Response(404)
+
+    def finish(self, batch_id: str, output: list[dict], errors: list[dict]):
+        self.files["out"] = b"".join(json.dumps(line).encode() + b"\n" for line in output)
+        self.files["err"] = b"".join(json.dumps(line).encode() + b"\n" for line in errors)
+        self.batches[batch_id].update(status="completed", output_file_id="out", error_file_id="err")
+
+
+def test_openai_batch_round_trip():
+    provider = Provider()
+    llm = ChatOpenAI("gpt", "key", prompt_cache=False)
+    http = httpx.Client(transport=httpx.MockTransport(provider))
+    llm.client = lambda url: http
+
+    batch_id = llm.submit_batch([("1", [HumanMessage("Hello")]), ("2", [HumanMessage("Bye")])])
+    assert b'"custom_id":"1"' in provider.files["file-0"].replace(b" ", b"")
+    assert provider.batches[batch_id]["endpoint"] == "/v1/chat/completions"
+    assert llm.batch_status(batch_id) == {"id": batch_id, "state": "in_progress", "done": False}
+
+    answer = {"choices": [{"message": {"content": "Hi"}}]}
+    provider.finish(batch_id,
+                    [{"custom_id": "1", "response": {"status_code": 200, "body": answer}}],
+                    [{"custom_id": "2", "response": {"status_code": 400, "body": {"error": {"message": "Bad request"}}}}])
+    results = llm.wait_batch(batch_id, poll_interval=0.01)
+    assert results["1"].content == "Hi"
+    assert isinstance(results["2"], RuntimeError) and "Bad request" in str(results["2"])
+
+
+def test_mistral_sets_the_model_on_the_job():
+    llm = ChatMistral("mistral-small", "key", prompt_cache=False)
+    line = llm._batch_line("1", [HumanMessage("Hello")], False)
+    assert "model" not in line["body"] and "stream" not in line["body"]
@@ -0,0 +1,80 @@
+import time
+
+from src.cache import InMemoryCache, SQLiteCache, make_key
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, SystemMessage
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [SystemMessage("Be brief."), HumanMessage("Hello")]
+
+
+def test_key_depends_on_every_request_parameter():
+    key = make_key(MESSAGES, "small", "a", 0.0)
+    assert key == make_key([SystemMessage("Be brief."), HumanMessage("Hello")], "small", "a", 0.0)
+    assert key != make_key(MESSAGES, "medium", "a", 0.0)
+    assert key != make_key(MESSAGES, "small", "b", 0.0)
+    assert key != make_key(MESSAGES, "small", "a", 0.5)
+    assert key != make_key(MESSAGES, "small", "a", 0.0, json_output=True)
+    assert key != make_key(MESSAGES[1:], "small", "a", 0.0)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = InMemoryCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_entries(monkeypatch):
+    cache = InMemoryCache(ttl=10)
+    cache.set("a", 1)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_get_first_counts_one_lookup():
+    cache = InMemoryCache()
+    assert cache.get_first(["a", "b", "c"]) is None
+    cache.set("b", "hit")
+    assert cache.get_first(["a", "b", "c"]) == (1, "hit")
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_sqlite_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path)
+    cache.set("a", {"answer": [1, 2]})
+    cache.close()
+    cache = SQLiteCache(path)
+    assert cache.get("a") == {"answer": [1, 2]}
+    assert len(cache) == 1
+    cache.close()
+
+
+def test_switcher_serves_repeats_from_the_cache():
+    llm = FakeLLM("a", reply="answer")
+    cache = InMemoryCache()
+    switcher = LLMSwitcher([entry(llm), entry(FakeLLM("b")), entry(FakeLLM("c"))], cache=cache)
+    first = switcher.invoke_task(MESSAGES, "small")
+    second = switcher.invoke_task(MESSAGES, "small")
+    assert first[0] == second[0] == "answer"
+    assert second[2] == 0.0
+    assert len(llm.calls) == 1
+    # One miss for the first request however many models could have answered it
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_switcher_does_not_cache_nondeterministic_models():
+    llm = FakeLLM("a", temperature=0.7)
+    cache = InMemoryCache()
+    switcher = LLMSwitcher([entry(llm)], cache=cache)
+    switcher.invoke_task(MESSAGES, "small")
+    switcher.invoke_task(MESSAGES, "small")
+    assert len(llm.calls) == 2
+    assert len(cache) == 0
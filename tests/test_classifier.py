@@ -0,0 +1,79 @@
+import pytest
+
+from src.classifier import LinearTaskModel, TaskClassifier
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage, ImageMessage
+from tests.conftest import FakeLLM, entry
+
+
+def classify(text: str):
+    return TaskClassifier().classify([HumanMessage(text)])
+
+
+@pytest.mark.parametrize("text, task_type", [
+    ("What is the capital of France?", "small"),
+    ("Fix this:\n```python\ndef f(x):\n    return x +\n```", "code-generation"),
+    ("Calculate 17% of 2340", "calculation"),
+    ("Draw a picture of a cat on a sofa", "image"),
+    ("Make a short video clip of waves", "video"),
+    ("Write a detailed essay on the history of Rome", "text-generation"),
+])
+def test_kinds_of_task(text, task_type):
+    assert classify(text).task_type == task_type
+
+
+def test_image_input_is_an_image_task():
+    messages = [ImageMessage("What is this?", image_base_64="aGVsbG8=")]
+    assert TaskClassifier().classify(messages).task_type == "image"
+
+
+def test_long_prompts_move_up_a_tier():
+    history = [HumanMessage("Tell me about it. " * 300), AIMessage("Sure. " * 2000)] * 3
+    messages = history + [HumanMessage("Now analyze and compare the trade-offs in detail")]
+    assert TaskClassifier().classify(messages).task_type in ("heavy", "text-generation")
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("Answer in 200 words", 280),
+    ("Answer in one sentence, at most 1 sentence", 25),
+    ("Give me a 3-paragraph answer", 360),
+    ("List 5 bullet points", 150),
+    ("Write a 2-page report", 1400),
+])
+def test_explicit_lengths(text, tokens):
+    assert classify(text).output_tokens == tokens
+
+
+def test_classifications_are_cached_per_prompt():
+    classifier = TaskClassifier(cache_size=1)
+    first = classifier.classify([HumanMessage("Hello")])
+    assert classifier.classify([HumanMessage("Hello")]) is first
+    classifier.classify([HumanMessage("Bye")])
+    assert classifier.classify([HumanMessage("Hello")]) is not first
+
+
+def test_choose_falls_back_to_a_served_type():
+    classifier = TaskClassifier()
+    messages = [HumanMessage("Calculate 17% of 2340")]
+    assert classifier.choose(messages, {"calculation", "small"})[0] == "calculation"
+    assert classifier.choose(messages, {"small"})[0] == "small"
+    # None of the predicted types is served: a general-purpose one is
+    assert classifier.choose([HumanMessage("Draw a cat")], {"text-generation"})[0] == "text-generation"
+
+
+def test_trained_model_replaces_the_rules(tmp_path):
+    samples = [([HumanMessage(f"Translate '{word}' to French")], "translation", 10) for word in ("cat", "dog", "house")]
+    samples += [([HumanMessage(f"Write a detailed essay about {topic}")], "essay", 1500) for topic in ("Rome", "Greece", "Egypt")]
+    model = LinearTaskModel.fit(samples, epochs=200)
+    path = str(tmp_path / "model.json")
+    model.save(path)
+    classifier = TaskClassifier(path)
+    assert classifier.classify([HumanMessage("Translate 'bird' to French")]).task_type == "translation"
+    assert classifier.classify([HumanMessage("Write a detailed essay about Persia")]).task_type == "essay"
+
+
+def test_switcher_classifies_unlabelled_requests():
+    small, coder = FakeLLM("small"), FakeLLM("coder")
+    switcher = LLMSwitcher([entry(small, tasks=("small",)), entry(coder, tasks=("code-generation",))])
+    assert switcher.invoke_task([HumanMessage("What is the capital of France?")])[1] == "small"
+    assert switcher.invoke_task([HumanMessage("Refactor this python function to fix the bug")])[1] == "coder"
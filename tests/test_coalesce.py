@@ -0,0 +1,159 @@
+import asyncio
+import threading
+
+from src.coalesce import SingleFlight, flight_key
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, SystemMessage
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def concurrently(count: int, call) -> list:
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = call()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_keys_cover_messages_task_and_params():
+    key = flight_key("invoke", MESSAGES, "small", False)
+    assert key == flight_key("invoke", [HumanMessage("Hello")], "small", False)
+    assert key != flight_key("invoke", MESSAGES, "small", True)
+    assert key != flight_key("invoke", MESSAGES, "large", False)
+    assert key != flight_key("stream", MESSAGES, "small", False)
+    assert key != flight_key("invoke", [SystemMessage("Be brief"), HumanMessage("Hello")], "small", False)
+
+
+def test_identical_requests_share_one_upstream_call():
+    llm = FakeLLM("a", delay=0.2)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+    results = concurrently(8, lambda: switcher.invoke_task(MESSAGES, "small"))
+    assert all(result[:2] == ("ok", "a") for result in results)
+    assert len(llm.calls) == 1
+    assert switcher.single_flight.stats() == {"leaders": 1, "followers": 7, "in_flight": 0}
+
+    # Nothing is kept once the call is done
+    switcher.invoke_task(MESSAGES, "small")
+    assert len(llm.calls) == 2
+
+
+def test_followers_get_the_leaders_error():
+    flight = SingleFlight()
+
+    def call():
+        threading.Event().wait(0.2)
+        raise ValueError("boom")
+
+    results = concurrently(4, lambda: flight.do("key", call))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["leaders"] == 1
+
+
+def test_async_requests_share_one_call_and_survive_a_cancelled_caller():
+    llm = FakeLLM("a", delay=0.2)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+
+    async def run():
+        first = asyncio.ensure_future(switcher.ainvoke_task(MESSAGES, "small"))
+        second = asyncio.ensure_future(switcher.ainvoke_task(MESSAGES, "small"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(run())
+    assert result[:2] == ("ok", "a")
+    assert first.cancelled()
+    assert len(llm.calls) == 1
+
+
+def test_async_call_is_cancelled_once_every_caller_is():
+    flight = SingleFlight()
+    finished = []
+
+    async def call():
+        await asyncio.sleep(0.2)
+        finished.append(True)
+
+    async def run():
+        callers = [asyncio.ensure_future(flight.ado("key", call)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.3)
+        return flight.stats()
+
+    assert asyncio.run(run())["in_flight"] == 0
+    assert not finished
+
+
+def test_identical_streams_share_one_upstream():
+    llm = FakeLLM("a", delay=0.1)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+    results = concurrently(4, lambda: "".join(switcher.stream_task(MESSAGES, "small")[0]))
+    assert results == ["Hello, world"] * 4
+    assert len(llm.calls) == 1
+
+
+def test_stream_is_closed_once_every_subscriber_left():
+    llm = FakeLLM("a", chunks=("one", "two"), stall_after=1)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+    first, _ = switcher.stream_task(MESSAGES, "small")
+    second, _ = switcher.stream_task(MESSAGES, "small")
+    assert next(first) == next(second) == "one"
+    first.close()
+    second.close()
+    llm.release.set()
+    # A new request opens a new upstream instead of joining the abandoned one
+    assert "".join(switcher.stream_task(MESSAGES, "small")[0]) == "onetwo"
+    assert len(llm.calls) == 2
+
+
+def test_stream_open_error_reaches_every_subscriber():
+    flight = SingleFlight()
+
+    def open_stream():
+        threading.Event().wait(0.1)
+        raise RuntimeError("All suitable LLMs failed for this task")
+
+    results = concurrently(3, lambda: flight.stream("key", open_stream))
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_async_streams_share_one_upstream():
+    llm = FakeLLM("a", delay=0.1)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+
+    async def read():
+        stream, _ = await switcher.astream_task(MESSAGES, "small")
+        return "".join([chunk async for chunk in stream])
+
+    async def run():
+        return await asyncio.gather(*(read() for _ in range(4)))
+
+    assert asyncio.run(run()) == ["Hello, world"] * 4
+    assert len(llm.calls) == 1
+
+
+def test_json_and_text_requests_are_not_shared():
+    llm = FakeLLM("a", delay=0.2)
+    switcher = LLMSwitcher([entry(llm)], single_flight=SingleFlight())
+    threads = [threading.Thread(target=switcher.invoke_task, args=(MESSAGES, "small", json)) for json in (False, True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(llm.calls) == 2
+    assert switcher.single_flight.stats()["followers"] == 0
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from src.compaction import SUMMARY_REQUEST, HistoryCompactor
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage, SystemMessage
+from src.tokenizer import DEFAULT_FAMILY, count_prompt_tokens
+from tests.conftest import FakeLLM, entry
+
+SYSTEM = SystemMessage("Be brief.")
+
+
+def conversation(turns: int) -> list:
+    messages = [SYSTEM]
+    for i in range(turns):
+        messages += [HumanMessage(f"Question {i}: " + "words " * 100), AIMessage(f"Answer {i}: " + "words " * 100)]
+    return messages[:-1]
+
+
+def tokens(messages: list) -> int:
+    return count_prompt_tokens(messages, DEFAULT_FAMILY)
+
+
+def test_fitting_history_is_sent_unchanged():
+    messages = conversation(3)
+    assert HistoryCompactor().compact(messages, tokens(messages), DEFAULT_FAMILY) is messages
+    assert HistoryCompactor().compact(messages, None, DEFAULT_FAMILY) is messages
+
+
+def test_old_turns_are_dropped_and_the_system_prompt_kept():
+    messages = conversation(10)
+    budget = tokens(messages) // 3
+    compacted = HistoryCompactor(step=1).compact(messages, budget, DEFAULT_FAMILY)
+    assert compacted[0] is SYSTEM
+    assert compacted[-1] is messages[-1]
+    assert isinstance(compacted[1], HumanMessage)
+    assert tokens(compacted) <= budget
+    # As many recent turns as fit are kept
+    assert tokens(messages[:1] + messages[len(messages) - len(compacted) - 1:]) > budget
+
+
+def test_the_cut_moves_in_steps():
+    compactor = HistoryCompactor(step=4)
+    budget = tokens(conversation(6))
+    firsts = [compactor.compact(conversation(turns), budget, DEFAULT_FAMILY)[1].content for turns in range(8, 16)]
+    assert len(set(firsts)) <= 3
+    assert all(tokens(compactor.compact(conversation(turns), budget, DEFAULT_FAMILY)) <= budget for turns in range(8, 16))
+
+
+def test_max_prompt_tokens_caps_every_budget():
+    compactor = HistoryCompactor(max_prompt_tokens=500)
+    assert compactor.budget(None) == 500
+    assert compactor.budget(10_000) == 500
+    assert compactor.budget(100) == 100
+    assert tokens(compactor.compact(conversation(10), None, DEFAULT_FAMILY)) <= 500
+
+
+def test_dropped_turns_are_summarized_once():
+    summarizer = FakeLLM("summarizer", reply="They asked many questions.")
+    compactor = HistoryCompactor(summarizer, step=1, summary_tokens=100)
+    messages = conversation(10)
+    budget = tokens(messages) // 2
+    compacted = compactor.compact(messages, budget, DEFAULT_FAMILY)
+    assert [m.content for m in compacted[1:3]] == [SUMMARY_REQUEST, "They asked many questions."]
+    assert tokens(compacted) <= budget
+    assert compactor.compact(messages, budget, DEFAULT_FAMILY) == compacted
+    assert len(summarizer.calls) == 1
+
+    # A longer conversation only summarizes the newly dropped turns, on top of the cached summary
+    compactor.compact(conversation(12), budget, DEFAULT_FAMILY)
+    assert len(summarizer.calls) == 2
+    assert summarizer.calls[1][-1].content.startswith("Summary so far:\nThey asked many questions.")
+
+
+def test_failed_summary_drops_the_turns():
+    summarizer = FakeLLM("summarizer", errors=(ValueError("boom"),))
+    messages = conversation(10)
+    compacted = HistoryCompactor(summarizer, step=1).compact(messages, tokens(messages) // 2, DEFAULT_FAMILY)
+    assert SUMMARY_REQUEST not in [m.content for m in compacted]
+    assert compacted[0] is SYSTEM and compacted[-1] is messages[-1]
+
+
+def test_async_compaction_summarizes_with_ainvoke():
+    summarizer = FakeLLM("summarizer", reply="Summary.")
+    messages = conversation(10)
+    compacted = asyncio.run(HistoryCompactor(summarizer).acompact(messages, tokens(messages) // 2, DEFAULT_FAMILY))
+    assert compacted[2].content == "Summary."
+
+
+def test_switcher_trims_history_to_each_models_window():
+    small, large = FakeLLM("small"), FakeLLM("large")
+    messages = conversation(10)
+    window = tokens(messages) // 2
+    switcher = LLMSwitcher([entry(small, score=90, context_window=window, max_output_tokens=200),
+                            entry(large, score=50, context_window=10 * window)], compactor=HistoryCompactor(step=1))
+    assert switcher.invoke_task(messages, "small")[1] == "small"
+    sent = small.calls[0]
+    assert sent[0] is SYSTEM and sent[-1] is messages[-1]
+    # The compacted prompt leaves the same room for the answer as the window filter assumed
+    assert tokens(sent) <= window - min(switcher.estimate_tokens_for_task("small"), 200)
+
+
+def test_models_whose_window_cannot_fit_the_prompt_are_skipped():
+    small, large = FakeLLM("small"), FakeLLM("large")
+    messages = conversation(10)
+    switcher = LLMSwitcher([entry(small, score=90, context_window=tokens(messages) // 2), entry(large, score=50)])
+    assert switcher.invoke_task(messages, "small")[1] == "large"
+    assert not small.calls
+
+    only_small = LLMSwitcher([entry(FakeLLM("small"), context_window=100)])
+    with pytest.raises(RuntimeError, match="context window"):
+        only_small.invoke_task(messages, "small")
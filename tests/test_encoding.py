@@ -0,0 +1,99 @@
+import base64
+import json
+
+from src.image import ImageSource
+from src.inference import encoding
+from src.inference.encoding import Fragment, MessageEncoder, StreamingBody, dumps, encode_body, request_body
+from src.inference.openai import ChatOpenAI
+from src.message import AIMessage, BaseMessage, HumanMessage, ImageMessage, SystemMessage
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 8
+
+
+def encoder() -> MessageEncoder:
+    return MessageEncoder("test", {
+        HumanMessage: lambda message: ("message", {"role": "user", "content": message.content}),
+        ImageMessage: lambda message: ("message", {"role": "user", "text": message.content[0], "image": message.content[1]}),
+        AIMessage: lambda message: None,
+        BaseMessage: lambda message: ("system", {"role": "system", "content": message.content}),
+    })
+
+
+def decoded(body) -> dict:
+    return json.loads(body if isinstance(body, bytes) else b"".join(body))
+
+
+def test_dumps_is_compact_utf8():
+    assert dumps({"a": ["é", 1]}) == '{"a":["é",1]}'.encode()
+
+
+def test_messages_are_encoded_once_per_provider():
+    calls = []
+    counting = MessageEncoder("counting", {HumanMessage: lambda message: calls.append(message) or ("message", {"c": message.content})})
+    message = HumanMessage("Hello")
+    first = counting(message)
+    assert counting(message) is first
+    assert encoder()(message) is not first
+    assert len(calls) == 1
+
+    # New content is encoded again
+    message.content = "Bye"
+    assert counting(message)[1] == {"c": "Bye"}
+    assert len(calls) == 2
+
+
+def test_rules_follow_the_nearest_base_and_none_leaves_a_message_out():
+    encoded = encoder().encode([SystemMessage("Be brief"), HumanMessage("Hello"), AIMessage("Hi")])
+    assert [kind for kind, _ in encoded] == ["system", "message"]
+    assert all(isinstance(fragment, Fragment) for _, fragment in encoded)
+
+
+def test_body_splices_fragments_into_valid_json():
+    fragments = [fragment for _, fragment in encoder().encode([HumanMessage('Say "hi"'), HumanMessage("é")])]
+    payload = {"model": "a", "messages": fragments, "temperature": 0.5}
+    assert decoded(encode_body(payload)) == {"model": "a", "messages": [{"role": "user", "content": 'Say "hi"'},
+                                                                        {"role": "user", "content": "é"}], "temperature": 0.5}
+    assert fragments[0]._segments is not None
+
+
+def test_small_images_are_inlined(tmp_path):
+    path = tmp_path / "small.png"
+    path.write_bytes(PNG)
+    [(_, fragment)] = encoder().encode([ImageMessage("Look", image_path=str(path))])
+    body = encode_body({"messages": [fragment]})
+    assert isinstance(body, bytes)
+    assert decoded(body)["messages"][0]["image"] == base64.b64encode(PNG).decode()
+
+
+def test_large_images_are_streamed_with_an_exact_length(tmp_path, monkeypatch):
+    monkeypatch.setattr(encoding, "STREAM_IMAGES_FROM", 1000)
+    path = tmp_path / "large.png"
+    path.write_bytes(PNG)
+    [(_, fragment)] = encoder().encode([ImageMessage("Look", image_path=str(path))])
+    body = encode_body({"model": "a", "messages": [fragment]})
+    assert isinstance(body, StreamingBody)
+    raw = b"".join(body)
+    assert len(raw) == body.length
+    assert json.loads(raw)["messages"][0]["image"] == base64.b64encode(PNG).decode()
+
+    content, headers = request_body({"messages": [fragment]}, {"Content-Type": "application/json"})
+    assert headers["Content-Length"] == str(len(b"".join(content)))
+
+
+def test_text_containing_the_image_marker_is_kept():
+    message = ImageMessage("\x00image\x00", image_base_64=base64.b64encode(PNG).decode())
+    [(_, fragment)] = encoder().encode([message])
+    assert decoded(encode_body({"messages": [fragment]}))["messages"][0]["text"] == "\x00image\x00"
+
+
+def test_adapter_payloads_stay_plain_dicts():
+    llm = ChatOpenAI("gpt", "key", prompt_cache=False)
+    payload = llm._payload([SystemMessage("Be brief"), HumanMessage("Hello")])
+    assert json.loads(json.dumps(payload))["messages"] == [{"role": "system", "content": "Be brief"},
+                                                          {"role": "user", "content": "Hello"}]
+    assert decoded(encode_body(payload)) == json.loads(json.dumps(payload))
+
+
+def test_image_source_is_materialized_by_dumps():
+    image = ImageSource(data=PNG)
+    assert json.loads(dumps({"image": image})) == {"image": base64.b64encode(PNG).decode()}
@@ -0,0 +1,163 @@
+import json
+import socket
+
+import httpx
+import pytest
+
+from src.gateway import Gateway, RequestError, to_messages
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, ImageMessage, SystemMessage
+from src.scheduler import Scheduler
+from tests.conftest import FakeLLM, entry
+
+CHAT = {"model": "auto", "messages": [{"role": "user", "content": "Hello"}]}
+
+
+def serve(*llms: FakeLLM, scheduler: Scheduler | None = None, **options) -> Gateway:
+    llms = llms or (FakeLLM("a"),)
+    return Gateway(lambda: LLMSwitcher([entry(llm, tasks=("small", "code-generation")) for llm in llms], scheduler=scheduler),
+                   port=0, **options).start()
+
+
+@pytest.fixture
+def gateway():
+    gateway = serve()
+    yield gateway
+    gateway.stop()
+
+
+def raw(gateway: Gateway, data: bytes) -> tuple[int, bytes]:
+    """Send `data` on a fresh connection and read the response until the gateway closes it."""
+    with socket.create_connection((gateway.host, gateway.port), timeout=5) as sock:
+        sock.sendall(data)
+        response = b""
+        while chunk := sock.recv(65536):
+            response += chunk
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), body
+
+
+def post(gateway: Gateway, body: bytes, headers: str = "") -> tuple[int, dict]:
+    status, data = raw(gateway, b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nConnection: close\r\n"
+                                + headers.encode() + b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    return status, json.loads(data)
+
+
+@pytest.mark.parametrize("request_bytes", [
+    b"GARBAGE\r\n\r\n",
+    b"POST /v1/chat/completions HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+    b"POST /v1/chat/completions HTTP/1.1\r\nContent-Length: +5\r\n\r\nhello",
+    b"POST /v1/chat/completions HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+    b"POST /v1/chat/completions HTTP/1.1\r\nNo colon here\r\n\r\n",
+])
+def test_malformed_requests_get_400_and_a_closed_connection(gateway, request_bytes):
+    status, body = raw(gateway, request_bytes)
+    assert status == 400
+    assert json.loads(body)["error"]["type"] == "invalid_request_error"
+
+
+def test_oversized_body_gets_413():
+    gateway = serve(max_body_size=10)
+    try:
+        assert post(gateway, json.dumps(CHAT).encode())[0] == 413
+    finally:
+        gateway.stop()
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"{not json", "Expecting property name"),
+    (b"[1, 2]", "must be a JSON object"),
+    (json.dumps({"model": "auto"}).encode(), "'messages' must be a non-empty list"),
+    (json.dumps({**CHAT, "model": 5}).encode(), "'model' must be a string"),
+    (json.dumps({**CHAT, "stream": True, "response_format": {"type": "json_object"}}).encode(), "not supported with stream"),
+    (json.dumps({"messages": [{"role": "tool", "content": "x"}]}).encode(), "Unsupported message role"),
+    (json.dumps({"messages": [{"role": "user", "content": [{"type": "audio"}]}]}).encode(), "Unsupported content part"),
+])
+def test_invalid_chat_requests_get_400(gateway, body, message):
+    status, error = post(gateway, body)
+    assert status == 400
+    assert message in error["error"]["message"]
+
+
+def test_api_keys_are_required_except_for_health():
+    gateway = serve(api_keys=["secret"])
+    try:
+        assert post(gateway, json.dumps(CHAT).encode())[0] == 401
+        assert post(gateway, json.dumps(CHAT).encode(), "Authorization: Bearer wrong\r\n")[0] == 401
+        assert post(gateway, json.dumps(CHAT).encode(), "Authorization: Bearer secret\r\n")[0] == 200
+        assert raw(gateway, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")[0] == 200
+    finally:
+        gateway.stop()
+
+
+def test_unknown_routes_and_methods(gateway):
+    assert raw(gateway, b"GET /v1/embeddings HTTP/1.1\r\nConnection: close\r\n\r\n")[0] == 404
+    assert raw(gateway, b"GET /v1/chat/completions HTTP/1.1\r\nConnection: close\r\n\r\n")[0] == 405
+    assert raw(gateway, b"POST /v1/models HTTP/1.1\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")[0] == 405
+
+
+def test_scheduler_headers():
+    gateway = serve(scheduler=Scheduler())
+    try:
+        status, error = post(gateway, json.dumps(CHAT).encode(), "X-Deadline: 0\r\n")
+        assert status == 429 and error["error"]["type"] == "rate_limit_error"
+        assert post(gateway, json.dumps(CHAT).encode(), "X-Priority: urgent\r\n")[0] == 400
+        assert post(gateway, json.dumps(CHAT).encode(), "X-Deadline: soon\r\n")[0] == 400
+        assert post(gateway, json.dumps(CHAT).encode(), "X-Priority: interactive\r\nX-Deadline: 5\r\n")[0] == 200
+    finally:
+        gateway.stop()
+
+
+def test_no_model_answering_gets_503():
+    gateway = serve(FakeLLM("a", errors=(ValueError("boom"),) * 10))
+    try:
+        status, error = post(gateway, json.dumps(CHAT).encode())
+        assert status == 503 and "All suitable LLMs failed" in error["error"]["message"]
+    finally:
+        gateway.stop()
+
+
+def test_chat_completion(gateway):
+    with httpx.Client(base_url=gateway.base_url) as client:
+        response = client.post("/chat/completions", json={**CHAT, "model": "code-generation"})
+        assert response.status_code == 200
+        answer = response.json()
+        assert answer["model"] == "a"
+        assert answer["choices"][0]["message"] == {"role": "assistant", "content": "ok"}
+        assert answer["usage"]["total_tokens"] == answer["usage"]["prompt_tokens"] + answer["usage"]["completion_tokens"]
+        assert "code-generation" in answer["routing"]["reason"]
+        # The connection is kept alive for the next request
+        assert client.get("/models").json()["data"][0]["id"] == "auto"
+
+
+def test_chunked_request_body(gateway):
+    body = json.dumps(CHAT).encode()
+    status, data = raw(gateway, b"POST /v1/chat/completions HTTP/1.1\r\nConnection: close\r\nTransfer-Encoding: chunked\r\n\r\n"
+                                + b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+    assert status == 200 and json.loads(data)["choices"][0]["message"]["content"] == "ok"
+
+
+def test_streamed_chat_completion(gateway):
+    request = {**CHAT, "stream": True, "stream_options": {"include_usage": True}}
+    with httpx.stream("POST", f"{gateway.base_url}/chat/completions", json=request) as response:
+        assert response.headers["content-type"] == "text/event-stream"
+        events = [line[6:] for line in response.iter_lines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert chunks[0]["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"]) == "Hello, world"
+    assert chunks[-2]["choices"][0]["finish_reason"] == "stop"
+    assert chunks[-1]["usage"]["completion_tokens"] > 0
+
+
+def test_openai_messages_are_converted():
+    messages = to_messages([
+        {"role": "developer", "content": "Be brief"},
+        {"role": "user", "content": [{"type": "text", "text": "What is this?"},
+                                     {"type": "image_url", "image_url": {"url": "data:image/png;base64,aGVsbG8="}}]},
+    ])
+    assert isinstance(messages[0], SystemMessage)
+    assert isinstance(messages[1], ImageMessage) and messages[1].content[0] == "What is this?"
+    assert isinstance(to_messages([{"role": "user", "content": None}])[0], HumanMessage)
+    with pytest.raises(RequestError):
+        to_messages([{"role": "user", "content": [{"type": "image_url", "image_url": "ftp://x"}]}])
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+
+from benchmarks.bench_suite import make_llm
+from src.health import HealthMonitor
+from src.inference.pool import ConnectionPool
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_breaker_opens_after_consecutive_failures():
+    health = HealthMonitor(failure_threshold=3, cooldown=60)
+    model = entry(FakeLLM("a"))
+    for _ in range(2):
+        health.record_failure(model)
+    assert health.state(model) == "closed"
+    health.record_success(model)
+    for _ in range(3):
+        health.record_failure(model)
+    assert health.state(model) == "open"
+    assert not health.available(model)
+    assert not health.allow(model)
+    assert not health.closed(model)
+    assert health.penalties[id(model)] == 0.0
+
+
+def test_breaker_opens_on_the_error_rate():
+    health = HealthMonitor(failure_threshold=100, error_rate_threshold=0.5, min_requests=10, cooldown=60)
+    model = entry(FakeLLM("a"))
+    for _ in range(10):
+        health.record_success(model)
+        health.record_failure(model)
+        health.record_failure(model)
+        if health.state(model) == "open":
+            break
+    assert health.state(model) == "open"
+
+
+def test_passing_probe_half_opens_and_a_trial_closes():
+    probed = []
+    health = HealthMonitor(failure_threshold=1, cooldown=0.05, probe=probed.append)
+    model = entry(FakeLLM("a"))
+    health.record_failure(model)
+    assert wait_for(lambda: health.state(model) == "half_open")
+    assert probed == [model]
+
+    # Looking does not take the single trial; claiming it does
+    assert health.available(model) and health.available(model)
+    assert health.allow(model)
+    assert not health.available(model)
+    assert not health.allow(model)
+
+    health.record_success(model)
+    assert health.state(model) == "closed"
+    assert health.allow(model) and health.allow(model)
+    assert id(model) not in health.penalties
+
+
+def test_failed_trial_reopens_with_a_longer_cooldown():
+    health = HealthMonitor(failure_threshold=1, cooldown=0.05, max_cooldown=10)
+    model = entry(FakeLLM("a"))
+    health.record_failure(model)
+    assert wait_for(lambda: health.state(model) == "half_open")
+    assert health.allow(model)
+    health.record_failure(model)
+    assert health.state(model) == "open"
+    assert health._breakers[health.key(model)].cooldown == 0.1
+
+
+def test_failing_probe_keeps_the_breaker_open():
+    def probe(entry):
+        raise ConnectionError("still down")
+
+    health = HealthMonitor(failure_threshold=1, cooldown=0.05, probe=probe)
+    model = entry(FakeLLM("a"))
+    health.record_failure(model)
+    time.sleep(0.3)
+    assert health.state(model) == "open"
+    assert health._breakers[health.key(model)].cooldown > 0.05
+
+
+def test_slow_models_rank_lower():
+    health = HealthMonitor(slow_latency=1.0)
+    model = entry(FakeLLM("a"))
+    health.record_success(model, latency=4.0)
+    assert health.penalties[id(model)] == 0.25
+    assert health.snapshot()["fake:a"]["latency_ewma"] == 4.0
+
+
+def test_reset_forgets_a_model():
+    health = HealthMonitor(failure_threshold=1, cooldown=60)
+    model = entry(FakeLLM("a"))
+    health.record_failure(model)
+    health.reset(model)
+    assert health.state(model) == "closed"
+    assert not health.penalties
+
+
+def test_switcher_skips_open_circuits_without_a_request():
+    broken, backup = FakeLLM("broken", errors=(ValueError("boom"),) * 10), FakeLLM("backup")
+    health = HealthMonitor(failure_threshold=2, cooldown=60)
+    switcher = LLMSwitcher([entry(broken, score=90), entry(backup, score=80)], max_retries=5, health=health)
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+    # Retrying stops once the breaker opens
+    assert len(broken.calls) == 2
+    assert switcher.health_status()["fake:broken"]["state"] == "open"
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+    assert len(broken.calls) == 2
+
+
+def test_switcher_sends_one_trial_to_a_half_open_model():
+    flaky, backup = FakeLLM("flaky", errors=(ValueError("boom"),)), FakeLLM("backup")
+    health = HealthMonitor(failure_threshold=1, cooldown=0.05)
+    switcher = LLMSwitcher([entry(flaky, score=90), entry(backup, score=80)], max_retries=1, health=health)
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+    assert wait_for(lambda: health.state(switcher.llms[0]) == "half_open")
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "flaky"
+    assert health.state(switcher.llms[0]) == "closed"
+
+
+@pytest.mark.parametrize("provider", ["groq", "mistral", "gemini"])
+def test_default_probe_lists_models_on_the_adapters_own_host(mock_server, provider):
+    llm = make_llm(mock_server, provider, "a", ConnectionPool())
+    HealthMonitor().probe(entry(llm))
+    assert mock_server.requests == 1
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from src.hedging import HedgePolicy
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from src.telemetry import Telemetry
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def candidates(*models: str, pulled: list | None = None):
+    """Switcher-like candidates for `HedgePolicy.run`, noting in `pulled` when each is taken."""
+    for model in models:
+        if pulled is not None:
+            pulled.append(model)
+        yield {"llm": FakeLLM(model)}
+
+
+def test_hedge_delay_uses_the_percentile_once_there_are_enough_samples():
+    policy = HedgePolicy(delay=0.5, percentile=90, min_samples=10)
+    for latency in range(1, 10):
+        policy.record("a", latency / 100)
+    assert policy.hedge_delay("a") == 0.5
+    policy.record("a", 0.10)
+    assert policy.hedge_delay("a") == pytest.approx(0.10)
+
+
+def test_fast_primary_never_pulls_a_backup():
+    pulled = []
+    policy = HedgePolicy(delay=0.5)
+    selected, result = policy.run(candidates("a", "b", pulled=pulled), lambda s: s["llm"].model)
+    assert (selected["llm"].model, result) == ("a", "a")
+    assert pulled == ["a"]
+
+
+def test_slow_primary_is_hedged_and_the_first_answer_wins():
+    policy = HedgePolicy(delay=0.05)
+    delays = {"slow": 1.0, "fast": 0.0}
+
+    def call(selected):
+        time.sleep(delays[selected["llm"].model])
+        return selected["llm"].model
+
+    started = time.perf_counter()
+    selected, result = policy.run(candidates("slow", "fast"), call)
+    assert result == "fast"
+    assert time.perf_counter() - started < 0.5
+
+
+def test_failed_primary_launches_the_next_candidate_at_once():
+    policy = HedgePolicy(delay=5.0)
+
+    def call(selected):
+        if selected["llm"].model == "broken":
+            raise ValueError("boom")
+        return "ok"
+
+    started = time.perf_counter()
+    selected, result = policy.run(candidates("broken", "backup"), call)
+    assert (selected["llm"].model, result) == ("backup", "ok")
+    assert time.perf_counter() - started < 1.0
+
+
+def test_every_candidate_failing_raises_with_the_last_error():
+    policy = HedgePolicy(delay=0.01)
+
+    def call(selected):
+        raise ValueError(selected["llm"].model)
+
+    with pytest.raises(RuntimeError, match="All suitable LLMs failed") as raised:
+        policy.run(candidates("a", "b"), call)
+    assert isinstance(raised.value.__cause__, ValueError)
+
+
+def test_candidates_not_admitted_are_passed_over():
+    policy = HedgePolicy(delay=0.5)
+    selected, _ = policy.run(candidates("closed", "open"), lambda s: "ok", lambda s, wait: s["llm"].model != "closed")
+    assert selected["llm"].model == "open"
+
+
+def test_arun_hedges_and_cancels_the_loser():
+    policy = HedgePolicy(delay=0.05)
+    cancelled = []
+
+    async def call(selected):
+        try:
+            await asyncio.sleep(1.0 if selected["llm"].model == "slow" else 0.0)
+        except asyncio.CancelledError:
+            cancelled.append(selected["llm"].model)
+            raise
+        return selected["llm"].model
+
+    async def run():
+        result = await policy.arun(candidates("slow", "fast"), call)
+        await asyncio.sleep(0)
+        return result
+
+    selected, result = asyncio.run(run())
+    assert result == "fast"
+    assert cancelled == ["slow"]
+
+
+def test_switcher_counts_a_hedge_separately_from_failovers():
+    spans = []
+    slow, fast = FakeLLM("slow", delay=0.5), FakeLLM("fast")
+    switcher = LLMSwitcher([entry(slow, score=90), entry(fast, score=50)], hedge=HedgePolicy(delay=0.05),
+                           telemetry=Telemetry([spans.append]))
+    content, model, _, _ = switcher.invoke_task(MESSAGES, "small")
+    assert model == "fast"
+    assert spans[0]["hedges"] == 1
+    assert spans[0]["failovers"] == 0
@@ -0,0 +1,131 @@
+import base64
+import functools
+import gc
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+from src.image import IMAGE_CACHE, Image, ImageCache, ImageSource
+from src.message import ImageMessage
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(10_000)
+
+
+@pytest.fixture
+def image_server(tmp_path):
+    """Serves `tmp_path` over HTTP and records the paths requested."""
+    requested = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            requested.append(self.path)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=str(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.requested = requested
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    max_bytes = IMAGE_CACHE.max_bytes
+    IMAGE_CACHE.clear()
+    yield
+    IMAGE_CACHE.clear()
+    IMAGE_CACHE.max_bytes = max_bytes
+
+
+def test_messages_hold_a_reference_until_the_image_is_needed(tmp_path):
+    path = tmp_path / "photo.png"
+    path.write_bytes(b"")
+    message = ImageMessage("Look", image_path=str(path))
+    # The file is read when the image is used, not when the message is made
+    path.write_bytes(PNG)
+    _, image = message.content
+    assert image.mime_type == "image/png"
+    assert image.size() == len(PNG)
+    assert image.base64() == base64.b64encode(PNG).decode()
+    assert message.to_dict()["content"] == f"Look [image sha256:{hashlib.sha256(PNG).hexdigest()}]"
+
+
+def test_base64_is_cached_by_content(tmp_path):
+    path = tmp_path / "photo.png"
+    path.write_bytes(PNG)
+    first, second = ImageSource(path=str(path)), ImageSource(path=str(path))
+    assert first.base64() is second.base64()
+
+    # A changed file is hashed and encoded again
+    path.write_bytes(PNG[:100])
+    assert first.base64() == base64.b64encode(PNG[:100]).decode()
+
+
+def test_iter_base64_matches_the_whole_encoding(tmp_path):
+    path = tmp_path / "photo.png"
+    path.write_bytes(PNG)
+    image = ImageSource(path=str(path))
+    expected = base64.b64encode(PNG)
+    assert b"".join(image.iter_base64(chunk_size=3 * 100)) == expected
+    assert image.base64_length() == len(expected)
+    image.base64()
+    assert b"".join(image.iter_base64(chunk_size=3 * 100)) == expected
+
+
+def test_given_base64_is_passed_through():
+    encoded = base64.b64encode(b"GIF89a" + bytes(100)).decode()
+    image = ImageSource(base64_data=encoded)
+    assert image.base64() is encoded
+    assert image.mime_type == "image/gif"
+    assert image.fit(100) is image
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = ImageCache(max_bytes=10)
+    cache.put(("a",), b"12345")
+    cache.put(("b",), b"12345")
+    cache.get(("a",))
+    cache.put(("c",), b"12345")
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == b"12345"
+    cache.put(("d",), b"x" * 11)
+    assert cache.get(("d",)) is None
+
+
+def test_url_is_downloaded_once(tmp_path, image_server):
+    (tmp_path / "photo.png").write_bytes(PNG)
+    image = ImageSource.parse(f"{image_server.url}/photo.png")
+    assert image.digest == hashlib.sha256(PNG).hexdigest()
+    assert image.mime_type == "image/png"
+    assert image.base64() == base64.b64encode(PNG).decode()
+    assert image_server.requested == ["/photo.png"]
+
+
+def test_oversized_url_is_spooled_to_a_temporary_file(tmp_path, image_server):
+    IMAGE_CACHE.max_bytes = 1000
+    (tmp_path / "photo.png").write_bytes(PNG)
+    image = ImageSource.parse(f"{image_server.url}/photo.png")
+    assert image.digest == hashlib.sha256(PNG).hexdigest()
+    assert image.size() == len(PNG)
+    assert b"".join(image.iter_base64()) == base64.b64encode(PNG)
+    assert image_server.requested == ["/photo.png"]
+
+    spooled = image._spooled
+    assert os.path.exists(spooled)
+    del image
+    gc.collect()
+    assert not os.path.exists(spooled)
+
+
+def test_invalid_source_raises():
+    with pytest.raises(ValueError):
+        ImageSource.parse("not a path: <>")
+
+
+@pytest.mark.skipif(Image is not None, reason="Pillow is installed")
+def test_downscaling_needs_pillow():
+    with pytest.raises(ImportError):
+        ImageSource(path="photo.png", downscale=True)
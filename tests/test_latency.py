@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from src.latency import LatencyTracker, Objective, QuantileSketch
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def test_sketch_quantiles_are_within_the_accuracy():
+    rng = random.Random(0)
+    samples = [rng.lognormvariate(0, 1) for _ in range(500)]
+    sketch = QuantileSketch(accuracy=0.02, window=1000)
+    assert sketch.quantile(50) is None
+    for sample in samples:
+        sketch.add(sample)
+    ordered = sorted(samples)
+    for percentile in (50, 90, 99):
+        exact = ordered[int(percentile / 100 * (len(ordered) - 1))]
+        assert sketch.quantile(percentile) == pytest.approx(exact, rel=0.021)
+
+
+def test_sketch_forgets_old_samples():
+    sketch = QuantileSketch(window=10)
+    for _ in range(10):
+        sketch.add(100.0)
+    for _ in range(20):
+        sketch.add(1.0)
+    assert sketch.quantile(99) == pytest.approx(1.0, rel=0.03)
+    assert len(sketch) == 10
+
+
+def test_throughput_is_only_measured_for_streams():
+    tracker = LatencyTracker()
+    model = entry(FakeLLM("a"))
+    tracker.record(model, 2.0)
+    assert tracker.quantile(model, "tps", 50) is None
+    tracker.record(model, 2.0, ttft=0.5, output_tokens=300)
+    assert tracker.quantile(model, "tps", 50) == pytest.approx(200, rel=0.03)
+    assert tracker.predict(model, "latency", 50, 1000) == pytest.approx(0.5 + 1000 / 200, rel=0.05)
+    assert tracker.predict(model, "ttft", 50, 1000) == pytest.approx(0.5, rel=0.03)
+    assert tracker.snapshot()["fake:a"]["samples"] == 2
+
+
+def test_latency_objective_prefers_the_faster_model():
+    tracker = LatencyTracker()
+    slow, fast = entry(FakeLLM("slow"), score=95), entry(FakeLLM("fast"), score=60)
+    for _ in range(10):
+        tracker.record(slow, 3.0)
+        tracker.record(fast, 0.5)
+    switcher = LLMSwitcher([slow, fast], latency=tracker, objectives={"small": "fastest"})
+    assert [s["llm"].model for s in switcher.rank_llms("small", MESSAGES)] == ["fast", "slow"]
+    assert [s["llm"].model for s in LLMSwitcher([slow, fast]).rank_llms("small", MESSAGES)] == ["slow", "fast"]
+
+
+def test_models_missing_the_slo_rank_last():
+    tracker = LatencyTracker()
+    slow, fast = entry(FakeLLM("slow"), score=95), entry(FakeLLM("fast"), score=60)
+    for _ in range(10):
+        tracker.record(slow, 3.0)
+        tracker.record(fast, 0.5)
+    switcher = LLMSwitcher([slow, fast], latency=tracker, objectives={"small": Objective("cost", slo=1.0)})
+    assert [s["llm"].model for s in switcher.rank_llms("small", MESSAGES)] == ["fast", "slow"]
+
+
+def test_unmeasured_models_are_assumed_typical():
+    tracker = LatencyTracker()
+    known, new = entry(FakeLLM("known"), score=60), entry(FakeLLM("new"), score=95)
+    for _ in range(10):
+        tracker.record(known, 2.0)
+    switcher = LLMSwitcher([known, new], latency=tracker, objectives={"small": Objective("cost", slo=1.0)})
+    # Both are predicted to miss the SLO, so cost decides
+    assert [s["llm"].model for s in switcher.rank_llms("small", MESSAGES)] == ["new", "known"]
+
+
+def test_switcher_records_latency_per_model():
+    switcher = LLMSwitcher([entry(FakeLLM("a", delay=0.05))])
+    switcher.invoke_task(MESSAGES, "small")
+    stream, _ = switcher.stream_task(MESSAGES, "small")
+    "".join(stream)
+    status = switcher.latency_status()["fake:a"]
+    assert status["samples"] == 2
+    assert status["latency_p50"] >= 0.05
+    assert "ttft_p50" in status
@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.bench_suite import make_llm, percentile, summarize
+from benchmarks.mock_server import MockConfig, MockServer
+from src.inference.pool import ConnectionPool
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from tests.conftest import entry
+
+MESSAGES = [HumanMessage("Hello")]
+PROVIDERS = ["openai", "groq", "mistral", "gemini", "ollama"]
+ANSWER = "token " * 20
+
+
+@pytest.mark.parametrize("provider", PROVIDERS)
+def test_every_adapter_invokes_and_streams(mock_server, provider):
+    llm = make_llm(mock_server, provider, "a", ConnectionPool())
+    answer = llm.invoke(MESSAGES)
+    assert answer.content == ANSWER
+    assert answer.usage
+    assert "".join(llm.stream(MESSAGES)) == ANSWER
+    assert mock_server.requests_by_model["a"] == 2
+
+
+@pytest.mark.parametrize("provider", PROVIDERS)
+def test_every_adapter_invokes_and_streams_async(mock_server, provider):
+    llm = make_llm(mock_server, provider, "a", ConnectionPool())
+
+    async def run():
+        answer = await llm.ainvoke(MESSAGES)
+        streamed = "".join([chunk async for chunk in llm.astream(MESSAGES)])
+        await llm.aclose()
+        return answer.content, streamed
+
+    assert asyncio.run(run()) == (ANSWER, ANSWER)
+
+
+def test_models_are_configured_separately():
+    with MockServer(MockConfig(chunks=2), models={"broken": MockConfig(error_rate=1.0, error_status=503)}) as server:
+        pool = ConnectionPool()
+        assert make_llm(server, "openai", "healthy", pool).invoke(MESSAGES).content == "token token "
+        with pytest.raises(httpx.HTTPStatusError) as error:
+            make_llm(server, "openai", "broken", pool).invoke(MESSAGES)
+        assert error.value.response.status_code == 503
+        server.configure("broken", error_rate=0.0)
+        assert make_llm(server, "openai", "broken", pool).invoke(MESSAGES).content == "token " * 20
+
+
+def test_broken_stream_fails_over_through_the_switcher(mock_server):
+    mock_server.configure("broken", fail_after_chunks=3)
+    pool = ConnectionPool()
+    switcher = LLMSwitcher([entry(make_llm(mock_server, "openai", "broken", pool), score=90),
+                            entry(make_llm(mock_server, "groq", "backup", pool), score=50)])
+    stream, model = switcher.stream_task(MESSAGES, "small")
+    assert model == "broken"
+    assert "".join(stream).startswith("token " * 3)
+    assert stream.models == ["broken", "backup"]
+
+
+def test_percentiles_and_summary():
+    samples = [i / 1000 for i in range(1, 101)]
+    assert percentile(samples, 0.5) == 0.051
+    assert percentile(samples, 0.99) == 0.1
+    summary = summarize(samples, wall=2.0)
+    assert summary["n"] == 100
+    assert summary["p50_ms"] == pytest.approx(51)
+    assert summary["throughput_rps"] == 50
@@ -0,0 +1,58 @@
+import asyncio
+
+from src.inference.groq import ChatGroq
+from src.inference.openai import ChatOpenAI
+from src.inference.pool import ConnectionPool
+from src.message import HumanMessage
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def test_adapters_share_one_client_per_origin(mock_server):
+    pool = ConnectionPool()
+    openai = ChatOpenAI(model="a", api_key="key", base_url=mock_server.urls("a")["openai"], pool=pool)
+    groq = ChatGroq(model="b", api_key="key", base_url=mock_server.urls("b")["groq"], pool=pool)
+    assert openai.client(openai.base_url) is groq.client(groq.base_url)
+    assert openai.client(openai.base_url) is not pool.client("http://127.0.0.1:1/v1")
+    pool.close()
+
+
+def test_sequential_requests_reuse_one_connection(mock_server):
+    pool = ConnectionPool()
+    llm = ChatOpenAI(model="a", api_key="key", base_url=mock_server.urls("a")["openai"], pool=pool)
+    for _ in range(5):
+        assert llm.invoke(MESSAGES).content
+        assert "".join(llm.stream(MESSAGES))
+    assert mock_server.requests == 10
+    assert len(mock_server._connections) == 1
+    pool.close()
+
+
+def test_closed_pool_reconnects_lazily(mock_server):
+    pool = ConnectionPool()
+    llm = ChatOpenAI(model="a", api_key="key", base_url=mock_server.urls("a")["openai"], pool=pool)
+    llm.invoke(MESSAGES)
+    client = llm.client(llm.base_url)
+    pool.close()
+    assert client.is_closed
+    assert llm.invoke(MESSAGES).content
+    assert llm.client(llm.base_url) is not client
+    pool.close()
+
+
+def test_async_clients_are_bound_to_their_loop(mock_server):
+    pool = ConnectionPool()
+    llm = ChatOpenAI(model="a", api_key="key", base_url=mock_server.urls("a")["openai"], pool=pool)
+
+    async def run():
+        results = await asyncio.gather(*(llm.ainvoke(MESSAGES) for _ in range(10)))
+        client = llm.async_client(llm.base_url)
+        assert client is llm.async_client(llm.base_url)
+        await pool.aclose()
+        return [result.content for result in results], client
+
+    first, first_client = asyncio.run(run())
+    second, second_client = asyncio.run(run())
+    assert all(first) and all(second)
+    assert first_client is not second_client
+    assert first_client.is_closed
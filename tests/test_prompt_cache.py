@@ -0,0 +1,114 @@
+import time
+
+from benchmarks.bench_suite import make_llm
+from src.inference.openai import ChatOpenAI
+from src.inference.pool import ConnectionPool
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage, SystemMessage
+from src.prompt_cache import ContextCache, PromptCache
+from tests.conftest import FakeLLM, entry
+
+SYSTEM = SystemMessage("You are a careful assistant. " * 100)
+
+
+def conversation(*turns: str) -> list:
+    messages = [SYSTEM]
+    for i, turn in enumerate(turns):
+        messages.append(HumanMessage(turn) if i % 2 == 0 else AIMessage(turn))
+    return messages
+
+
+def test_prefixes_are_the_system_prompt_and_the_history():
+    cache = PromptCache()
+    messages = conversation("Hi", "Hello", "How are you?")
+    assert [prefix.length for prefix in cache.prefixes(messages)] == [3, 1]
+    assert [prefix.length for prefix in cache.prefixes(conversation("Hi"))] == [1]
+    assert cache.prefixes([HumanMessage("Hi")]) == []
+    # The same content gives the same prefix
+    assert cache.prefixes(conversation("Hi"))[0] == cache.prefixes(conversation("Bye"))[0]
+
+
+def test_only_long_prefixes_are_stable_and_warm():
+    cache = PromptCache(ttl=0.1, min_tokens=100)
+    assert [prefix.length for prefix in cache.observe(conversation("Hi"), "openai")] == [1]
+    assert cache.warm_tokens(conversation("Another question")) > 100
+    assert PromptCache(min_tokens=100).observe([SystemMessage("Short"), HumanMessage("Hi")], "openai") == []
+    time.sleep(0.15)
+    assert cache.warm_tokens(conversation("Another question")) == 0
+
+
+def test_least_recently_used_prefixes_are_dropped():
+    cache = PromptCache(min_tokens=1, max_entries=2)
+    for i in range(3):
+        cache.observe([SystemMessage(f"Prompt {i}"), HumanMessage("Hi")], "openai")
+    assert cache.warm_tokens([SystemMessage("Prompt 0"), HumanMessage("Hi")]) == 0
+    assert cache.warm_tokens([SystemMessage("Prompt 2"), HumanMessage("Hi")]) > 0
+
+
+def test_openai_payload_carries_a_cache_key_for_stable_prefixes():
+    llm = ChatOpenAI("gpt", "key", prompt_cache=PromptCache(min_tokens=100))
+    payload = llm._payload(conversation("Hi"), prefixes=llm._observe_prefixes(conversation("Hi")))
+    assert len(payload["prompt_cache_key"]) == 32
+    assert "prompt_cache_key" not in llm._payload(conversation("Hi"))
+
+
+def test_context_cache_is_created_once_a_prefix_is_reused():
+    cache = ContextCache(ttl=1.0, min_tokens=100, min_uses=2)
+    assert cache.plan(conversation("One"), "gemini") is None
+    action, prefix, name = cache.plan(conversation("Two"), "gemini")
+    assert (action, name) == ("create", None)
+    # Creation is in flight: others go uncached instead of creating it again
+    assert cache.plan(conversation("Three"), "gemini") is None
+
+    cache.created(prefix, "cachedContents/a")
+    assert cache.plan(conversation("Four"), "gemini") == ("use", prefix, "cachedContents/a")
+    assert cache.warm_tokens(conversation("Five")) > 100
+    assert cache.take_names() == ["cachedContents/a"]
+    assert cache.warm_tokens(conversation("Six")) == 0
+
+
+def test_context_cache_is_refreshed_before_it_expires():
+    cache = ContextCache(ttl=0.2, min_tokens=100, min_uses=1)
+    _, prefix, _ = cache.plan(conversation("One"), "gemini")
+    cache.created(prefix, "cachedContents/a")
+    time.sleep(0.12)
+    assert cache.plan(conversation("Two"), "gemini") == ("refresh", prefix, "cachedContents/a")
+    assert cache.plan(conversation("Three"), "gemini")[0] == "use"
+    cache.refreshed(prefix)
+    assert cache.plan(conversation("Four"), "gemini")[0] == "use"
+
+
+def test_failed_or_dropped_context_cache_goes_uncached():
+    cache = ContextCache(ttl=60, min_tokens=100, min_uses=1)
+    _, prefix, _ = cache.plan(conversation("One"), "gemini")
+    cache.failed(prefix)
+    assert cache.plan(conversation("Two"), "gemini") is None
+
+    other = ContextCache(ttl=60, min_tokens=100, min_uses=1)
+    _, prefix, _ = other.plan(conversation("One"), "gemini")
+    other.created(prefix, "cachedContents/a")
+    other.forget("cachedContents/a")
+    assert other.warm_tokens(conversation("Two")) == 0
+
+
+def test_gemini_creates_uses_and_deletes_a_context_cache(mock_server):
+    llm = make_llm(mock_server, "gemini", "a", ConnectionPool())
+    llm.prompt_cache = ContextCache(min_tokens=100, min_uses=2)
+    for turn in ("One", "Two", "Three"):
+        assert llm.invoke(conversation(turn)).content
+    assert mock_server.cache_requests["POST"] == 1
+    llm.close()
+    assert mock_server.cache_requests["DELETE"] == 1
+
+
+def test_warm_prefix_makes_a_model_cheaper():
+    warm = FakeLLM("warm")
+    warm.prompt_cache = PromptCache(min_tokens=100)
+    warm.prompt_cache.observe(conversation("Hi"), "openai")
+    cold = FakeLLM("cold")
+    cold.prompt_cache = PromptCache(min_tokens=100)
+    switcher = LLMSwitcher([entry(cold, price=0.002, cached_price_per_1k_tokens=0.0001),
+                            entry(warm, price=0.002, cached_price_per_1k_tokens=0.0001)])
+    ranked = switcher.rank_llms("small", conversation("Another question"))
+    assert [s["llm"].model for s in ranked] == ["warm", "cold"]
+    assert ranked[0]["estimated_cost"] < ranked[1]["estimated_cost"]
@@ -0,0 +1,115 @@
+import calendar
+import threading
+
+import src.quota
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from src.quota import QuotaLedger, window_id
+from tests.conftest import FakeLLM, entry
+
+
+def test_window_ids():
+    now = calendar.timegm((2026, 3, 31, 23, 59, 0))
+    assert window_id(None, now) == "all"
+    assert window_id("daily", now) == f"d{now // 86400}"
+    assert window_id("daily", now + 60) != window_id("daily", now)
+    assert window_id("monthly", now) == "m2026-03"
+    assert window_id("monthly", now + 60) == "m2026-04"
+
+
+def test_in_memory_ledger_counts_down():
+    ledger = QuotaLedger()
+    ledger.register("groq:a", 1000, "Groq")
+    ledger.register("groq:a", 5, "Groq")
+    assert ledger.remaining("groq:a") == 1000
+    assert ledger.consume("groq:a", 300) == 700
+    assert ledger.consume("groq:a", 900) == 0
+    assert ledger.remaining("unknown") == 0
+
+
+def test_usage_resets_with_the_window(monkeypatch):
+    ledger = QuotaLedger(windows={"gemini": "daily"})
+    ledger.register("gemini:a", 1000, "Gemini")
+    ledger.register("groq:b", 1000, "Groq")
+    monkeypatch.setattr(src.quota, "window_id", lambda window, now=None: "d1" if window else "all")
+    ledger.consume("gemini:a", 400)
+    ledger.consume("groq:b", 400)
+    monkeypatch.setattr(src.quota, "window_id", lambda window, now=None: "d2" if window else "all")
+    assert ledger.remaining("gemini:a") == 1000
+    assert ledger.remaining("groq:b") == 600
+
+
+def test_usage_persists_across_restarts(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    ledger = QuotaLedger(path, flush_interval=60)
+    ledger.register("groq:a", 1000, "groq")
+    ledger.consume("groq:a", 250)
+    ledger.close()
+
+    reopened = QuotaLedger(path, flush_interval=60)
+    reopened.register("groq:a", 1000, "groq")
+    assert reopened.remaining("groq:a") == 750
+    reopened.close()
+
+
+def test_processes_sharing_a_file_see_each_others_usage(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    first, second = QuotaLedger(path, flush_interval=60), QuotaLedger(path, flush_interval=60)
+    for ledger in (first, second):
+        ledger.register("groq:a", 1000, "groq")
+    first.consume("groq:a", 100)
+    second.consume("groq:a", 200)
+    version = second.version
+    first.flush()
+    second.flush()
+    assert second.remaining("groq:a") == 700
+    assert second.version > version
+    first.flush()
+    assert first.remaining("groq:a") == 700
+    first.close()
+    second.close()
+
+
+def test_concurrent_consumers_lose_no_usage(tmp_path):
+    ledger = QuotaLedger(str(tmp_path / "quota.sqlite3"), flush_interval=0.01)
+    ledger.register("groq:a", 1_000_000, "groq")
+
+    def spend():
+        for _ in range(500):
+            ledger.consume("groq:a", 1)
+            ledger.remaining("groq:a")
+
+    threads = [threading.Thread(target=spend) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ledger.flush()
+    assert ledger.remaining("groq:a") == 1_000_000 - 4000
+    ledger.close()
+
+
+def test_closed_ledger_keeps_counting_in_memory(tmp_path):
+    ledger = QuotaLedger(str(tmp_path / "quota.sqlite3"))
+    ledger.register("groq:a", 1000, "groq")
+    ledger.close()
+    assert ledger.consume("groq:a", 10) == 990
+
+
+def test_switcher_routes_by_the_shared_ledger(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    free, paid = FakeLLM("free"), FakeLLM("paid")
+
+    def switcher():
+        return LLMSwitcher([entry(free, score=60, price=0.01, free=2000), entry(paid, score=90, price=0.001)],
+                           quota=QuotaLedger(path, flush_interval=60))
+
+    first = switcher()
+    assert first.invoke_task([HumanMessage("Hello")], "small")[1] == "free"
+    first.quota.consume(first._quota_key(first.llms[0]), 2000)
+    first.quota.close()
+
+    second = switcher()
+    assert second.llms[0]["free_limit_tokens"] == 0
+    assert second.invoke_task([HumanMessage("Hello")], "small")[1] == "paid"
+    second.quota.close()
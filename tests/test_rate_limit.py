@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src.hedging import HedgePolicy
+from src.inference import error_message
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from src.rate_limit import RateLimiter, TokenBucket
+from src.telemetry import Telemetry
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def rate_limited(retry_after: str = "5") -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return httpx.HTTPStatusError("429 Too Many Requests", request=request, response=response)
+
+
+def test_bucket_refills_continuously():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+    # Larger than the bucket: waits for a full bucket instead of forever
+    assert bucket.wait_time(1000, now + 60) == 0.0
+    bucket.block(10, now + 60)
+    assert bucket.wait_time(1, now + 61) == pytest.approx(9.0)
+
+
+def test_requests_and_tokens_are_limited_per_model():
+    limiter = RateLimiter()
+    model = entry(FakeLLM("a"), rpm=2, tpm=1000)
+    assert limiter.try_acquire(model, 400)
+    assert not limiter.try_acquire(model, 700)
+    assert limiter.try_acquire(model, 100)
+    assert not limiter.try_acquire(model, 1)
+    assert limiter.wait_time(model, 1) > 0
+    assert limiter.try_acquire(entry(FakeLLM("b"), rpm=2), 1000)
+
+
+def test_provider_limits_are_shared_by_its_models():
+    limiter = RateLimiter({"fake": {"rpm": 2}})
+    a, b = entry(FakeLLM("a")), entry(FakeLLM("b"))
+    assert limiter.try_acquire(a, 1)
+    assert limiter.try_acquire(b, 1)
+    assert not limiter.try_acquire(a, 1)
+    assert not limiter.try_acquire(b, 1)
+
+
+def test_acquire_waits_for_room_or_gives_up():
+    limiter = RateLimiter()
+    model = entry(FakeLLM("a"), tpm=6000)
+    assert limiter.try_acquire(model, 6000)
+    assert not limiter.acquire(model, 600, timeout=1.0)
+    started = time.perf_counter()
+    assert limiter.acquire(model, 10, timeout=1.0)
+    assert 0.05 < time.perf_counter() - started < 0.5
+    assert asyncio.run(limiter.aacquire(model, 10, timeout=1.0))
+
+
+def test_penalize_blocks_models_without_configured_limits():
+    limiter = RateLimiter()
+    model = entry(FakeLLM("a"))
+    assert limiter.try_acquire(model, 100)
+    limiter.penalize(model, 5)
+    assert not limiter.try_acquire(model, 1)
+    assert limiter.wait_time(model, 1) == pytest.approx(5, abs=0.1)
+
+
+def test_switcher_routes_around_a_limited_model():
+    best, other = FakeLLM("best"), FakeLLM("other")
+    switcher = LLMSwitcher([entry(best, score=90, rpm=1), entry(other, score=50)], rate_limiter=RateLimiter())
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "best"
+    started = time.perf_counter()
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "other"
+    assert time.perf_counter() - started < 0.5
+
+
+def test_switcher_waits_when_every_model_is_limited():
+    spans = []
+    model = entry(FakeLLM("a"), rpm=120)
+    switcher = LLMSwitcher([model], rate_limiter=RateLimiter(), telemetry=Telemetry([spans.append]))
+    while switcher.rate_limiter.try_acquire(model, 1):
+        pass
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "a"
+    assert spans[0]["queue_wait_s"] > 0.1
+
+
+def test_switcher_gives_up_after_rate_limit_wait():
+    model = entry(FakeLLM("a"), rpm=1)
+    switcher = LLMSwitcher([model], rate_limiter=RateLimiter(), rate_limit_wait=0.1)
+    switcher.invoke_task(MESSAGES, "small")
+    with pytest.raises(RuntimeError, match="All suitable LLMs failed"):
+        switcher.invoke_task(MESSAGES, "small")
+
+
+def test_429_backs_the_model_off_without_hurting_its_health():
+    limited, backup = FakeLLM("limited", errors=(rate_limited(),)), FakeLLM("backup")
+    switcher = LLMSwitcher([entry(limited, score=90), entry(backup, score=50)], rate_limiter=RateLimiter())
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+    assert len(limited.calls) == 1
+    assert switcher.rate_limiter.wait_time(switcher.llms[0], 1) == pytest.approx(5, abs=0.2)
+    assert "fake:limited" not in switcher.health_status()
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+
+
+def test_hedge_backup_spends_no_tokens_unless_it_is_sent():
+    primary, backup = FakeLLM("primary"), FakeLLM("backup")
+    backup_entry = entry(backup, score=50, rpm=1)
+    switcher = LLMSwitcher([entry(primary, score=90), backup_entry], hedge=HedgePolicy(delay=0.5), rate_limiter=RateLimiter())
+    for _ in range(5):
+        assert switcher.invoke_task(MESSAGES, "small")[1] == "primary"
+    assert not backup.calls
+    assert switcher.rate_limiter.try_acquire(backup_entry, 1)
+
+
+def test_hedge_never_waits_for_a_limited_backup():
+    primary, backup = FakeLLM("primary", delay=0.3), FakeLLM("backup")
+    backup_entry = entry(backup, score=50, rpm=1)
+    switcher = LLMSwitcher([entry(primary, score=90), backup_entry], hedge=HedgePolicy(delay=0.05), rate_limiter=RateLimiter())
+    switcher.rate_limiter.try_acquire(backup_entry, 1)
+    started = time.perf_counter()
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "primary"
+    assert time.perf_counter() - started < 1.0
+    assert not backup.calls
+
+
+def test_error_message_reads_json_errors_and_keeps_other_bodies():
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    assert error_message(httpx.Response(429, json={"error": {"message": "Slow down"}}, request=request)) == "Slow down"
+    assert error_message(httpx.Response(502, text="<html>Bad gateway</html>", request=request)) == "<html>Bad gateway</html>"
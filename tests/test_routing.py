@@ -0,0 +1,86 @@
+import pytest
+
+from benchmarks.bench_routing import TASKS, legacy_rank, make_llms
+from src.routing import RankedCandidates, RankedLLM, RoutingIndex
+from tests.conftest import FakeLLM, entry
+
+
+def models(ranked) -> list[str]:
+    return [selected["llm"].model for selected in ranked]
+
+
+@pytest.mark.parametrize("token_estimate", [100, 5_000, 200_000])
+def test_index_ranks_like_a_full_sort(token_estimate):
+    llms = make_llms(300)
+    index = RoutingIndex(llms)
+    for task_type in TASKS:
+        ranked = list(index.rank(task_type, lambda entry: token_estimate))
+        expected = legacy_rank(llms, task_type, token_estimate)
+        assert [view.rank_score for view in ranked] == pytest.approx([view["rank_score"] for view in expected])
+        assert [view.estimated_cost for view in ranked] == pytest.approx([view["estimated_cost"] for view in expected])
+
+
+def test_unknown_task_type_raises():
+    index = RoutingIndex([entry(FakeLLM("a"))])
+    assert index.task_types() == {"small"}
+    with pytest.raises(RuntimeError, match="No LLM available"):
+        index.rank("video", lambda entry: 100)
+
+
+def test_price_update_moves_the_entry():
+    cheap, pricey = entry(FakeLLM("cheap"), price=0.001), entry(FakeLLM("pricey"), price=0.01)
+    index = RoutingIndex([cheap, pricey])
+    assert models(index.rank("small", lambda e: 1000)) == ["cheap", "pricey"]
+    index.update(cheap, price_per_1k_tokens=0.1)
+    assert models(index.rank("small", lambda e: 1000)) == ["pricey", "cheap"]
+
+
+def test_free_quota_ranks_first_until_it_runs_out():
+    paid, free = entry(FakeLLM("paid"), score=95, price=0.001), entry(FakeLLM("free"), score=60, price=0.01, free=5000)
+    index = RoutingIndex([paid, free])
+    ranked = list(index.rank("small", lambda e: 1000))
+    assert models(ranked) == ["free", "paid"]
+    assert ranked[0].estimated_cost == 0.0
+    index.consume(free, 4500)
+    assert free["free_limit_tokens"] == 500
+    assert models(index.rank("small", lambda e: 1000)) == ["paid", "free"]
+    index.set_quota(free, 0)
+    assert models(index.rank("small", lambda e: 1000)) == ["paid", "free"]
+    index.set_quota(free, 5000)
+    assert models(index.rank("small", lambda e: 1000)) == ["free", "paid"]
+
+
+def test_penalties_demote_unhealthy_models():
+    good, flaky = entry(FakeLLM("good"), score=80), entry(FakeLLM("flaky"), score=90)
+    index = RoutingIndex([good, flaky])
+    assert models(index.rank("small", lambda e: 1000)) == ["flaky", "good"]
+    assert models(index.rank("small", lambda e: 1000, {id(flaky): 0.5})) == ["good", "flaky"]
+
+
+def test_candidates_are_scored_lazily_and_replayed():
+    produced = []
+
+    def source():
+        for i in range(5):
+            produced.append(i)
+            yield RankedLLM(entry(FakeLLM(str(i))), 5 - i, 0.0, 100)
+
+    ranked = RankedCandidates(source())
+    assert ranked
+    assert produced == [0]
+    assert ranked[1]["llm"].model == "1"
+    assert produced == [0, 1]
+    assert len(ranked) == 5
+    assert models(ranked) == ["0", "1", "2", "3", "4"]
+    assert models(ranked) == ["0", "1", "2", "3", "4"]
+
+
+def test_ranked_views_read_and_write_through_to_the_entry():
+    config = entry(FakeLLM("a"))
+    view = RankedLLM(config, 1.0, 0.5, 100)
+    assert view["benchmark_score"] == 90
+    assert view["estimated_cost"] == 0.5
+    view["benchmark_score"] = 70
+    assert config["benchmark_score"] == 70
+    assert "estimated_cost" not in config
+    assert view.get("missing", "default") == "default"
@@ -0,0 +1,94 @@
+import time
+
+import numpy as np
+
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage, ImageMessage, SystemMessage
+from src.semantic_cache import HashingEmbedder, SemanticCache
+from tests.conftest import FakeLLM, entry
+
+SYSTEM = SystemMessage("You are a helpful assistant. " * 20)
+
+
+def ask(question: str, system: SystemMessage = SYSTEM) -> list:
+    return [system, HumanMessage(question)]
+
+
+def test_embeddings_are_normalized_and_ignore_case_and_punctuation():
+    embedder = HashingEmbedder()
+    a = embedder.embed("What is the capital of France?")
+    b = embedder.embed("what is the capital of france")
+    assert abs(float(np.linalg.norm(a)) - 1.0) < 1e-6
+    assert float(a @ b) > 0.999
+    assert float(a @ embedder.embed("Write a poem about the sea")) < 0.5
+
+
+def test_near_duplicate_question_hits():
+    cache = SemanticCache(threshold=0.9)
+    cache.store(ask("What is the capital of France?"), "small", "a", "Paris")
+    assert cache.lookup(ask("what is the capital of France"), "small") == ("Paris", "a")
+    assert cache.lookup(ask("How do I bake bread?"), "small") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_shared_system_prompt_does_not_make_questions_alike():
+    cache = SemanticCache(threshold=0.9)
+    cache.store(ask("What is the capital of France?"), "small", "a", "Paris")
+    assert cache.lookup(ask("What is the capital of Spain?"), "small") is None
+
+
+def test_hits_are_scoped_to_context_task_type_and_json_mode():
+    cache = SemanticCache(threshold=0.9)
+    question = "What is the capital of France?"
+    cache.store(ask(question), "small", "a", "Paris")
+    assert cache.lookup(ask(question, SystemMessage("Answer in French.")), "small") is None
+    assert cache.lookup([SYSTEM, HumanMessage("Hi"), AIMessage("Hello!"), HumanMessage(question)], "small") is None
+    assert cache.lookup(ask(question), "medium") is None
+    assert cache.lookup(ask(question), "small", json_output=True) is None
+    assert cache.lookup(ask(question), "small") == ("Paris", "a")
+
+
+def test_expired_entries_miss(monkeypatch):
+    cache = SemanticCache(ttl=10)
+    cache.store(ask("Hello there"), "small", "a", "Hi")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.lookup(ask("Hello there"), "small") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_replaced_when_full():
+    cache = SemanticCache(max_entries=2)
+    cache.store(ask("first question"), "small", "a", 1)
+    cache.store(ask("second question"), "small", "a", 2)
+    cache.lookup(ask("first question"), "small")
+    cache.store(ask("third question"), "small", "a", 3)
+    assert cache.lookup(ask("first question"), "small") == (1, "a")
+    assert cache.lookup(ask("second question"), "small") is None
+
+
+def test_images_are_never_cached():
+    cache = SemanticCache()
+    messages = [ImageMessage("What is this?", image_base_64="aGVsbG8=")]
+    cache.store(messages, "small", "a", "a cat")
+    assert cache.lookup(messages, "small") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "semantic.npz")
+    cache = SemanticCache(snapshot_path=path)
+    cache.store(ask("What is the capital of France?"), "small", "a", "Paris")
+    cache.save()
+    restored = SemanticCache(snapshot_path=path)
+    assert restored.lookup(ask("What is the capital of France?"), "small") == ("Paris", "a")
+
+
+def test_switcher_serves_a_rephrased_prompt_without_calling_a_model():
+    llm = FakeLLM("a", reply="Paris")
+    switcher = LLMSwitcher([entry(llm)], semantic_cache=SemanticCache(threshold=0.9))
+    switcher.invoke_task(ask("What is the capital of France?"), "small")
+    content, model, cost, reason = switcher.invoke_task(ask("what is the capital of france"), "small")
+    assert (content, model, cost) == ("Paris", "a", 0.0)
+    assert "semantic cache" in reason
+    assert len(llm.calls) == 1
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from src.inference.stream_parser import SSEDecoder, aiter_ndjson, aiter_sse, iter_ndjson, iter_sse, parse_json
+
+BODY = (b": ping\n\n"
+        b"data: {\"a\": 1}\n\n"
+        b"event: message\ndata: {\"b\": \"\xc3\xa9\"}\n\n"
+        b"data: first\ndata:second\n\n"
+        b"data: [DONE]\n\n")
+EVENTS = [b"{\"a\": 1}", b"{\"b\": \"\xc3\xa9\"}", b"first\nsecond"]
+
+
+def splits(body: bytes):
+    for at in range(1, len(body)):
+        yield [body[:at], body[at:]]
+
+
+def pieces(body: bytes, size: int) -> list[bytes]:
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+async def agen(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def acollect(iterator) -> list[bytes]:
+    async def run():
+        return [item async for item in iterator]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n"])
+def test_events_split_at_every_byte_boundary(newline):
+    body = BODY.replace(b"\n", newline)
+    for chunks in splits(body):
+        assert list(iter_sse(chunks)) == EVENTS
+    assert list(iter_sse(pieces(body, 1))) == EVENTS
+    assert list(iter_sse(pieces(body, 7))) == EVENTS
+
+
+def test_payloads_decode_as_utf8_json():
+    assert parse_json(EVENTS[1]) == {"b": "é"}
+
+
+def test_done_stops_the_events_and_drains_the_body():
+    read = []
+
+    def body():
+        for chunk in (b"data: 1\n\ndata: [DONE]\n\n", b"data: 2\n\n", b""):
+            read.append(chunk)
+            yield chunk
+
+    assert list(iter_sse(body())) == [b"1"]
+    assert len(read) == 3
+
+
+def test_last_event_is_kept_without_a_trailing_blank_line():
+    assert list(iter_sse([b"data: 1\n\ndata: 2"])) == [b"1", b"2"]
+    assert list(iter_sse([b"data: 1\r\n\r\ndata: 2\r\n"])) == [b"1", b"2"]
+    assert list(iter_sse([b"data: [DONE]"])) == []
+
+
+def test_decoder_carries_an_incomplete_event():
+    decoder = SSEDecoder()
+    assert decoder.feed(b"data: par") == []
+    assert decoder.feed(b"tial\n") == []
+    assert decoder.feed(b"\ndata: next\n\n") == [b"partial", b"next"]
+    assert decoder.flush() == []
+
+
+def test_ndjson_lines_split_across_reads():
+    body = b"{\"a\": 1}\n\n{\"b\": 2}\r\n{\"c\": 3}"
+    for chunks in splits(body):
+        assert [parse_json(line) for line in iter_ndjson(chunks)] == [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+def test_async_events_split_at_every_byte_boundary():
+    for chunks in splits(BODY.replace(b"\n", b"\r\n")):
+        assert acollect(aiter_sse(agen(chunks))) == EVENTS
+
+
+def test_async_done_drains_the_body():
+    read = []
+
+    async def body():
+        for chunk in (b"data: 1\n\ndata: [DONE]\n\n", b"data: 2\n\n"):
+            read.append(chunk)
+            yield chunk
+
+    assert acollect(aiter_sse(body())) == [b"1"]
+    assert len(read) == 2
+
+
+def test_async_ndjson():
+    assert acollect(aiter_ndjson(agen([b"{\"a\"", b": 1}\n{\"b\": 2}"]))) == [b"{\"a\": 1}", b"{\"b\": 2}"]
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.llm_switcher import LLMSwitcher
+from src.message import AIMessage, HumanMessage
+from src.streaming import CONTINUE_PROMPT, StreamTimeout, _Pump
+from src.telemetry import Telemetry
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def switcher(*llms: FakeLLM, **options) -> LLMSwitcher:
+    return LLMSwitcher([entry(llm, score=90 - i) for i, llm in enumerate(llms)], **options)
+
+
+def astream(switcher: LLMSwitcher, **options) -> tuple[str, list[str]]:
+    async def run():
+        stream, _ = await switcher.astream_task(MESSAGES, "small", **options)
+        text = "".join([chunk async for chunk in stream])
+        return text, stream.models
+
+    return asyncio.run(run())
+
+
+def test_error_before_the_first_token_fails_over_silently():
+    broken, backup = FakeLLM("broken", errors=(ConnectionError("refused"),) * 5), FakeLLM("backup")
+    stream, model = switcher(broken, backup, max_retries=1).stream_task(MESSAGES, "small")
+    assert model == "backup"
+    assert "".join(stream) == "Hello, world"
+    assert stream.models == ["backup"]
+
+
+def test_silent_model_fails_over_after_the_first_token_timeout():
+    silent, backup = FakeLLM("silent", stall_after=0), FakeLLM("backup")
+    started = time.perf_counter()
+    stream, model = switcher(silent, backup).stream_task(MESSAGES, "small", first_token_timeout=0.1)
+    assert model == "backup"
+    assert time.perf_counter() - started < 1.0
+    assert len(silent.calls) == 1
+    silent.release.set()
+
+
+def test_break_after_the_first_token_resumes_on_the_next_model():
+    broken = FakeLLM("broken", chunks=("The answer", " is", " 42"), break_after=1)
+    backup = FakeLLM("backup", chunks=(" is", " 42."))
+    stream, model = switcher(broken, backup).stream_task(MESSAGES, "small")
+    assert model == "broken"
+    assert "".join(stream) == "The answer is 42."
+    assert stream.models == ["broken", "backup"]
+    resumed = backup.calls[0]
+    assert isinstance(resumed[-2], AIMessage) and resumed[-2].content == "The answer"
+    assert resumed[-1].content == CONTINUE_PROMPT
+
+
+def test_stall_after_the_first_token_resumes_on_the_next_model():
+    stalled = FakeLLM("stalled", chunks=("Part one", " never sent"), stall_after=1)
+    backup = FakeLLM("backup", chunks=(" and part two",))
+    stream, _ = switcher(stalled, backup).stream_task(MESSAGES, "small", stall_timeout=0.1)
+    assert "".join(stream) == "Part one and part two"
+    assert stream.models == ["stalled", "backup"]
+    stalled.release.set()
+
+
+def test_break_without_resume_raises():
+    broken = FakeLLM("broken", chunks=("The answer", " is"), break_after=1)
+    stream, _ = switcher(broken, FakeLLM("backup")).stream_task(MESSAGES, "small", resume=False)
+    assert next(stream) == "The answer"
+    with pytest.raises(ConnectionError):
+        next(stream)
+
+
+def test_every_model_failing_raises():
+    llms = [FakeLLM(name, errors=(ConnectionError("refused"),) * 5) for name in ("a", "b")]
+    with pytest.raises(RuntimeError, match="All suitable LLMs failed"):
+        switcher(*llms, max_retries=1).stream_task(MESSAGES, "small")
+
+
+def test_stream_span_counts_the_failover():
+    spans = []
+    broken = FakeLLM("broken", chunks=("The answer", " is"), break_after=1)
+    stream, _ = switcher(broken, FakeLLM("backup"), telemetry=Telemetry([spans.append])).stream_task(MESSAGES, "small")
+    "".join(stream)
+    assert spans[0]["status"] == "ok"
+    assert spans[0]["failovers"] == 1
+    assert spans[0]["model"] == "backup"
+    assert spans[0]["ttft_s"] is not None
+
+
+def test_async_error_before_the_first_token_fails_over():
+    broken, backup = FakeLLM("broken", errors=(ConnectionError("refused"),) * 5), FakeLLM("backup")
+    assert astream(switcher(broken, backup, max_retries=1)) == ("Hello, world", ["backup"])
+
+
+def test_async_silent_model_fails_over_after_the_first_token_timeout():
+    silent, backup = FakeLLM("silent", stall_after=0), FakeLLM("backup")
+    assert astream(switcher(silent, backup), first_token_timeout=0.1) == ("Hello, world", ["backup"])
+
+
+def test_async_break_after_the_first_token_resumes():
+    broken = FakeLLM("broken", chunks=("The answer", " is", " 42"), break_after=1)
+    backup = FakeLLM("backup", chunks=(" is", " 42."))
+    assert astream(switcher(broken, backup)) == ("The answer is 42.", ["broken", "backup"])
+    assert backup.calls[0][-1].content == CONTINUE_PROMPT
+
+
+def test_async_stall_after_the_first_token_resumes():
+    stalled = FakeLLM("stalled", chunks=("Part one", " never sent"), stall_after=1)
+    backup = FakeLLM("backup", chunks=(" and part two",))
+    assert astream(switcher(stalled, backup), stall_timeout=0.1) == ("Part one and part two", ["stalled", "backup"])
+
+
+def test_pump_times_out_and_stops_reading_an_abandoned_stream():
+    release = threading.Event()
+    produced = []
+    closed = threading.Event()
+
+    class Stream:
+        def __iter__(self):
+            for i in range(1000):
+                produced.append(i)
+                yield "x"
+                if i == 0:
+                    release.wait(5)
+
+        def close(self):
+            closed.set()
+
+    pump = _Pump(Stream, max_chunks=4)
+    chunks = pump.chunks(first_token_timeout=1.0, stall_timeout=0.05)
+    assert next(chunks) == "x"
+    with pytest.raises(StreamTimeout, match="stalled"):
+        next(chunks)
+    pump.cancel()
+    release.set()
+    assert closed.wait(2)
+    # The bounded queue stopped the reader long before the stream ended
+    assert len(produced) < 10
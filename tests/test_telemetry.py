@@ -0,0 +1,129 @@
+import json
+import urllib.request
+
+import pytest
+
+from benchmarks.bench_suite import make_llm
+from src.inference.pool import ConnectionPool
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage
+from src.telemetry import JSONLSink, PrometheusExporter, Telemetry, current_span
+from tests.conftest import FakeLLM, entry
+
+MESSAGES = [HumanMessage("Hello")]
+
+
+def traced(*llms: FakeLLM, **options) -> tuple[LLMSwitcher, list[dict]]:
+    spans = []
+    switcher = LLMSwitcher([entry(llm, score=90 - i) for i, llm in enumerate(llms)],
+                           telemetry=Telemetry([spans.append]), **options)
+    return switcher, spans
+
+
+def test_span_counts_retries_and_failovers():
+    flaky = FakeLLM("flaky", errors=(ValueError("boom"),) * 2)
+    switcher, spans = traced(flaky, FakeLLM("backup"), max_retries=2)
+    assert switcher.invoke_task(MESSAGES, "small")[1] == "backup"
+    [span] = spans
+    assert (span["operation"], span["task_type"], span["model"], span["status"]) == ("invoke", "small", "backup", "ok")
+    assert (span["retries"], span["failovers"], span["hedges"]) == (1, 1, 0)
+    assert span["errors"] == ["flaky: boom", "flaky: boom"]
+    assert span["latency_s"] > 0 and span["cost"] > 0
+    assert span["ttft_s"] is None
+
+
+def test_failed_request_ends_its_span_with_the_error():
+    switcher, spans = traced(FakeLLM("a", errors=(ValueError("boom"),)), max_retries=1)
+    with pytest.raises(RuntimeError):
+        switcher.invoke_task(MESSAGES, "small")
+    assert spans[0]["status"] == "error"
+    assert spans[0]["errors"][-1] == "All suitable LLMs failed for this task"
+
+
+def test_stream_span_ends_with_the_stream():
+    switcher, spans = traced(FakeLLM("a"))
+    stream, _ = switcher.stream_task(MESSAGES, "small")
+    assert not spans
+    "".join(stream)
+    assert spans[0]["operation"] == "stream"
+    assert 0 <= spans[0]["ttft_s"] <= spans[0]["latency_s"]
+
+
+def test_span_is_current_only_while_it_runs():
+    telemetry = Telemetry()
+    assert not current_span()
+    with telemetry.span("invoke", "small") as span:
+        assert current_span() is span
+    assert not current_span()
+
+
+def test_span_is_emitted_once():
+    spans = []
+    span = Telemetry([spans.append]).span("invoke", "small")
+    span.end()
+    span.end(ValueError("late"))
+    assert [s["status"] for s in spans] == ["coalesced"]
+
+
+def test_failing_sink_does_not_break_requests():
+    def broken(span):
+        raise ValueError("sink down")
+
+    spans = []
+    switcher = LLMSwitcher([entry(FakeLLM("a"))], telemetry=Telemetry([broken, spans.append]))
+    assert switcher.invoke_task(MESSAGES, "small")[0] == "ok"
+    assert len(spans) == 1
+
+
+def test_jsonl_sink_appends_one_line_per_span(tmp_path):
+    path = str(tmp_path / "spans.jsonl")
+    sink = JSONLSink(path)
+    switcher = LLMSwitcher([entry(FakeLLM("a"))], telemetry=Telemetry([sink]))
+    switcher.invoke_task(MESSAGES, "small")
+    switcher.invoke_task(MESSAGES, "small")
+    sink.close()
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["model"] for line in lines] == ["a", "a"]
+    assert lines[0]["request_id"] != lines[1]["request_id"]
+
+
+def test_prometheus_exporter_renders_counters_and_histograms():
+    exporter = PrometheusExporter(buckets=(0.1, 1.0))
+    for latency in (0.05, 0.1, 0.5, 3.0):
+        exporter({"operation": "invoke", "task_type": "small", "model": 'a"b', "status": "ok", "retries": 1,
+                  "failovers": 0, "hedges": 0, "tokens_in": 10, "tokens_out": 5, "cost": 0.001, "ranking_s": 0.0,
+                  "queue_wait_s": 0.0, "connect_s": 0.0, "ttft_s": None, "latency_s": latency})
+    text = exporter.render()
+    assert 'llm_router_requests_total{operation="invoke",task_type="small",model="a\\"b",status="ok"} 4' in text
+    assert 'llm_router_retries_total{task_type="small",model="a\\"b"} 4' in text
+    assert 'llm_router_tokens_total{task_type="small",model="a\\"b",direction="out"} 20' in text
+    assert 'llm_router_latency_seconds_bucket{task_type="small",model="a\\"b",le="0.1"} 2' in text
+    assert 'llm_router_latency_seconds_bucket{task_type="small",model="a\\"b",le="1.0"} 3' in text
+    assert 'llm_router_latency_seconds_bucket{task_type="small",model="a\\"b",le="+Inf"} 4' in text
+    assert 'llm_router_latency_seconds_sum{task_type="small",model="a\\"b"} 3.65' in text
+    assert 'llm_router_latency_seconds_count{task_type="small",model="a\\"b"} 4' in text
+    assert "llm_router_ttft_seconds_bucket" not in text
+
+
+def test_prometheus_exporter_serves_metrics():
+    exporter = PrometheusExporter()
+    switcher = LLMSwitcher([entry(FakeLLM("a"))], telemetry=Telemetry([exporter]))
+    switcher.invoke_task(MESSAGES, "small")
+    server = exporter.serve(port=0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'llm_router_requests_total{operation="invoke",task_type="small",model="a",status="ok"} 1' in body
+
+
+def test_connection_setup_is_timed_only_for_new_connections(mock_server):
+    spans = []
+    llm = make_llm(mock_server, "openai", "a", ConnectionPool(http2=False))
+    switcher = LLMSwitcher([entry(llm)], telemetry=Telemetry([spans.append]))
+    switcher.invoke_task(MESSAGES, "small")
+    switcher.invoke_task(MESSAGES, "small")
+    assert spans[0]["connect_s"] > 0
+    assert spans[1]["connect_s"] == 0
@@ -0,0 +1,63 @@
+from src.llm_switcher import LLMSwitcher
+from src.message import HumanMessage, ImageMessage, SystemMessage
+from src.tokenizer import (IMAGE_TOKENS, MESSAGE_OVERHEAD, count_message_tokens, count_prompt_tokens, count_text_tokens,
+                           family_of, usage_tokens)
+from tests.conftest import FakeLLM, entry
+
+
+def test_families_come_from_the_adapter_name():
+    llm = FakeLLM("a")
+    assert family_of(llm) == "openai"
+    llm.name = "Mistral"
+    assert family_of(llm) == "mistral"
+
+
+def test_text_tokens_grow_with_the_text():
+    assert count_text_tokens("") == 0
+    short, long = count_text_tokens("hello world", "llama"), count_text_tokens("hello world " * 100, "llama")
+    assert 0 < short < long
+    # Mistral's tokenizer packs fewer bytes into a token than Gemini's
+    assert count_text_tokens("x" * 700, "mistral") > count_text_tokens("x" * 700, "gemini")
+
+
+def test_prompt_tokens_add_message_overhead_and_priming():
+    messages = [SystemMessage("Be brief."), HumanMessage("Hello")]
+    expected = sum(MESSAGE_OVERHEAD["llama"] + count_text_tokens(m.content, "llama") for m in messages) + 3
+    assert count_prompt_tokens(messages, "llama") == expected
+
+
+def test_image_messages_count_a_fixed_image_cost():
+    message = ImageMessage("What is this?", image_base_64="aGVsbG8=")
+    text_only = MESSAGE_OVERHEAD["gemini"] + count_text_tokens("What is this?", "gemini")
+    assert count_message_tokens(message, "gemini") == text_only + IMAGE_TOKENS["gemini"]
+
+
+def test_message_counts_are_recomputed_when_content_changes():
+    message = HumanMessage("short")
+    before = count_message_tokens(message, "llama")
+    assert count_message_tokens(message, "llama") == before
+    message.content = "a much longer message than before " * 10
+    assert count_message_tokens(message, "llama") > before
+
+
+def test_usage_tokens():
+    assert usage_tokens(None) is None
+    assert usage_tokens({"total_tokens": 12}) == 12
+    assert usage_tokens({"prompt_tokens": 5, "completion_tokens": 7}) == 12
+    assert usage_tokens({"prompt_tokens": 0}) is None
+
+
+def test_estimates_count_the_prompt_with_the_models_tokenizer():
+    llm = FakeLLM("a", name="Mistral")
+    switcher = LLMSwitcher([entry(llm)])
+    messages = [HumanMessage("word " * 200)]
+    assert switcher.estimate_tokens(llm, messages, "small") == count_prompt_tokens(messages, "mistral") + 300
+    assert switcher.estimate_tokens(llm, messages, "small", completion_tokens=50) == count_prompt_tokens(messages, "mistral") + 50
+    assert switcher.estimate_tokens(llm, None, "heavy") == 3000
+
+
+def test_quota_is_charged_the_provider_reported_usage():
+    llm = FakeLLM("a", usage={"prompt_tokens": 100, "completion_tokens": 23, "total_tokens": 123})
+    switcher = LLMSwitcher([entry(llm, free=1000)])
+    switcher.invoke_task([HumanMessage("Hello")], "small")
+    assert switcher.quota.remaining(switcher._quota_key(switcher.llms[0])) == 877